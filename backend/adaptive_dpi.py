@@ -0,0 +1,57 @@
+import re
+from PIL import Image
+
+# Claude vision downsamples any image whose long edge exceeds ~1568px, so
+# rendering beyond that only costs render time and request payload
+TARGET_LONG_EDGE_PX = 1568
+
+MIN_DPI = 100
+MAX_FIRST_PASS_DPI = 200
+
+# Pages dense with ink (small print, tables) get at least DENSE_PAGE_DPI
+DENSE_INK_COVERAGE = 0.15
+DENSE_PAGE_DPI = 200
+
+# Resolution used when a first-pass result fails validation
+ESCALATION_DPI = 300
+
+POINTS_PER_INCH = 72
+DEFAULT_PAGE_SIZE_PTS = (612.0, 792.0)  # US letter
+
+def page_size_from_pdfinfo(info):
+    """
+    Parse the page size in points from pdf2image's pdfinfo dictionary.
+    """
+    match = re.match(r'\s*([\d.]+)\s*x\s*([\d.]+)', str(info.get('Page size', '')))
+    if not match:
+        return DEFAULT_PAGE_SIZE_PTS
+    return float(match.group(1)), float(match.group(2))
+
+def choose_dpi(page_size_pts, ink_coverage=None):
+    """
+    Pick a first-pass rendering DPI from the page dimensions and, when known,
+    the fraction of the page covered by ink.
+    """
+    long_edge_in = max(page_size_pts) / POINTS_PER_INCH
+    dpi = TARGET_LONG_EDGE_PX / max(long_edge_in, 1.0)
+
+    if ink_coverage is not None and ink_coverage >= DENSE_INK_COVERAGE:
+        dpi = max(dpi, DENSE_PAGE_DPI)
+
+    return int(min(max(dpi, MIN_DPI), MAX_FIRST_PASS_DPI))
+
+def needs_dense_rerender(dpi, ink_coverage):
+    """Whether a page rendered at dpi is dense enough to warrant more pixels"""
+    return ink_coverage >= DENSE_INK_COVERAGE and dpi < DENSE_PAGE_DPI
+
+def fit_long_edge(image, long_edge_px=TARGET_LONG_EDGE_PX):
+    """
+    Downscale a PIL image so its long edge is at most long_edge_px.
+
+    Returns the image unchanged when it is already small enough.
+    """
+    scale = long_edge_px / max(image.size)
+    if scale >= 1:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.BICUBIC)
@@ -1,6 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, send_file
 from flask_cors import CORS
+import csv
+import functools
+import json
 import os
+import ssl
+import time
 import uuid
 import tempfile
 from datetime import datetime
@@ -12,17 +17,148 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
-# Create upload folder
+# Upload folder, created when the first upload is saved
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 
-# Import the modules
-import expensereportextractor
-import llm_utils
-import requests
+# Import the modules. The ones that pull in boto3, numpy, PIL/pdf2image or
+# requests are imported inside the routes that use them (or by the warm-up),
+# so importing the app stays fast.
+import bedrock_pool
+import fx_rates
+import html_content
+import metrics
+import profiling
+import reconciliation
+import scheduler
+import single_flight
+import warmup
 from urllib.parse import urlparse
 
+DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
+
+# Render pool workers re-import this module as __mp_main__, and in debug the
+# reloader runs it as __main__ in a watcher process that only restarts the
+# server child (started with WERKZEUG_RUN_MAIN=true); only the server warms up
+_reloader_watcher = __name__ == '__main__' and DEBUG and os.getenv('WERKZEUG_RUN_MAIN') != 'true'
+if warmup.WARMUP_ENABLED and __name__ != '__mp_main__' and not _reloader_watcher:
+    warmup.start()
+
+def request_tenant():
+    """Tenant of the request (for fair scheduling, and whose receipts and expenses it sees): X-Tenant-Id, X-User-Id or the client address"""
+    return request.headers.get('X-Tenant-Id') or request.headers.get('X-User-Id') or request.remote_addr or scheduler.DEFAULT_TENANT
+
+def admitted(priority):
+    """
+    Run a route under scheduler admission for a priority class. When the
+    class (or the tenant's share of it) is full, or no LLM slot frees up in
+    time, respond 429 with Retry-After instead of queueing without bound.
+    """
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(*args, **kwargs):
+            try:
+                with scheduler.admit(priority, request_tenant()):
+                    return route(*args, **kwargs)
+            except scheduler.Overloaded as e:
+                return overloaded_response(e)
+        return wrapper
+    return decorator
+
+def overloaded_response(e):
+    """429 with Retry-After for a scheduler.Overloaded"""
+    response = jsonify({'error': str(e), 'retryAfter': e.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def client_connected():
+    """A check that the current request's client is still connected, or None where the server can't tell"""
+    sock = request.environ.get('werkzeug.socket')
+    if sock is None or isinstance(sock, ssl.SSLSocket):
+        # Can't peek below TLS
+        return None
+    return lambda: single_flight.socket_connected(sock)
+
+def coalesced(priority, kind, key, compute):
+    """
+    Run compute() under scheduler admission, once for concurrent identical
+    requests (same key): duplicates wait for the computation in flight and
+    share its result (see single_flight). Only the computation is admitted,
+    so waiting duplicates don't take other requests' capacity. May raise
+    scheduler.Overloaded or single_flight.Disconnected.
+    """
+    tenant = request_tenant()
+
+    def admitted_compute():
+        with scheduler.admit(priority, tenant):
+            return compute()
+
+    return single_flight.run(kind, key, admitted_compute, client_connected())
+
+@app.before_request
+def start_profile():
+    """Profile the request when an operator asked for it (see profiling)"""
+    if (profiling.PROFILE_TOKEN and not request.path.startswith('/profiles')
+            and profiling.requested(request.path, request.headers.get('X-Profile-Token'))):
+        g.profile = profiling.start(f"{request.method} {request.path}")
+
+@app.after_request
+def finish_profile(response):
+    session = g.pop('profile', None)
+    if session is not None:
+        session.stop(response.status_code)
+        response.headers['X-Profile-Id'] = session.id
+    return response
+
+@app.teardown_request
+def abandon_profile(error):
+    # Requests that raised skip after_request
+    session = g.pop('profile', None)
+    if session is not None:
+        session.stop(500)
+
+def profile_admin(route):
+    """Profile endpoints: 404 when profiling is off, 403 without the token"""
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        if not profiling.PROFILE_TOKEN:
+            return jsonify({'error': 'Profiling is disabled'}), 404
+        if not profiling.authorized(request.headers.get('X-Profile-Token')):
+            return jsonify({'error': 'Invalid profile token'}), 403
+        return route(*args, **kwargs)
+    return wrapper
+
+@app.route("/profiles", methods=['GET'])
+@profile_admin
+def list_profiles():
+    """Stored profiles, newest first, and the paths armed for profiling"""
+    return jsonify({'profiles': profiling.list_profiles(), 'armed': profiling.armed()})
+
+@app.route("/profiles", methods=['POST'])
+@profile_admin
+def arm_profile():
+    """Profile the next requests to a path: {"path": "/policyextractionfromdocument", "count": 1}"""
+    data = request.get_json(silent=True) or {}
+    path = data.get('path')
+    if not isinstance(path, str) or not path.startswith('/'):
+        return jsonify({'error': 'path must be a route path such as /expenseextractor'}), 400
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'count must be an integer'}), 400
+    return jsonify({'armed': profiling.arm(path, count)})
+
+@app.route("/profiles/<profile_id>", defaults={'artifact': 'summary.json'})
+@app.route("/profiles/<profile_id>/<artifact>")
+@profile_admin
+def download_profile(profile_id, artifact):
+    """A profile's summary or one of its artifacts (cpu.folded, allocations.txt, tracemalloc.snapshot)"""
+    path = profiling.artifact_path(profile_id, artifact)
+    if path is None:
+        return jsonify({'error': 'No such profile or artifact'}), 404
+    return send_file(path, mimetype=profiling.ARTIFACTS[artifact], as_attachment=artifact != 'summary.json',
+                     download_name=f"{profile_id}-{artifact}")
+
 @app.route("/")
 def health_check():
     """Health check endpoint"""
@@ -31,11 +167,42 @@ def health_check():
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route("/ready")
+def readiness_check():
+    """Readiness check: 503 until the warm-up (when enabled) has finished"""
+    status = warmup.status()
+    if not warmup.is_ready():
+        return jsonify(status), 503
+    return jsonify(status)
+
+@app.route("/metrics")
+def get_metrics():
+    """Counters and latency summaries collected since startup"""
+    return jsonify(metrics.snapshot())
+
+@app.route("/scheduler/status")
+def scheduler_status():
+    """Admitted requests and LLM slot usage per priority class"""
+    return jsonify(scheduler.get_scheduler().status())
+
+@app.route("/llm/tiers")
+def llm_tiers():
+    """Fast-model acceptance, escalations and latency per model tier"""
+    import expensereportextractor
+    return jsonify(expensereportextractor.tier_status())
+
+@app.route("/bedrock/status")
+def bedrock_status():
+    """Health and load of each endpoint in the Bedrock pool"""
+    return jsonify({'endpoints': bedrock_pool.get_pool().status()})
+
 @app.route("/expenseextractor", methods=['POST'])
 def extract_expense():
     """
-    Extract expense data from uploaded receipts (PDF/JPG)
+    Extract expense data from uploaded receipts (PDF/JPG). Identical uploads
+    in flight at the same time share one extraction.
     """
+    import expensereportextractor
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
@@ -51,30 +218,42 @@ def extract_expense():
         if file_type not in ['pdf', 'image']:
             return jsonify({'error': 'Invalid file type. Must be pdf or image'}), 400
 
-        # Generate a unique filename with appropriate extension
-        extension = 'pdf' if file_type == 'pdf' else 'jpg'
-        temp_filename = f"temp_{str(uuid.uuid4())}.{extension}"
-        temp_path = os.path.join(UPLOAD_FOLDER, temp_filename)
+        content = file.read()
+        filename = file.filename
 
-        try:
-            # Save the uploaded file temporarily
-            file.save(temp_path)
+        def extract():
+            # Generate a unique filename with appropriate extension
+            extension = 'pdf' if file_type == 'pdf' else 'jpg'
+            temp_filename = f"temp_{str(uuid.uuid4())}.{extension}"
+            temp_path = os.path.join(UPLOAD_FOLDER, temp_filename)
 
-            # Process based on file type
-            if file_type == 'pdf':
-                print("Processing PDF file")
-                jsonresponse = expensereportextractor.extractfields(temp_path, file_type='pdf')
-            else:
+            try:
+                # Save the uploaded file temporarily
+                os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+                with open(temp_path, 'wb') as f:
+                    f.write(content)
+
+                # Process based on file type
+                if file_type == 'pdf':
+                    print("Processing PDF file")
+                    return expensereportextractor.extractfields(temp_path, file_type='pdf', source=filename)
                 print("Processing image file")
-                jsonresponse = expensereportextractor.extractfields(temp_path, file_type='image')
-
-            return jsonresponse
-
-        finally:
-            # Clean up: remove temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-
+                return expensereportextractor.extractfields(temp_path, file_type='image', source=filename)
+
+            finally:
+                # Clean up: remove temporary file
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        # Per tenant: the result depends on the tenant's receipt index
+        key = single_flight.key('receipt', request_tenant(), content, file_type)
+        return coalesced(scheduler.INTERACTIVE, 'receipt', key, extract)
+
+    except scheduler.Overloaded as e:
+        return overloaded_response(e)
+    except single_flight.Disconnected as e:
+        # The client is gone; nothing will read this
+        return jsonify({'error': str(e)}), 499
     except Exception as e:
         print(f"Error in extract_expense: {str(e)}")
         return jsonify({
@@ -82,11 +261,13 @@ def extract_expense():
         }), 500
 
 @app.route("/policyextractionfromdocument", methods=['POST'])
+@admitted(scheduler.BULK)
 def policy_extraction_from_document():
     """
     Extract expense policies from uploaded policy documents
     """
     print("in policy_extraction_from_document")
+    import expensereportextractor
     try:
         # Check if the request has the file part
         if 'file' not in request.files:
@@ -135,6 +316,8 @@ def policy_extraction_from_document():
             }
         })
 
+    except scheduler.Overloaded:
+        raise
     except Exception as e:
         return jsonify({
             'error': f'Error processing document: {str(e)}',
@@ -144,8 +327,10 @@ def policy_extraction_from_document():
 @app.route("/expensepolicycheck", methods=['POST'])
 def expense_policy_check():
     """
-    Check if expenses comply with company policies
+    Check if expenses comply with company policies. Identical checks in
+    flight at the same time share one result.
     """
+    import expensereportextractor
     try:
         # Get the request data
         data = request.get_json()
@@ -155,6 +340,10 @@ def expense_policy_check():
                 'violations': [{'message': 'No data provided'}]
             }), 400
 
+        # Canonicalised (key order doesn't matter) before the fields are split
+        # off, and per tenant like the rule index the check reads
+        key = single_flight.key('compliance', request_tenant(), data)
+
         # Extract the policy rules and invoice data
         policy_rules = data.pop('policyRules', [])
         seniority = data.pop('seniority', None)
@@ -163,10 +352,15 @@ def expense_policy_check():
         print("seniority", seniority)
 
         # Pass both to the policy compliance checker
-        result = expensereportextractor.check_policy_compliance(seniority, extraction_results, policy_rules)
+        result = coalesced(scheduler.COMPLIANCE, 'compliance', key,
+                           lambda: expensereportextractor.check_policy_compliance(seniority, extraction_results, policy_rules))
 
         return jsonify(result)
 
+    except scheduler.Overloaded as e:
+        return overloaded_response(e)
+    except single_flight.Disconnected as e:
+        return jsonify({'error': str(e)}), 499
     except Exception as e:
         return jsonify({
             'isCompliant': False,
@@ -174,11 +368,14 @@ def expense_policy_check():
         }), 500
 
 @app.route("/policyextractionfromurl", methods=['POST'])
+@admitted(scheduler.BULK)
 def policy_extraction_from_url():
     """
     Extract expense policies from a web URL
     """
     print("in policy_extraction_from_url")
+    import expensereportextractor
+    import requests
     try:
         # Get the request data
         data = request.get_json()
@@ -230,7 +427,27 @@ def policy_extraction_from_url():
         # Extract text content from HTML or plain text
         content_type = response.headers.get('content-type', '').lower()
 
-        if 'html' in content_type:
+        text_content = None
+        if 'html' in content_type and html_content.HTML_CONTENT_EXTRACTION:
+            # Main content only, without menus, banners and footers
+            start = time.perf_counter()
+            try:
+                text_content = html_content.extract_main_text(html_content.decode(response.content, content_type))
+            except Exception as e:
+                # A page the extractor can't handle still has its full text
+                print(f"Main content extraction failed, using the full page text: {str(e)}")
+                metrics.increment('html_extract_fallbacks')
+            else:
+                metrics.observe('html_extract_seconds', time.perf_counter() - start)
+                print(f"Extracted {len(text_content)} characters of main content from {len(response.content)} bytes "
+                      f"of HTML in {time.perf_counter() - start:.3f}s")
+            if text_content is not None and len(text_content.strip()) < html_content.MIN_EXTRACTED_TEXT:
+                # Too little to be the policy: use the whole page text instead
+                print("Main content extraction found too little text, using the full page text")
+                metrics.increment('html_extract_fallbacks')
+                text_content = None
+
+        if text_content is None and 'html' in content_type:
             # For HTML content, extract text using simple parsing
             try:
                 from bs4 import BeautifulSoup
@@ -243,7 +460,7 @@ def policy_extraction_from_url():
                 # Fallback: simple HTML tag removal
                 import re
                 text_content = re.sub('<[^<]+?>', '', response.text)
-        else:
+        elif text_content is None:
             # Plain text content
             text_content = response.text
 
@@ -270,6 +487,8 @@ def policy_extraction_from_url():
             }
         })
 
+    except scheduler.Overloaded:
+        raise
     except Exception as e:
         print(f"Error in policy_extraction_from_url: {str(e)}")
         return jsonify({
@@ -277,8 +496,107 @@ def policy_extraction_from_url():
             'policies': []
         }), 500
 
+@app.route("/expenses", methods=['POST'])
+def add_expenses():
+    """
+    Store extracted expenses (a single object or a list) for aggregation
+    """
+    import expense_store
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No expenses provided'}), 400
+
+    expenses = data if isinstance(data, list) else [data]
+    try:
+        ids = expense_store.get_store().add_many(expenses, tenant=request_tenant())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'ids': ids, 'count': len(ids)})
+
+@app.route("/expenses/<expense_id>", methods=['DELETE'])
+def delete_expense(expense_id):
+    """Remove one of the caller's stored expenses"""
+    import expense_store
+    if not expense_store.get_store().remove(expense_id, tenant=request_tenant()):
+        return jsonify({'error': 'Expense not found'}), 404
+    return jsonify({'id': expense_id, 'deleted': True})
+
+@app.route("/expenses/summary")
+def expense_summary():
+    """
+    Spend grouped by category, department, currency or month, converted to
+    one currency. Query parameters: groupBy, startDate, endDate, currency,
+    category, department.
+    """
+    import expense_store
+    try:
+        return jsonify(expense_store.get_store().summary(
+            group_by=request.args.get('groupBy', 'category'),
+            start_date=request.args.get('startDate'),
+            end_date=request.args.get('endDate'),
+            currency=request.args.get('currency', fx_rates.BASE_CURRENCY),
+            category=request.args.get('category'),
+            department=request.args.get('department'),
+            tenant=request_tenant()
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route("/budgets/summary", methods=['POST'])
+def budgets_summary():
+    """
+    Spent and remaining amounts for budgets, per category and department
+    """
+    import expense_store
+    data = request.get_json()
+    if not data or not isinstance(data.get('budgets'), list):
+        return jsonify({'error': 'No budgets provided'}), 400
+
+    try:
+        budgets = expense_store.get_store().budget_summary(
+            data['budgets'],
+            currency=data.get('currency', fx_rates.BASE_CURRENCY),
+            tenant=request_tenant()
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'budgets': budgets})
+
+@app.route("/cardstatement/reconcile", methods=['POST'])
+def reconcile_card_statement():
+    """
+    Match a card statement (CSV/OFX upload) against extracted receipts.
+
+    Receipts default to the caller's stored expenses; a 'receipts' form
+    field (JSON list of {id, date, vendor, total, currency}) overrides them.
+    """
+    import expense_store
+    if 'file' not in request.files:
+        return jsonify({'error': 'No statement file provided'}), 400
+    file = request.files['file']
+
+    try:
+        if request.form.get('receipts'):
+            receipts = json.loads(request.form['receipts'])
+            if not isinstance(receipts, list):
+                return jsonify({'error': 'receipts must be a JSON list'}), 400
+        else:
+            receipts = expense_store.get_store().receipts(tenant=request_tenant())
+
+        start = time.perf_counter()
+        result = reconciliation.reconcile(reconciliation.iter_statement(file.stream, file.filename or ''), receipts)
+        result['summary']['seconds'] = round(time.perf_counter() - start, 3)
+        return jsonify(result)
+
+    except (ValueError, csv.Error) as e:
+        return jsonify({'error': f'Invalid statement: {str(e)}'}), 400
+    except Exception as e:
+        print(f"Error in reconcile_card_statement: {str(e)}")
+        return jsonify({'error': f'Error reconciling statement: {str(e)}'}), 500
+
 if __name__ == '__main__':
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', 3042))
-    debug = os.getenv('DEBUG', 'True').lower() == 'true'
-    app.run(host=host, port=port, debug=debug)
\ No newline at end of file
+    app.run(host=host, port=port, debug=DEBUG)
\ No newline at end of file
@@ -0,0 +1,295 @@
+"""
+Re-extract an archive of receipts with extractfields.
+
+Walks a directory for PDF/JPEG/PNG receipts, or reads a manifest listing
+one path per line, and runs each file through
+expensereportextractor.extractfields. Concurrency is bounded, and the
+request rate is capped and halved whenever Bedrock throttles. Results are
+appended to a JSONL file, one object per receipt. Progress is checkpointed
+in SQLite next to the output, so an interrupted run resumes where it
+stopped without redoing work or duplicating lines. Receipts finished with
+an older extraction prompt are redone. Run from the backend directory:
+
+    python backfill.py /archive/receipts --output receipts.jsonl --concurrency 16 --rate 8
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+RECEIPT_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png')
+
+# Errors that mean "slow down" rather than "this receipt failed"
+THROTTLE_MARKERS = ('ThrottlingException', 'TooManyRequests', 'Too many requests', 'ServiceQuotaExceeded')
+
+class RateLimiter:
+    """
+    Spaces request starts at most rate per second. The rate halves on
+    throttling and climbs back to max_rate by a small step per success.
+    """
+
+    def __init__(self, max_rate, min_rate=0.1):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + 1 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+class Checkpoint:
+    """
+    SQLite record of finished receipts and of how much of the output file
+    holds committed results.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS receipts ("
+            " path TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL,"
+            " prompt TEXT NOT NULL,"
+            " error TEXT,"
+            " updated TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS output (path TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        self._db.commit()
+
+    def finished(self, prompt, max_attempts):
+        """Paths done with this prompt, or that have failed max_attempts times with it"""
+        rows = self._db.execute(
+            "SELECT path FROM receipts WHERE prompt = ? AND (status = 'done' OR attempts >= ?)",
+            (prompt, max_attempts)
+        )
+        return {path for (path,) in rows}
+
+    def attempts(self, prompt):
+        rows = self._db.execute("SELECT path, attempts FROM receipts WHERE prompt = ? AND status = 'failed'", (prompt,))
+        return dict(rows)
+
+    def output_size(self, output_path):
+        row = self._db.execute("SELECT size FROM output WHERE path = ?", (output_path,)).fetchone()
+        return row[0] if row else None
+
+    def commit(self, records, output_path, output_size):
+        """Record (path, status, attempts, prompt, error) rows and the output size in one transaction"""
+        now = datetime.now().isoformat()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO receipts (path, status, attempts, prompt, error, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                [record + (now,) for record in records]
+            )
+            self._db.execute("INSERT OR REPLACE INTO output (path, size) VALUES (?, ?)", (output_path, output_size))
+
+def receipt_paths(source):
+    """Receipt files under a directory, or the paths listed in a manifest file"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(RECEIPT_EXTENSIONS):
+                    yield os.path.abspath(os.path.join(root, name))
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield os.path.abspath(os.path.join(base, line))
+
+def prompt_version():
+    """Hash of what determines an extraction, so a prompt change redoes the archive"""
+    import expensereportextractor
+    import llm_output
+    import llm_utils
+    text = expensereportextractor.get_extraction_prompt() + json.dumps(llm_output.RECEIPT_TOOL, sort_keys=True)
+    text += f"|structured={llm_utils.STRUCTURED_OUTPUT}"
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+def extract(path, limiter):
+    """Run one receipt; returns (receipt dict or None, error or None, seconds)"""
+    import expensereportextractor
+    limiter.wait()
+    start = time.perf_counter()
+    file_type = 'pdf' if path.lower().endswith('.pdf') else 'image'
+    try:
+        response = expensereportextractor.extractfields(path, file_type=file_type, source=path)
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+
+    if isinstance(response, str):
+        try:
+            response = json.loads(response)
+        except ValueError:
+            return None, f"Unparsable response: {response[:200]}", elapsed
+    if not isinstance(response, dict):
+        return None, f"Unexpected response: {str(response)[:200]}", elapsed
+    if 'error' in response:
+        return None, str(response['error']), elapsed
+    return response, None, elapsed
+
+def format_eta(seconds):
+    if seconds is None:
+        return '?'
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h{rest // 60:02d}m" if hours else f"{rest // 60}m{rest % 60:02d}s"
+
+def open_output(output_path, committed_size):
+    """Open the output for appending, cutting off lines written after the last checkpoint"""
+    exists = os.path.exists(output_path) and os.path.getsize(output_path) > 0
+    if committed_size is None and exists:
+        raise SystemExit(f"{output_path} exists but has no checkpoint; remove it or choose another --output")
+    output = open(output_path, 'ab')
+    if committed_size is not None and output.tell() != committed_size:
+        print(f"Discarding {output.tell() - committed_size} bytes written after the last checkpoint")
+        output.truncate(committed_size)
+        output.seek(committed_size)
+    return output
+
+def run(args):
+    import receipt_index
+    import scheduler
+
+    # The backfill does its own concurrency and rate control, and should
+    # not be answered from receipts indexed with an older prompt
+    scheduler.SCHEDULER_ENABLED = False
+    receipt_index.RECEIPT_INDEX_ENABLED = args.use_receipt_index
+
+    output_path = os.path.abspath(args.output)
+    checkpoint = Checkpoint(args.checkpoint or output_path + '.checkpoint.db')
+    prompt = prompt_version()
+
+    finished = checkpoint.finished(prompt, args.max_attempts)
+    attempts = checkpoint.attempts(prompt)
+    todo = deque(path for path in receipt_paths(args.source) if path not in finished)
+    total = len(todo)
+    print(f"{total:,} receipts to process ({len(finished):,} already finished, prompt {prompt})")
+
+    output = open_output(output_path, checkpoint.output_size(output_path))
+    limiter = RateLimiter(args.rate)
+    pending_records = []
+    counts = {'done': 0, 'failed': 0, 'throttled': 0}
+    recent = deque()  # completion times for the throughput estimate
+    started = time.monotonic()
+    last_commit = last_report = started
+
+    def commit():
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint.commit(pending_records, output_path, output.tell())
+        pending_records.clear()
+
+    def report(final=False):
+        now = time.monotonic()
+        while recent and recent[0] < now - args.window:
+            recent.popleft()
+        span = min(args.window, now - started)
+        throughput = len(recent) / span if span > 0 else 0.0
+        remaining = total - counts['done'] - counts['failed']
+        eta = remaining / throughput if throughput > 0 else None
+        label = 'Finished' if final else 'Progress'
+        print(f"{label}: {counts['done'] + counts['failed']:,}/{total:,} ({counts['done']:,} done, "
+              f"{counts['failed']:,} failed, {counts['throttled']:,} throttled)  {throughput:.2f} receipts/s  "
+              f"request rate {limiter.rate:.2f}/s  ETA {format_eta(eta) if not final else '-'}")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        running = {}
+        try:
+            while todo or running:
+                while todo and len(running) < args.concurrency * 2:
+                    path = todo.popleft()
+                    running[executor.submit(extract, path, limiter)] = path
+
+                completed, _ = concurrent.futures.wait(running, timeout=1.0,
+                                                       return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in completed:
+                    path = running.pop(future)
+                    receipt, error, seconds = future.result()
+
+                    if error and any(marker in error for marker in THROTTLE_MARKERS):
+                        counts['throttled'] += 1
+                        limiter.throttled()
+                        todo.appendleft(path)
+                        continue
+
+                    attempt = attempts.get(path, 0) + 1
+                    if error:
+                        counts['failed'] += 1
+                        logging.error(f"Backfill failed for {path}: {error}")
+                        pending_records.append((path, 'failed', attempt, prompt, error))
+                    else:
+                        counts['done'] += 1
+                        limiter.succeeded()
+                        line = {'path': path, 'prompt': prompt, 'seconds': round(seconds, 3), 'receipt': receipt}
+                        output.write((json.dumps(line, default=str, separators=(',', ':')) + '\n').encode())
+                        pending_records.append((path, 'done', attempt, prompt, None))
+                    recent.append(time.monotonic())
+
+                now = time.monotonic()
+                if pending_records and (len(pending_records) >= args.checkpoint_every or now - last_commit >= 5):
+                    commit()
+                    last_commit = now
+                if now - last_report >= args.report_every:
+                    report()
+                    last_report = now
+        except KeyboardInterrupt:
+            print("Interrupted: waiting for running receipts, then checkpointing")
+            for future in running:
+                future.cancel()
+            for future in concurrent.futures.as_completed([f for f in running if not f.cancelled()]):
+                receipt, error, seconds = future.result()
+                path = running[future]
+                if receipt is not None:
+                    line = {'path': path, 'prompt': prompt, 'seconds': round(seconds, 3), 'receipt': receipt}
+                    output.write((json.dumps(line, default=str, separators=(',', ':')) + '\n').encode())
+                    pending_records.append((path, 'done', attempts.get(path, 0) + 1, prompt, None))
+        finally:
+            commit()
+            output.close()
+
+    report(final=True)
+    print(f"Elapsed {format_eta(time.monotonic() - started)}; results in {output_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('source', help='Directory of receipts, or a manifest file with one path per line')
+    parser.add_argument('--output', required=True, help='JSONL file results are appended to')
+    parser.add_argument('--checkpoint', help='Checkpoint database (default: OUTPUT.checkpoint.db)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Receipts processed at once')
+    parser.add_argument('--rate', type=float, default=5.0, help='Maximum receipts started per second')
+    parser.add_argument('--max-attempts', type=int, default=3, help='Runs a failing receipt is retried in')
+    parser.add_argument('--checkpoint-every', type=int, default=100, help='Results per checkpoint (also every 5s)')
+    parser.add_argument('--report-every', type=float, default=10.0, help='Seconds between progress lines')
+    parser.add_argument('--window', type=float, default=60.0, help='Seconds of history for throughput and ETA')
+    parser.add_argument('--use-receipt-index', action='store_true',
+                        help='Answer duplicate receipts from the receipt index instead of re-extracting: identical '
+                             'ones, and near ones whose date, vendor and total a fast-model read confirms')
+    run(parser.parse_args())
+
+if __name__ == '__main__':
+    main()
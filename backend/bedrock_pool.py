@@ -0,0 +1,247 @@
+import json
+import os
+import random
+import threading
+import time
+import metrics
+
+# Regions/endpoints Bedrock calls are spread over. Either a comma-separated
+# list of regions with optional weights ("us-east-1=2,us-west-2"), or a JSON
+# list of {"region", "weight", "endpoint_url", "name"} objects; endpoint_url
+# points a member at a local stand-in or a VPC endpoint.
+BEDROCK_ENDPOINTS = os.getenv('BEDROCK_ENDPOINTS', 'us-east-1')
+
+# Attempts botocore makes on one endpoint before the pool fails over
+# (unset keeps botocore's default)
+MAX_ATTEMPTS = os.getenv('BEDROCK_MAX_ATTEMPTS')
+
+# Ejection: an endpoint is taken out of rotation on a throttle, or after
+# EJECT_AFTER_FAILURES consecutive failures, for EJECT_SECONDS doubling on
+# every failed probe up to MAX_EJECT_SECONDS. When the time is up a single
+# probe request is let through; success re-admits the endpoint.
+EJECT_AFTER_FAILURES = int(os.getenv('BEDROCK_EJECT_AFTER_FAILURES', 3))
+EJECT_SECONDS = float(os.getenv('BEDROCK_EJECT_SECONDS', 5))
+MAX_EJECT_SECONDS = float(os.getenv('BEDROCK_MAX_EJECT_SECONDS', 120))
+
+THROTTLE_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException'}
+UNAVAILABLE_CODES = {'ServiceUnavailableException', 'InternalServerException', 'ModelNotReadyException',
+                     'ModelTimeoutException', 'InternalFailure', 'ServiceUnavailable'}
+
+HEALTHY, EJECTED, PROBING = 'healthy', 'ejected', 'probing'
+
+class Endpoint:
+    """One region/endpoint in the pool with its client and health state"""
+
+    def __init__(self, region, weight=1.0, endpoint_url=None, name=None):
+        self.region = region
+        self.weight = float(weight)
+        self.endpoint_url = endpoint_url
+        self.name = name or (f"{region}@{endpoint_url}" if endpoint_url else region)
+        self.outstanding = 0
+        self.state = HEALTHY
+        self.failures = 0
+        self.eject_seconds = EJECT_SECONDS
+        self.ejected_until = 0.0
+        self.session = None
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """bedrock-runtime client for this endpoint, created once and shared"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # boto3 takes ~100 ms to import, so it is loaded on first use
+                    import boto3
+                    from botocore.config import Config
+                    config = Config(retries={'total_max_attempts': int(MAX_ATTEMPTS)}) if MAX_ATTEMPTS else None
+                    self.session = boto3.session.Session()
+                    self._client = self.session.client(
+                        "bedrock-runtime",
+                        region_name=self.region,
+                        endpoint_url=self.endpoint_url,
+                        config=config
+                    )
+        return self._client
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'region': self.region,
+            'weight': self.weight,
+            'state': self.state,
+            'outstanding': self.outstanding,
+            'consecutiveFailures': self.failures,
+            'ejectedForSeconds': max(0.0, round(self.ejected_until - time.monotonic(), 1)) if self.state != HEALTHY else 0.0
+        }
+
+def parse_endpoints(spec):
+    """Parse BEDROCK_ENDPOINTS into Endpoint objects"""
+    spec = spec.strip()
+    if spec.startswith('['):
+        return [
+            Endpoint(item['region'], item.get('weight', 1), item.get('endpoint_url'), item.get('name'))
+            for item in json.loads(spec)
+        ]
+
+    endpoints = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        region, _, weight = entry.partition('=')
+        endpoints.append(Endpoint(region.strip(), float(weight) if weight else 1.0))
+    return endpoints
+
+def classify_failure(error):
+    """
+    'throttle' or 'unavailable' for errors another endpoint may not have,
+    None for errors that would fail anywhere (validation, access, cancelled).
+    """
+    from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, ReadTimeoutError
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        if code in THROTTLE_CODES or status == 429:
+            return 'throttle'
+        if code in UNAVAILABLE_CODES or status >= 500:
+            return 'unavailable'
+        return None
+    if isinstance(error, (BotocoreConnectionError, ReadTimeoutError, ConnectionError, TimeoutError)):
+        return 'unavailable'
+    return None
+
+class BedrockPool:
+    """
+    Spreads Bedrock calls over several regions/endpoints.
+
+    Each call goes to the healthy endpoint with the fewest outstanding
+    requests relative to its weight. Throttled or failing endpoints are
+    ejected and re-admitted after a successful probe; a call that fails on
+    one endpoint for such a reason is retried on the next.
+    """
+
+    def __init__(self, endpoints):
+        if not endpoints:
+            raise ValueError("Bedrock pool needs at least one endpoint")
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+
+    def _acquire(self, exclude):
+        """Pick an endpoint and count the request against it"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for endpoint in self.endpoints:
+                if endpoint in exclude:
+                    continue
+                if endpoint.state == EJECTED and now >= endpoint.ejected_until:
+                    # Time served: let one probe request through
+                    endpoint.state = PROBING
+                    metrics.increment('bedrock_probes', endpoint=endpoint.name)
+                    candidates = [endpoint]
+                    break
+                if endpoint.state == HEALTHY:
+                    candidates.append(endpoint)
+
+            if not candidates:
+                # Everything is ejected or probing: rather than fail, use the
+                # remaining endpoint that comes back soonest
+                remaining = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+                if not remaining:
+                    return None
+                endpoint = min(remaining, key=lambda endpoint: endpoint.ejected_until)
+                if endpoint.state == EJECTED:
+                    endpoint.state = PROBING
+                    metrics.increment('bedrock_probes', endpoint=endpoint.name)
+                candidates = [endpoint]
+
+            lowest = min((endpoint.outstanding + 1) / endpoint.weight for endpoint in candidates)
+            best = [endpoint for endpoint in candidates if (endpoint.outstanding + 1) / endpoint.weight == lowest]
+            endpoint = random.choice(best)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _release(self, endpoint, failure):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failure is None:
+                # Successes of requests sent before an ejection don't count;
+                # only a probe re-admits
+                if endpoint.state == PROBING:
+                    metrics.increment('bedrock_readmissions', endpoint=endpoint.name)
+                    print(f"Bedrock endpoint {endpoint.name} re-admitted")
+                if endpoint.state != EJECTED:
+                    endpoint.state = HEALTHY
+                    endpoint.failures = 0
+                    endpoint.eject_seconds = EJECT_SECONDS
+                return
+
+            endpoint.failures += 1
+            metrics.increment('bedrock_failures', endpoint=endpoint.name, reason=failure)
+            if endpoint.state == EJECTED:
+                return
+            if endpoint.state == PROBING:
+                endpoint.eject_seconds = min(endpoint.eject_seconds * 2, MAX_EJECT_SECONDS)
+            elif failure != 'throttle' and endpoint.failures < EJECT_AFTER_FAILURES:
+                return
+            else:
+                metrics.increment('bedrock_ejections', endpoint=endpoint.name, reason=failure)
+            print(f"Bedrock endpoint {endpoint.name} ejected for {endpoint.eject_seconds:.1f}s ({failure})")
+            endpoint.state = EJECTED
+            endpoint.ejected_until = time.monotonic() + endpoint.eject_seconds
+
+    def call(self, function):
+        """
+        Run function(client) on an endpoint, failing over to the others on
+        throttling or unavailability. Other exceptions propagate unchanged.
+        """
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise last_error
+            tried.add(endpoint)
+
+            start = time.perf_counter()
+            try:
+                result = function(endpoint.client)
+            except Exception as e:
+                from llm_utils import Cancelled
+                if isinstance(e, Cancelled):
+                    # Says nothing about the endpoint's health either way
+                    with self._lock:
+                        endpoint.outstanding -= 1
+                    raise
+                failure = classify_failure(e)
+                self._release(endpoint, failure)
+                if failure is None:
+                    raise
+                last_error = e
+                continue
+
+            self._release(endpoint, None)
+            metrics.increment('bedrock_requests', endpoint=endpoint.name)
+            metrics.observe('bedrock_request_seconds', time.perf_counter() - start, endpoint=endpoint.name)
+            return result
+
+    def status(self):
+        with self._lock:
+            return [endpoint.describe() for endpoint in self.endpoints]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide pool built from BEDROCK_ENDPOINTS"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BedrockPool(parse_endpoints(BEDROCK_ENDPOINTS))
+        return _pool
+
+def call(function):
+    """Run function(client) on the shared pool (see BedrockPool.call)"""
+    return get_pool().call(function)
@@ -0,0 +1,173 @@
+"""
+Local stand-in for a Bedrock runtime endpoint.
+
+Answers POST /model/{modelId}/invoke with a fixed Claude-style response
+(an empty call of the forced tool when the request has a tool_choice) after
+a configurable latency, and /invoke-with-response-stream with the same
+response as a stream of events spread over that latency (counting streams
+the client closed early in cancelled). It can be told to throttle a fraction of
+requests (429 ThrottlingException) or to be down (503
+ServiceUnavailableException). Point a pool member at it with endpoint_url
+in BEDROCK_ENDPOINTS, e.g.
+
+    python benchmarks/bedrock_standin.py --port 8701 --throttle-rate 0.2
+    BEDROCK_ENDPOINTS='[{"region": "us-east-1", "endpoint_url": "http://127.0.0.1:8701"}]' python app.py
+
+AWS credentials must be set (any values) for botocore to sign requests.
+"""
+import argparse
+import base64
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPONSE = {
+    "id": "msg_standin",
+    "type": "message",
+    "role": "assistant",
+    "content": [{"type": "text", "text": "{}"}],
+    "stop_reason": "end_turn",
+    "usage": {"input_tokens": 10, "output_tokens": 2}
+}
+
+def _event_message(chunk):
+    """A Bedrock response stream chunk event in the AWS event stream encoding"""
+    headers = b''.join(
+        bytes([len(name)]) + name.encode() + b'\x07' + struct.pack('>H', len(value)) + value.encode()
+        for name, value in ((':event-type', 'chunk'), (':content-type', 'application/json'), (':message-type', 'event')))
+    payload = json.dumps({"bytes": base64.b64encode(json.dumps(chunk).encode()).decode()}).encode()
+    prelude = struct.pack('>II', 16 + len(headers) + len(payload), len(headers))
+    message = prelude + struct.pack('>I', zlib.crc32(prelude)) + headers + payload
+    return message + struct.pack('>I', zlib.crc32(message))
+
+def stream_events(response):
+    """The events streaming a Claude-style response"""
+    events = [{"type": "message_start", "message": {"id": response["id"], "type": "message", "role": "assistant",
+                                                   "content": [], "usage": {"input_tokens": response["usage"]["input_tokens"]}}}]
+    for index, block in enumerate(response["content"]):
+        if block["type"] == "tool_use":
+            events.append({"type": "content_block_start", "index": index, "content_block": dict(block, input={})})
+            delta = {"type": "input_json_delta", "partial_json": json.dumps(block["input"])}
+        else:
+            events.append({"type": "content_block_start", "index": index, "content_block": {"type": "text", "text": ""}})
+            delta = {"type": "text_delta", "text": block["text"]}
+        events.append({"type": "content_block_delta", "index": index, "delta": delta})
+        events.append({"type": "content_block_stop", "index": index})
+    events.append({"type": "message_delta", "delta": {"stop_reason": response["stop_reason"]},
+                   "usage": {"output_tokens": response["usage"]["output_tokens"]}})
+    events.append({"type": "message_stop"})
+    return events
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+class StandIn:
+    """A stand-in endpoint running on a background thread"""
+
+    def __init__(self, port=0, latency=0.05, jitter=0.2, throttle_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.down = False
+        self.requests = 0
+        self.cancelled = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', port), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, error_type=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if error_type:
+                    self.send_header('x-amzn-ErrorType', error_type)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with standin._lock:
+                    standin.requests += 1
+                    throttled = standin._rng.random() < standin.throttle_rate
+                    delay = standin.latency * standin._rng.uniform(1 - standin.jitter, 1 + standin.jitter)
+
+                if not self.path.endswith(('/invoke', '/invoke-with-response-stream')):
+                    self._reply(404, {"message": "Only invoke is emulated"}, 'ResourceNotFoundException')
+                elif standin.down:
+                    self._reply(503, {"message": "Service unavailable"}, 'ServiceUnavailableException')
+                elif throttled:
+                    self._reply(429, {"message": "Too many requests"}, 'ThrottlingException')
+                elif self.path.endswith('/invoke'):
+                    time.sleep(delay)
+                    self._reply(200, standin.response(body))
+                else:
+                    self._stream(standin.response(body), delay)
+
+            def _stream(self, response, delay):
+                # Chunked, as Bedrock streams, so each event reaches the client as it is sent
+                self.protocol_version = 'HTTP/1.1'
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/vnd.amazon.eventstream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                events = stream_events(response)
+                try:
+                    for event in events:
+                        time.sleep(delay / len(events))
+                        message = _event_message(event)
+                        self.wfile.write(f"{len(message):x}\r\n".encode() + message + b"\r\n")
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    with standin._lock:
+                        standin.cancelled += 1
+
+        return Handler
+
+    def response(self, body):
+        """Claude-style answer: text, or an empty call of the forced tool"""
+        tool_choice = body.get('tool_choice') or {}
+        if tool_choice.get('type') != 'tool':
+            return RESPONSE
+        content = [{"type": "tool_use", "id": "toolu_standin", "name": tool_choice['name'], "input": {}}]
+        return dict(RESPONSE, content=content, stop_reason="tool_use")
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8701)
+    parser.add_argument('--latency', type=float, default=0.05, help='Response latency in seconds')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    args = parser.parse_args()
+
+    standin = StandIn(args.port, args.latency, throttle_rate=args.throttle_rate)
+    print(f"Bedrock stand-in listening on {standin.url}")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.server.server_close()
+
+if __name__ == '__main__':
+    main()
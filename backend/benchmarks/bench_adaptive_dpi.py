@@ -0,0 +1,79 @@
+"""
+Compare fixed 300 DPI rendering with adaptive first-pass DPI on a PDF corpus.
+
+For every page of every PDF in the corpus directory this renders the page at
+300 DPI and at the adaptive DPI, and reports render time and the base64
+payload that would be sent to Bedrock. Escalations (re-renders at full
+resolution after a failed validation) are not included, since they depend
+on model output. Requires poppler. Run from the backend directory:
+
+    python benchmarks/bench_adaptive_dpi.py path/to/receipts_and_policies/
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+from pdf2image import pdfinfo_from_path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import adaptive_dpi
+import expensereportextractor
+import page_filter
+
+def render_and_encode(pdf_path, page_num, dpi):
+    """Return (render_seconds, payload_bytes, image) for one page"""
+    start = time.perf_counter()
+    image = expensereportextractor.render_pdf_page(pdf_path, page_num, dpi)
+    elapsed = time.perf_counter() - start
+    analysis = page_filter.load_analysis_image(image)
+    payload = len(base64.b64encode(expensereportextractor.encode_jpeg(image)))
+    return elapsed, payload, analysis
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('corpus', help='Directory containing PDF files')
+    parser.add_argument('--max-pages', type=int, default=5, help='Pages to sample per document')
+    args = parser.parse_args()
+
+    totals = {'fixed_time': 0.0, 'fixed_bytes': 0, 'adaptive_time': 0.0, 'adaptive_bytes': 0, 'pages': 0}
+    pdfs = sorted(name for name in os.listdir(args.corpus) if name.lower().endswith('.pdf'))
+
+    for name in pdfs:
+        pdf_path = os.path.join(args.corpus, name)
+        info = pdfinfo_from_path(pdf_path)
+        dpi = adaptive_dpi.choose_dpi(adaptive_dpi.page_size_from_pdfinfo(info))
+
+        for page_num in range(min(info.get('Pages', 0), args.max_pages)):
+            fixed_time, fixed_bytes, _ = render_and_encode(pdf_path, page_num, 300)
+            adaptive_time, adaptive_bytes, analysis = render_and_encode(pdf_path, page_num, dpi)
+
+            ink_coverage, _ = page_filter.ink_statistics(analysis)
+            if adaptive_dpi.needs_dense_rerender(dpi, ink_coverage):
+                dense_time, adaptive_bytes, _ = render_and_encode(pdf_path, page_num, adaptive_dpi.DENSE_PAGE_DPI)
+                adaptive_time += dense_time
+
+            totals['fixed_time'] += fixed_time
+            totals['fixed_bytes'] += fixed_bytes
+            totals['adaptive_time'] += adaptive_time
+            totals['adaptive_bytes'] += adaptive_bytes
+            totals['pages'] += 1
+
+        print(f"{name}: first-pass DPI {dpi}")
+
+    if not totals['pages']:
+        print("No PDF pages found")
+        return
+
+    pages = totals['pages']
+    print(f"\nPages rendered:       {pages} from {len(pdfs)} documents")
+    print(f"Render time / page:   300 DPI {totals['fixed_time'] / pages * 1000:.0f} ms, "
+          f"adaptive {totals['adaptive_time'] / pages * 1000:.0f} ms "
+          f"({1 - totals['adaptive_time'] / totals['fixed_time']:.0%} less)")
+    print(f"Payload / page:       300 DPI {totals['fixed_bytes'] / pages / 1024:.0f} KiB, "
+          f"adaptive {totals['adaptive_bytes'] / pages / 1024:.0f} KiB "
+          f"({1 - totals['adaptive_bytes'] / totals['fixed_bytes']:.0%} less)")
+
+if __name__ == '__main__':
+    main()
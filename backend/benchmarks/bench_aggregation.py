@@ -0,0 +1,100 @@
+"""
+Benchmark expense aggregation over a synthetic set of transactions.
+
+Loads N transactions (default 1,000,000) across categories, departments and
+currencies into an in-memory ExpenseStore, then times the queries the budget
+dashboard needs: unfiltered totals (running aggregates), date-filtered
+group-bys (vectorised scans), budget summaries, and incremental adds.
+Run from the backend directory:
+
+    python benchmarks/bench_aggregation.py --transactions 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import expense_store
+
+CATEGORIES = ['Meals', 'Travel', 'Lodging', 'Office Supplies', 'Software', 'Training', 'Entertainment', 'Transport']
+DEPARTMENTS = ['Engineering', 'Sales', 'Marketing', 'Finance', 'Operations', 'HR']
+CURRENCIES = ['USD'] * 6 + ['EUR', 'EUR', 'GBP', 'INR', 'JPY', 'CAD']
+
+def synthetic_expenses(count, seed=42):
+    rng = random.Random(seed)
+    start = date(2023, 1, 1)
+    for index in range(count):
+        yield {
+            'id': f"txn-{index}",
+            'date': (start + timedelta(days=rng.randrange(730))).isoformat(),
+            'currency': rng.choice(CURRENCIES),
+            'vendor': f"Vendor {rng.randrange(5000)}",
+            'category': rng.choice(CATEGORIES),
+            'department': rng.choice(DEPARTMENTS),
+            'total': f"{rng.uniform(2, 800):.2f}"
+        }
+
+def timed(label, function, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"{label:<40} median {timings[len(timings) // 2] * 1000:8.2f} ms   best {timings[0] * 1000:8.2f} ms")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--transactions', type=int, default=1_000_000)
+    parser.add_argument('--batch-size', type=int, default=50_000)
+    args = parser.parse_args()
+
+    store = expense_store.ExpenseStore(path=':memory:')
+    expenses = synthetic_expenses(args.transactions)
+
+    start = time.perf_counter()
+    while True:
+        batch = [expense for _, expense in zip(range(args.batch_size), expenses)]
+        if not batch:
+            break
+        store.add_many(batch)
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {len(store):,} transactions in {elapsed:.1f} s ({len(store) / elapsed:,.0f}/s)\n")
+
+    for group_by in expense_store.GROUP_DIMENSIONS:
+        timed(f"summary by {group_by} (running)", lambda: store.summary(group_by=group_by))
+
+    timed("summary by category, one quarter", lambda: store.summary(
+        group_by='category', start_date='2024-01-01', end_date='2024-03-31'))
+    timed("summary by month, one year, EUR", lambda: store.summary(
+        group_by='month', start_date='2024-01-01', end_date='2024-12-31', currency='EUR'))
+    timed("summary by category, one department", lambda: store.summary(
+        group_by='category', department='Sales'))
+
+    budgets = [{
+        'id': quarter,
+        'name': f"Q{quarter + 1} 2024",
+        'startDate': (date(2024, 1, 1) + timedelta(days=91 * quarter)).isoformat(),
+        'endDate': (date(2024, 1, 1) + timedelta(days=91 * quarter + 90)).isoformat(),
+        'amount': 5_000_000,
+        'categories': [{'name': name, 'allocation': 600_000} for name in CATEGORIES],
+        'departments': [{'name': name, 'allocation': 800_000} for name in DEPARTMENTS]
+    } for quarter in range(4)]
+    timed("budget summary, 4 quarterly budgets", lambda: store.budget_summary(budgets))
+
+    extra = synthetic_expenses(args.transactions + 1000, seed=7)
+    new_expenses = [dict(expense, id=f"new-{index}") for index, expense in enumerate(extra) if index < 1000]
+    added = iter(new_expenses)
+    timed("incremental add, 1 expense", lambda: store.add(next(added)), repeat=len(new_expenses))
+
+    unfiltered = store.summary(group_by='category')
+    scanned = store.summary(group_by='category', start_date='1970-01-01')
+    print(f"\nRunning aggregates match full scan: {unfiltered['groups'] == scanned['groups']}")
+    print(f"Total across {unfiltered['count']:,} transactions: {unfiltered['total']:,.2f} {unfiltered['currency']}")
+
+if __name__ == '__main__':
+    main()
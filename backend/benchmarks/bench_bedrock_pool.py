@@ -0,0 +1,109 @@
+"""
+Drive the Bedrock client pool against local stand-in endpoints.
+
+Starts three stand-ins (see bedrock_standin.py): "east" with weight 2,
+"west" which throttles a fraction of requests, and "eu" which goes down for
+the middle third of the run. Worker threads send invoke requests through
+the pool for a fixed time, once through a single-region pool on "west" and
+once through the three-region pool, and the calls that failed, the
+requests each endpoint served and the ejections/re-admissions are
+reported. No AWS access is needed. Run from the backend directory:
+
+    python benchmarks/bench_bedrock_pool.py --seconds 10
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# botocore signs requests, so it needs credentials of some kind
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'standin')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'standin')
+
+import bedrock_pool
+import llm_utils
+import metrics
+from bedrock_standin import StandIn
+
+REQUEST = json.dumps({
+    "anthropic_version": "bedrock-2023-05-31",
+    "max_tokens": 16,
+    "messages": [{"role": "user", "content": [{"type": "text", "text": "ping"}]}]
+})
+REASONS = ('throttle', 'unavailable')
+
+def run(label, pool, args, outage=None):
+    metrics.reset()
+    stop = time.perf_counter() + args.seconds
+    failed = []
+
+    def worker(_):
+        while time.perf_counter() < stop:
+            try:
+                pool.call(lambda client: llm_utils._invoke(client, llm_utils.SONNET_37_MODEL_ID, REQUEST))
+            except Exception as e:
+                failed.append(type(e).__name__)
+
+    def outage_schedule():
+        time.sleep(args.seconds / 3)
+        outage.down = True
+        time.sleep(args.seconds / 3)
+        outage.down = False
+
+    if outage is not None:
+        threading.Thread(target=outage_schedule, daemon=True).start()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(worker, range(args.concurrency)))
+
+    served = {endpoint.name: metrics.counter('bedrock_requests', endpoint=endpoint.name) for endpoint in pool.endpoints}
+    total = sum(served.values()) + len(failed)
+    print(f"\n{label}: {total:,} calls, {len(failed):,} failed ({len(failed) / max(total, 1):.1%})")
+    for endpoint in pool.endpoints:
+        name = endpoint.name
+        latency = metrics.snapshot()['summaries'].get(f'bedrock_request_seconds{{endpoint={name}}}', {})
+        failures = sum(metrics.counter('bedrock_failures', endpoint=name, reason=reason) for reason in REASONS)
+        ejections = sum(metrics.counter('bedrock_ejections', endpoint=name, reason=reason) for reason in REASONS)
+        print(f"  {name:<6} served {served[name]:6,} ({served[name] / max(sum(served.values()), 1):5.1%})   "
+              f"p99 {latency.get('p99', 0) * 1000:5.0f} ms   failures {failures:5,}   ejections {ejections:3}   "
+              f"probes {metrics.counter('bedrock_probes', endpoint=name):3}   "
+              f"re-admitted {metrics.counter('bedrock_readmissions', endpoint=name):3}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.04, help='Stand-in response latency in seconds')
+    parser.add_argument('--throttle-rate', type=float, default=0.15, help='Fraction of requests "west" throttles')
+    parser.add_argument('--eject-seconds', type=float, default=0.5)
+    args = parser.parse_args()
+
+    # Fail over on the first error so the pool, not botocore, handles it
+    bedrock_pool.MAX_ATTEMPTS = '1'
+    bedrock_pool.EJECT_SECONDS = args.eject_seconds
+    bedrock_pool.MAX_EJECT_SECONDS = args.eject_seconds * 8
+
+    east = StandIn(latency=args.latency, seed=1).start()
+    west = StandIn(latency=args.latency, throttle_rate=args.throttle_rate, seed=2).start()
+    eu = StandIn(latency=args.latency, seed=3).start()
+
+    single = bedrock_pool.BedrockPool([bedrock_pool.Endpoint('us-west-2', 1, west.url, 'west')])
+    run('single region', single, args)
+
+    pool = bedrock_pool.BedrockPool([
+        bedrock_pool.Endpoint('us-east-1', 2, east.url, 'east'),
+        bedrock_pool.Endpoint('us-west-2', 1, west.url, 'west'),
+        bedrock_pool.Endpoint('eu-central-1', 1, eu.url, 'eu'),
+    ])
+    run('pool', pool, args, outage=eu)
+
+    for standin in (east, west, eu):
+        standin.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Measure app import time and first-request latency in a fresh process.
+
+Each run starts a new Python process that imports app, optionally waits for
+the warm-up to report ready, then sends two receipt extractions through
+Flask's test client against a local Bedrock stand-in (see
+bedrock_standin.py). The first request pays for whatever the process has
+not loaded yet: imports, stores, boto3 client creation, credential
+resolution and the connection to Bedrock. No AWS access is needed. For a
+per-module breakdown use python -X importtime -c "import app". Run from
+the backend directory:
+
+    python benchmarks/bench_cold_start.py --runs 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bedrock_standin import StandIn
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import io, json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+
+ready = None
+if app.warmup.WARMUP_ENABLED:
+    while app.warmup.status()['status'] == 'warming' or app.warmup.status()['status'] == 'cold':
+        time.sleep(0.005)
+    ready = time.perf_counter() - start
+
+image = open(sys.argv[1], 'rb').read()
+client = app.app.test_client()
+latencies = []
+for _ in range(2):
+    begin = time.perf_counter()
+    response = client.post('/expenseextractor', data={'fileType': 'image', 'file': (io.BytesIO(image), 'receipt.jpg')},
+                           content_type='multipart/form-data')
+    latencies.append(time.perf_counter() - begin)
+    assert response.status_code == 200, response.data
+print(json.dumps({'import': imported, 'ready': ready, 'first': latencies[0], 'second': latencies[1],
+                  'warmup': app.warmup.status()['status']}))
+'''
+
+def sample_receipt(path):
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (600, 900), 'white')
+    draw = ImageDraw.Draw(image)
+    for line in range(20):
+        draw.text((40, 40 + line * 40), f"ITEM {line}    {line * 3 + 1}.99", fill='black')
+    image.save(path, format='JPEG')
+
+def run_once(warm, image_path, standin, data_folder):
+    env = dict(os.environ,
+               WARMUP_ENABLED=str(warm),
+               BEDROCK_ENDPOINTS=json.dumps([{'region': 'us-east-1', 'endpoint_url': standin.url}]),
+               DATA_FOLDER=data_folder,
+               AWS_ACCESS_KEY_ID=os.environ.get('AWS_ACCESS_KEY_ID', 'standin'),
+               AWS_SECRET_ACCESS_KEY=os.environ.get('AWS_SECRET_ACCESS_KEY', 'standin'))
+    output = subprocess.run([sys.executable, '-c', CHILD, image_path], cwd=BACKEND, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05, help='Stand-in response latency in seconds')
+    args = parser.parse_args()
+
+    standin = StandIn(latency=args.latency, seed=1).start()
+    with tempfile.TemporaryDirectory() as folder:
+        image_path = os.path.join(folder, 'receipt.jpg')
+        sample_receipt(image_path)
+
+        for warm in (False, True):
+            runs = [run_once(warm, image_path, standin, os.path.join(folder, f"data-{warm}-{run}"))
+                    for run in range(args.runs)]
+
+            def median_ms(key):
+                return statistics.median(run[key] for run in runs) * 1000
+
+            label = 'warm-up' if warm else 'no warm-up'
+            ready = f"ready after {median_ms('ready'):6.0f} ms   " if warm else ' ' * 25
+            print(f"{label:<11} import {median_ms('import'):5.0f} ms   {ready}"
+                  f"first request {median_ms('first'):5.0f} ms   second request {median_ms('second'):5.0f} ms")
+    standin.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Compare the verbose and compact compliance prompts.
+
+Builds synthetic policy sets of several sizes (rules spread over a few
+countries, seniority levels and expense types) and runs check_policy_compliance
+for one invoice with each prompt encoding against a local Bedrock stand-in
+that reports the input tokens it received (estimated) and a short verdict,
+with latency growing with the input. Reported per encoding and rule count:
+applicable rules, estimated input tokens, max_tokens requested, the tokens
+the stand-in reported and the latency. No AWS access is needed. Run from
+the backend directory:
+
+    python benchmarks/bench_compliance_prompt.py --rules 10 40 120
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'standin')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'standin')
+from bedrock_standin import StandIn
+import bedrock_pool
+import expensereportextractor
+import llm_utils
+import metrics
+import scheduler
+
+INVOICE = {
+    "invoiceNumber": "INV-20931", "date": "2025-03-01", "vendor": "Trattoria Roma", "currency": "USD",
+    "total": "186.40", "expenseLocation": "New York", "expenseCountry": "united states", "expenseType": "meals",
+    "numberOfPeople": 3,
+    "items": [{"description": "Set lunch", "quantity": 3, "amount": "138.00"},
+              {"description": "Beverages", "quantity": 4, "amount": "32.00"},
+              {"description": "Service", "quantity": 1, "amount": "16.40"}]
+}
+
+TEMPLATES = [
+    "{type} expenses must not exceed {amount} USD per person per day, including tax and tips.",
+    "Receipts for {type} expenses over {amount} USD must be itemised and submitted within 30 days.",
+    "{type} expenses above {amount} USD require written approval from a line manager before booking.",
+    "Alcohol is not reimbursable as part of {type} expenses unless a client is present and named.",
+]
+
+def make_rules(count, seed):
+    rng = random.Random(seed)
+    return [{
+        'rule': rng.choice(TEMPLATES).format(type=expense_type.title(), amount=rng.randint(20, 400)),
+        'country': rng.choice(['global', 'global', 'united states', 'germany']),
+        'seniority': rng.choice(['all', 'all', 'senior', 'junior']),
+        'expenseType': expense_type
+    } for expense_type in (rng.choice(['all', 'meals', 'meals', 'transportation']) for _ in range(count))]
+
+class ComplianceStandIn(StandIn):
+    """Answers with a one-violation verdict and reports (estimated) token usage"""
+
+    def response(self, body):
+        text = ' '.join(block.get('text', '') for block in body['messages'][0]['content'])
+        verdict = {"isCompliant": False, "violations": [{"message": "Meals exceed the per person daily limit."}]}
+        usage = {"input_tokens": llm_utils.estimate_tokens(text), "output_tokens": 40}
+        # Prefill time grows with the prompt
+        time.sleep(self.latency + usage["input_tokens"] * 0.0001)
+        content = [{"type": "tool_use", "id": "toolu_standin", "name": body['tool_choice']['name'], "input": verdict}]
+        return {"id": "msg_standin", "type": "message", "role": "assistant", "content": content,
+                "stop_reason": "tool_use", "usage": usage}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rules', type=int, nargs='+', default=[10, 40, 120], help='Policy set sizes')
+    parser.add_argument('--checks', type=int, default=5, help='Checks per size and encoding')
+    parser.add_argument('--seed', type=int, default=2)
+    args = parser.parse_args()
+
+    standin = ComplianceStandIn(latency=0.2, jitter=0).start()
+    bedrock_pool._pool = bedrock_pool.BedrockPool(
+        bedrock_pool.parse_endpoints(json.dumps([{"region": "us-east-1", "endpoint_url": standin.url}])))
+    scheduler.SCHEDULER_ENABLED = False
+    llm_utils.MODEL_TIERING_ENABLED = False
+
+    rows = []
+    try:
+        for count in args.rules:
+            rules = make_rules(count, args.seed)
+            for compact in (False, True):
+                encoding = 'compact' if compact else 'verbose'
+                expensereportextractor.COMPACT_COMPLIANCE_PROMPT = compact
+                metrics.reset()
+                for _ in range(args.checks):
+                    expensereportextractor.check_policy_compliance('senior', dict(INVOICE), rules)
+
+                applicable = expensereportextractor.filter_applicable_policies(rules, 'united states', 'senior', 'meals')
+                if compact:
+                    prompt, _ = expensereportextractor.get_compact_compliance_prompt('senior', INVOICE, applicable, '2025-03-10')
+                    max_tokens = expensereportextractor.compliance_max_tokens(len(applicable))
+                else:
+                    prompt = expensereportextractor.get_compliance_prompt('senior', INVOICE, applicable, '2025-03-10')
+                    max_tokens = expensereportextractor.COMPLIANCE_MAX_TOKENS
+                rows.append((count, encoding, len(applicable), llm_utils.estimate_tokens(prompt), max_tokens,
+                             metrics.percentile('compliance_input_tokens', 50, prompt=encoding),
+                             metrics.percentile('compliance_output_tokens', 50, prompt=encoding),
+                             metrics.percentile('compliance_seconds', 50, prompt=encoding)))
+    finally:
+        standin.stop()
+
+    print(f"\n{'rules':>5} {'prompt':8} {'applicable':>10} {'est. input':>10} {'max_tokens':>10} "
+          f"{'input tok':>9} {'output tok':>10} {'p50 ms':>7}")
+    for count, encoding, applicable, estimated, max_tokens, input_tokens, output_tokens, seconds in rows:
+        print(f"{count:5} {encoding:8} {applicable:10} {estimated:10,} {max_tokens:10,} "
+              f"{input_tokens:9,} {output_tokens:10} {seconds * 1000:7.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Simulate hedged LLM calls and report the tail latency reduction.
+
+Each simulated call takes a log-normally distributed time, and a small
+fraction hit a slow path (queueing, retries inside Bedrock) that takes many
+times longer. Calls run through hedging.hedged_call with hedging off and
+on, at the same concurrency, each holding a scheduler LLM slot (a hedge
+needs a spare one), and the p50/p95/p99 of end-to-end latency and the
+fraction of calls hedged are compared. Time is scaled down so the run
+takes seconds; no AWS access is needed. Run from the backend directory:
+
+    python benchmarks/bench_hedging.py --calls 2000
+"""
+import argparse
+import concurrent.futures
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hedging
+import metrics
+import scheduler
+
+def simulated_call(rng, lock, median, slow_fraction, slow_factor):
+    """An attempt function as passed to hedged_call, honouring cancellation"""
+    def call(cancel):
+        with lock:
+            duration = rng.lognormvariate(0, 0.35) * median
+            if rng.random() < slow_fraction:
+                duration *= slow_factor
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            if cancel is not None and cancel.cancelled:
+                return {"error": "Request cancelled"}
+            time.sleep(min(0.005, max(0.0, deadline - time.perf_counter())))
+        return {"total": "12.00"}
+    return call
+
+def run(enabled, args):
+    metrics.reset()
+    hedging.HEDGE_ENABLED = enabled
+    hedging._budget = hedging.HedgeBudget(args.max_rate)
+    scheduler._scheduler = scheduler.Scheduler(slots=args.slots, bulk_max_slot_share=1.0)
+    rng = random.Random(args.seed)
+    lock = threading.Lock()
+    attempt = simulated_call(rng, lock, args.median, args.slow_fraction, args.slow_factor)
+
+    def one_call(_):
+        with scheduler.slot():
+            return hedging.hedged_call('bench', attempt, attempt)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one_call, range(args.calls)))
+
+    summary = metrics.snapshot()['summaries']['llm_call_seconds{kind=bench}']
+    hedges = metrics.counter('llm_hedges', kind='bench')
+    wins = metrics.counter('llm_hedge_wins', kind='bench')
+    suppressed = metrics.counter('llm_hedges_suppressed', kind='bench')
+    no_slot = metrics.counter('llm_hedges_no_slot', kind='bench')
+    label = 'hedged' if enabled else 'baseline'
+    print(f"{label:<9} p50 {summary['p50'] * 1000:7.0f} ms   p95 {summary['p95'] * 1000:7.0f} ms   "
+          f"p99 {summary['p99'] * 1000:7.0f} ms   hedge rate {hedges / args.calls:5.1%}   "
+          f"hedge wins {wins}   suppressed {suppressed}   no slot {no_slot}")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--slots', type=int, default=20, help='Scheduler LLM slots (spare ones are left for hedges)')
+    parser.add_argument('--median', type=float, default=0.05, help='Median attempt latency in seconds (scaled)')
+    parser.add_argument('--slow-fraction', type=float, default=0.03)
+    parser.add_argument('--slow-factor', type=float, default=10.0)
+    parser.add_argument('--max-rate', type=float, default=hedging.MAX_RATE)
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    hedging.DEFAULT_DELAY = args.median * 3
+    hedging.MIN_DELAY = args.median
+
+    baseline = run(False, args)
+    hedged = run(True, args)
+    print(f"\np99 reduction: {1 - hedged['p99'] / baseline['p99']:.0%}, "
+          f"p95 reduction: {1 - hedged['p95'] / baseline['p95']:.0%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Compare the plain BeautifulSoup text and the main content extraction for policy pages.
+
+Builds a corpus of saved intranet policy pages in the layouts they come in
+(semantic HTML5, class-named div templates, SharePoint-style layout
+tables, ASP.NET pages wrapped in one form, wiki pages and unlabelled
+divs), each with menus, cookie banners, sidebars, footers and inline
+scripts around a policy of headings, paragraphs, lists and tables. Each page is reduced to text the way
+/policyextractionfromurl did (html.parser, scripts and styles removed) and
+with html_content.extract_main_text. Reported per layout: parse time,
+characters and estimated tokens sent to the LLM, the policy sentences kept
+and the boilerplate phrases kept. Saved pages (*.html) can be measured too
+with --corpus; there only time and size are reported. Run from the backend
+directory:
+
+    python benchmarks/bench_html_extraction.py --pages 10 [--corpus saved_pages/]
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bs4 import BeautifulSoup
+import html_content
+import llm_utils
+
+TOPICS = ['Air travel', 'Hotels', 'Meals', 'Ground transport', 'Mobile phones', 'Client entertainment',
+          'Conferences', 'Receipts and approvals']
+RULES = [
+    "{topic} expenses above ${amount} require written approval from your line manager before booking.",
+    "Employees in {dept} may claim {topic_lower} costs of up to ${amount} per day, including taxes and tips.",
+    "Receipts for {topic_lower} must be itemised and submitted within {days} days of the expense date.",
+    "{topic} booked outside the approved travel portal are reimbursed only up to ${amount}.",
+    "Alcohol purchased as part of {topic_lower} is not reimbursable unless a client is present and named.",
+]
+DEPARTMENTS = ['Sales', 'Engineering', 'Finance', 'Marketing', 'Operations', 'Legal', 'Support', 'People']
+SCRIPT = "window.dataLayer=window.dataLayer||[];function gtag(){dataLayer.push(arguments)}" * 40
+STYLE = ".nav a{color:#036;padding:4px 8px}.footer{font-size:11px}" * 60
+
+def make_policy(rng):
+    """Policy HTML and its sentences"""
+    sentences = []
+    parts = [f"<h1>Global Travel and Expense Policy {rng.randint(2023, 2025)}</h1>",
+             "<p>This policy applies to all employees, contractors and interns, and sets out what may be "
+             "claimed, the limits that apply and how claims are approved.</p>"]
+    sentences.append("This policy applies to all employees, contractors and interns")
+    for topic in rng.sample(TOPICS, 5):
+        parts.append(f"<h2>{topic}</h2>")
+        rules = [rule.format(topic=topic, topic_lower=topic.lower(), amount=rng.randint(20, 900),
+                             dept=rng.choice(DEPARTMENTS), days=rng.choice([30, 45, 60]))
+                 for rule in rng.sample(RULES, 3)]
+        sentences.extend(rules)
+        parts.append(f"<p>{rules[0]} Exceptions are reviewed by Finance.</p>")
+        parts.append("<ul>" + ''.join(f"<li>{rule}</li>" for rule in rules[1:]) + "</ul>")
+    limits = [(level, rng.randint(40, 120)) for level in ('Junior', 'Senior', 'Director')]
+    parts.append("<h3>Daily meal limits</h3><table><tr><th>Level</th><th>Daily limit (USD)</th></tr>"
+                 + ''.join(f"<tr><td>{level}</td><td>{limit}</td></tr>" for level, limit in limits) + "</table>")
+    sentences.extend(f"{level} | {limit}" for level, limit in limits)
+    return '\n'.join(parts), sentences
+
+def make_boilerplate(rng):
+    """Pieces of page furniture and the phrases that identify them"""
+    menu_items = [f"{dept} {page}" for dept in DEPARTMENTS for page in ('Home', 'Team sites', 'News', 'Forms', 'Contacts')]
+    links = ''.join(f'<li><a href="/{i}">{item}</a></li>' for i, item in enumerate(menu_items))
+    pieces = {
+        'cookie': "We use cookies to improve your intranet experience. By continuing you accept our cookie policy.",
+        'footer': "Copyright Example Corporation. All rights reserved. Internal use only. Contact the service desk "
+                  "on extension 4000 for help with this site, or raise a ticket in the IT portal.",
+        'sidebar': "Quick links for new starters and managers",
+        'news': "Office closure on Friday for the summer party, see the events calendar for details",
+        'breadcrumb': "Home / Finance / Policies / Travel",
+    }
+    return links, pieces, [menu_items[0], menu_items[-1]] + list(pieces.values())
+
+def page(layout, rng):
+    policy, sentences = make_policy(rng)
+    links, bp, phrases = make_boilerplate(rng)
+    head = f"<head><title>Travel policy</title><style>{STYLE}</style><script>{SCRIPT}</script></head>"
+    if layout == 'semantic':
+        body = (f'<div class="cookie-banner"><p>{bp["cookie"]}</p><button>Accept</button></div>'
+                f'<header><a href="/">Intranet</a><nav><ul>{links}</ul></nav></header>'
+                f'<nav aria-label="breadcrumb">{bp["breadcrumb"]}</nav>'
+                f'<main><article>{policy}</article></main>'
+                f'<aside><h3>{bp["sidebar"]}</h3><p>{bp["news"]}</p></aside><footer><p>{bp["footer"]}</p></footer>')
+    elif layout == 'div-template':
+        body = (f'<div id="cookie-consent">{bp["cookie"]}</div><div class="top-bar"><div class="mega-menu"><ul>{links}</ul></div></div>'
+                f'<div class="breadcrumbs">{bp["breadcrumb"]}</div><div class="page">'
+                f'<div class="left-sidebar"><h3>{bp["sidebar"]}</h3><ul>{links}</ul></div>'
+                f'<div class="page-content">{policy}</div>'
+                f'<div class="news-widget"><p>{bp["news"]}</p></div></div><div class="site-footer"><p>{bp["footer"]}</p></div>')
+    elif layout == 'sharepoint':
+        body = (f'<div id="s4-ribbonrow">{bp["cookie"]}</div>'
+                f'<table width="100%"><tr><td colspan="2"><a href="/">Intranet</a> {bp["breadcrumb"]}</td></tr>'
+                f'<tr><td valign="top" width="200"><div class="ms-quicklaunch"><h3>{bp["sidebar"]}</h3><ul>{links}</ul></div></td>'
+                f'<td valign="top"><div class="ms-rtestate-field">{policy}</div><p>{bp["news"]}</p></td></tr>'
+                f'<tr><td colspan="2"><small>{bp["footer"]}</small></td></tr></table>')
+    elif layout == 'aspnet':
+        # The whole body is one form, with a small search form inside
+        body = (f'<form id="aspnetForm" method="post"><div class="header"><a href="/">Intranet</a>'
+                f'<form class="search-box"><input name="q"> Search</form><ul class="menu">{links}</ul></div>'
+                f'<div id="cookie-notice">{bp["cookie"]}</div><div id="MainContent">{policy}</div>'
+                f'<div class="footer"><p>{bp["footer"]}</p></div></form>')
+    elif layout == 'wiki':
+        toc = ''.join(f'<li><a href="#{topic}">{topic}</a></li>' for topic in TOPICS)
+        body = (f'<div id="mw-head"><ul>{links}</ul></div><div id="siteNotice">{bp["cookie"]}</div>'
+                f'<div id="content" class="mw-body"><div id="toc" class="toc"><ul>{toc}</ul></div>{policy}'
+                f'<div class="related-pages"><h3>{bp["sidebar"]}</h3><p>{bp["news"]}</p></div></div>'
+                f'<div id="footer"><p>{bp["breadcrumb"]}</p><p>{bp["footer"]}</p></div>')
+    else:
+        # No semantic tags or telling class names: only text and link density to go on
+        body = (f'<div><div>{bp["cookie"]}</div><div><ul>{links}</ul></div><div>{bp["breadcrumb"]}</div>'
+                f'<div><div><h3>{bp["sidebar"]}</h3><ul>{links}</ul></div><div>{policy}</div></div>'
+                f'<div><p>{bp["news"]}</p></div><div><p>{bp["footer"]}</p></div></div>')
+    return f"<!DOCTYPE html><html>{head}<body>{body}<script>{SCRIPT}</script></body></html>", sentences, phrases
+
+def baseline_text(html):
+    """The text /policyextractionfromurl sent before"""
+    soup = BeautifulSoup(html, 'html.parser')
+    for script in soup(["script", "style"]):
+        script.decompose()
+    return '\n'.join(line.strip() for line in soup.get_text().split('\n') if line.strip())
+
+def main_text(html):
+    text = html_content.extract_main_text(html)
+    return '\n'.join(line.strip() for line in text.split('\n') if line.strip())
+
+def kept(text, phrases):
+    flat = re.sub(r'\s+', ' ', text)
+    return sum(phrase in flat for phrase in phrases)
+
+def measure(extract, html, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        text = extract(html)
+    return text, (time.perf_counter() - start) / repeats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pages', type=int, default=10, help='Synthetic pages per layout')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed parses per page')
+    parser.add_argument('--corpus', help='Directory of saved .html pages to measure as well')
+    parser.add_argument('--seed', type=int, default=6)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'layout':13} {'method':9} {'html KB':>7} {'parse ms':>8} {'chars':>7} {'tokens':>7} "
+          f"{'policy kept':>11} {'boilerplate kept':>16}")
+    for layout in ('semantic', 'div-template', 'sharepoint', 'aspnet', 'wiki', 'unlabelled'):
+        pages = [page(layout, rng) for _ in range(args.pages)]
+        for method, extract in (('baseline', baseline_text), ('main', main_text)):
+            size = seconds = chars = tokens = 0
+            policy_found = policy_total = boilerplate_found = boilerplate_total = 0
+            for html, sentences, phrases in pages:
+                text, elapsed = measure(extract, html, args.repeats)
+                size += len(html)
+                seconds += elapsed
+                chars += len(text)
+                tokens += llm_utils.estimate_tokens(text)
+                policy_found += kept(text, sentences)
+                policy_total += len(sentences)
+                boilerplate_found += kept(text, phrases)
+                boilerplate_total += len(phrases)
+            count = len(pages)
+            print(f"{layout:13} {method:9} {size / count / 1024:7.0f} {seconds / count * 1000:8.1f} {chars / count:7,.0f} "
+                  f"{tokens / count:7,.0f} {policy_found / policy_total:11.1%} {boilerplate_found / boilerplate_total:16.1%}")
+
+    if args.corpus:
+        paths = sorted(glob.glob(os.path.join(args.corpus, '*.htm*')))
+        print(f"\n{len(paths)} saved pages in {args.corpus}")
+        print(f"{'page':40} {'html KB':>7} {'baseline ms':>11} {'main ms':>7} {'baseline tok':>12} {'main tok':>8}")
+        for path in paths:
+            with open(path, 'rb') as f:
+                html = html_content.decode(f.read())
+            before, before_seconds = measure(baseline_text, html, args.repeats)
+            after, after_seconds = measure(main_text, html, args.repeats)
+            print(f"{os.path.basename(path)[:40]:40} {len(html) / 1024:7.0f} {before_seconds * 1000:11.1f} "
+                  f"{after_seconds * 1000:7.1f} {llm_utils.estimate_tokens(before):12,} {llm_utils.estimate_tokens(after):8,}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Compare receipt extraction latency with and without tiered model routing.
+
+Receipts are sent to a local Bedrock stand-in (see bedrock_standin.py) that
+answers the fast model quickly and the Sonnet models slowly. A share of the
+fast model's receipts have amounts that don't add up, which validation
+catches and escalates. The same receipts are run with every call on the
+Sonnet models, as before tiering, and with the fast model first; latency
+percentiles, the fast tier's acceptance rate and the Sonnet calls made are
+reported. No AWS access is needed. Run from the backend directory:
+
+    python benchmarks/bench_model_tiers.py --receipts 200 --bad-rate 0.15
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'standin')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'standin')
+from bedrock_standin import StandIn
+import bedrock_pool
+import expensereportextractor
+import llm_output
+import llm_utils
+import metrics
+import scheduler
+
+RECEIPT = {
+    "invoiceNumber": "A-1001", "date": "2025-03-14", "currency": "EUR", "vendor": "Cafe Central",
+    "items": [{"description": "Lunch", "quantity": 2, "amount": "36.00"}],
+    "amount": "36.00", "taxes": "3.60", "total": "39.60"
+}
+
+class TieredStandIn(StandIn):
+    """Answers by model: the fast model quickly, sometimes wrongly; Sonnet slowly"""
+
+    def __init__(self, fast_latency, full_latency, bad_rate, seed):
+        super().__init__(latency=0, jitter=0, seed=seed)
+        self.fast_latency = fast_latency
+        self.full_latency = full_latency
+        self.bad_rate = bad_rate
+        self.models = {}
+
+    def _handler(self):
+        standin = self
+        handler = super()._handler()
+
+        class Handler(handler):
+            def do_POST(self):
+                model_id = self.path.split('/')[2]
+                fast = 'haiku' in model_id
+                with standin._lock:
+                    standin.models[model_id] = standin.models.get(model_id, 0) + 1
+                    bad = fast and standin._rng.random() < standin.bad_rate
+                    delay = (standin.fast_latency if fast else standin.full_latency) * standin._rng.uniform(0.7, 1.5)
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                receipt = dict(RECEIPT, total="93.60") if bad else RECEIPT
+                time.sleep(delay)
+                content = [{"type": "tool_use", "id": "toolu_standin", "name": body['tool_choice']['name'], "input": receipt}]
+                self._reply(200, {"id": "msg_standin", "type": "message", "role": "assistant", "content": content,
+                                  "stop_reason": "tool_use", "usage": {"input_tokens": 1500, "output_tokens": 200}})
+
+        return Handler
+
+def extract(_):
+    start = time.perf_counter()
+    _, receipt, errors = expensereportextractor.invoke_tiered(
+        'receipt', expensereportextractor.get_extraction_prompt(), llm_output.RECEIPT_TOOL,
+        expensereportextractor.parse_receipt, llm_output.check_receipt, image_data=b'\xff\xd8jpeg', kind='receipt')
+    metrics.observe('bench_receipt_seconds', time.perf_counter() - start)
+    if receipt is None or errors or llm_output.check_receipt(receipt):
+        metrics.increment('bench_bad_receipts')
+
+def run(label, tiering, standin, args):
+    metrics.reset()
+    standin.models.clear()
+    llm_utils.MODEL_TIERING_ENABLED = tiering
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(extract, range(args.receipts)))
+
+    status = expensereportextractor.tier_status()['kinds']['receipt']
+    sonnet_calls = sum(calls for model, calls in standin.models.items() if 'haiku' not in model)
+    print(f"\n{label}")
+    print(f"  latency  p50 {metrics.percentile('bench_receipt_seconds', 50) * 1000:6.0f} ms   "
+          f"p95 {metrics.percentile('bench_receipt_seconds', 95) * 1000:6.0f} ms")
+    if tiering:
+        print(f"  fast tier accepted {status['tiers']['fast']['accepted']}/{status['tiers']['fast']['calls']}   "
+              f"escalated {status['escalations']}")
+    print(f"  Sonnet calls {sonnet_calls}   receipts failing validation {metrics.counter('bench_bad_receipts')}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--receipts', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--bad-rate', type=float, default=0.15, help="Share of the fast model's receipts that don't add up")
+    parser.add_argument('--fast-latency', type=float, default=0.3, help='Fast model call in seconds')
+    parser.add_argument('--full-latency', type=float, default=1.2, help='Sonnet call in seconds')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    standin = TieredStandIn(args.fast_latency, args.full_latency, args.bad_rate, args.seed).start()
+    bedrock_pool._pool = bedrock_pool.BedrockPool(
+        bedrock_pool.parse_endpoints(json.dumps([{"region": "us-east-1", "endpoint_url": standin.url}])))
+    scheduler.SCHEDULER_ENABLED = False
+    try:
+        run('Sonnet only', False, standin, args)
+        run('fast model first', True, standin, args)
+    finally:
+        standin.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark the blank/duplicate page pre-filter on a synthetic scanned manual.
+
+The manual mimics a scanned policy handbook: a cover page, text pages with
+scanner noise and slight skew, blank versos, coloured separator sheets and an
+appendix that is repeated at the end. Run from the backend directory:
+
+    python benchmarks/bench_page_filter.py [--pages 120] [--dpi 300]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import page_filter
+
+WORDS = ("expense receipt approval must should limit maximum travel meals hotel "
+         "reimbursement manager policy employee submit within days required "
+         "itemised original claim allowance per diem economy class").split()
+
+def scanner_noise(image, rng, speckles=400):
+    """Add paper grain, speckle, a slight skew and blur like a desktop scanner"""
+    draw = ImageDraw.Draw(image)
+    for _ in range(speckles):
+        x, y = rng.randrange(image.width), rng.randrange(image.height)
+        shade = rng.randrange(90, 200)
+        draw.point((x, y), fill=(shade, shade, shade))
+    image = image.rotate(rng.uniform(-0.6, 0.6), fillcolor=(246, 244, 240))
+    return image.filter(ImageFilter.GaussianBlur(0.6))
+
+def text_page(width, height, seed):
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), (246, 244, 240))
+    draw = ImageDraw.Draw(image)
+    margin = width // 10
+    line_height = max(12, height // 60)
+    y = margin
+    while y < height - margin:
+        if rng.random() < 0.08:
+            y += line_height  # paragraph break
+            continue
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randrange(6, 14)))
+        # Draw each glyph run as a filled bar sized like a word at this scale
+        x = margin
+        for word in line.split():
+            word_w = len(word) * line_height // 2
+            if x + word_w > width - margin:
+                break
+            draw.rectangle((x, y, x + word_w, y + line_height * 2 // 3), fill=(30, 30, 30))
+            x += word_w + line_height // 2
+        y += line_height * 3 // 2
+    return scanner_noise(image, rng)
+
+def cover_page(width, height, seed):
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), (246, 244, 240))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((width // 4, height // 5, width * 3 // 4, height // 3), fill=(20, 60, 120))
+    draw.rectangle((width // 6, height // 2, width * 5 // 6, height // 2 + height // 30), fill=(30, 30, 30))
+    return scanner_noise(image, rng)
+
+def blank_page(width, height, seed):
+    image = Image.new('RGB', (width, height), (246, 244, 240))
+    return scanner_noise(image, random.Random(seed), speckles=1500)
+
+def separator_page(width, height, seed):
+    image = Image.new('RGB', (width, height), (150, 190, 230))
+    return scanner_noise(image, random.Random(seed), speckles=800)
+
+def build_manual(pages, dpi):
+    """Return a list of (label, image) pages"""
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    appendix = [text_page(width, height, 10_000 + i) for i in range(3)]
+    manual = [('cover', cover_page(width, height, 0))]
+
+    page = 1
+    while len(manual) < pages - len(appendix) * 2:
+        if page % 12 == 0:
+            manual.append(('separator', separator_page(width, height, page)))
+        elif page % 5 == 0:
+            manual.append(('blank', blank_page(width, height, page)))
+        else:
+            manual.append(('text', text_page(width, height, page)))
+        page += 1
+
+    manual.extend(('appendix', image) for image in appendix)
+    # The appendix is repeated at the back of the manual, re-scanned
+    rng = random.Random(99)
+    manual.extend(('duplicate', scanner_noise(image.copy(), rng, speckles=200)) for image in appendix)
+    return manual
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pages', type=int, default=120)
+    parser.add_argument('--dpi', type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"Building {args.pages}-page synthetic manual at {args.dpi} DPI...")
+    manual = build_manual(args.pages, args.dpi)
+
+    pre_filter = page_filter.PageFilter()
+    counts = {}
+    mistakes = []
+    start_time = time.perf_counter()
+    for page_num, (label, image) in enumerate(manual):
+        decision = pre_filter.classify(image, page_num)
+        counts[decision.action] = counts.get(decision.action, 0) + 1
+        expected = {'blank': 'blank', 'separator': 'blank', 'duplicate': 'duplicate'}.get(label, 'process')
+        if decision.action != expected:
+            mistakes.append((page_num + 1, label, decision.describe()))
+    elapsed = time.perf_counter() - start_time
+
+    skipped = counts.get('blank', 0) + counts.get('duplicate', 0)
+    print(f"Pages:            {len(manual)}")
+    print(f"Filter time:      {elapsed:.2f}s total, {elapsed / len(manual) * 1000:.1f} ms/page")
+    print(f"Decisions:        {counts}")
+    print(f"LLM calls saved:  {skipped} of {len(manual)} ({skipped / len(manual):.0%})")
+    print(f"Misclassified:    {len(mistakes)}")
+    for page, label, description in mistakes:
+        print(f"  page {page} ({label}): {description}")
+
+if __name__ == '__main__':
+    main()
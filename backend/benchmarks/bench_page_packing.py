@@ -0,0 +1,193 @@
+"""
+Compare per-page and packed policy extraction calls, tokens and wall time.
+
+A synthetic policy document (sparse and dense pages, some rules running
+onto the next page) is rendered as in bench_render_pool.py and extracted
+with extract_rendered_policies against a local Bedrock stand-in, once with
+one request per page and once with page packing. The stand-in answers the
+way the prompts ask: a per-page request sees only half of a rule that spans
+a page break, a packed request returns it whole on the page it starts on.
+Its latency grows with the images sent and the tokens generated. Reported
+per document: requests, estimated input and output tokens, wall time, and
+rules found whole, split or duplicated and attributed to the right page.
+No AWS access or poppler is needed. Run from the backend directory:
+
+    python benchmarks/bench_page_packing.py --pages 36
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from multiprocessing import shared_memory
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'standin')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'standin')
+from bedrock_standin import StandIn
+import bedrock_pool
+import bench_render_pool
+import expensereportextractor
+import render_pool
+import scheduler
+
+# Input tokens of a full-size page image (about 1568 px on the long edge)
+IMAGE_TOKENS = 1600
+
+def make_document(pages, seed):
+    """Rules per page as {page: [(rule_id, spans_next_page)]}"""
+    rng = random.Random(seed)
+    document = {}
+    rule_id = 0
+    for page in range(pages):
+        count = rng.randint(4, 6) if rng.random() < 0.3 else rng.randint(1, 2)
+        rules = []
+        for index in range(count):
+            rule_id += 1
+            spans = index == count - 1 and page < pages - 1 and rng.random() < 0.3
+            rules.append((rule_id, spans))
+        document[page] = rules
+    return document
+
+class PolicyStandIn(StandIn):
+    """Answers policy extraction requests from the synthetic document"""
+
+    def __init__(self, document, image_pages, time_scale, seed):
+        super().__init__(latency=0, jitter=0, seed=seed)
+        self.document = document
+        self.image_pages = image_pages
+        self.time_scale = time_scale
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def policies(self, pages, context, continues):
+        spans_from = {page + 1 for page, rules in self.document.items() if rules and rules[-1][1]}
+        seen = set(pages) | ({context} if context is not None else set())
+        policies = []
+
+        def add(text, page):
+            policies.append({"text": text, "page": page + 1, "country": "global", "expenseType": "other",
+                             "seniority": "all", "confidence": 0.9})
+
+        if context is not None and self.document[context][-1][1] and context + 1 in pages:
+            add(f"Rule {self.document[context][-1][0]} in full", context)
+        for page in pages:
+            if page in spans_from and page - 1 not in seen:
+                add(f"Rule {self.document[page - 1][-1][0]} (second part)", page)
+            for rule_id, spans in self.document[page]:
+                if not spans:
+                    add(f"Rule {rule_id} in full", page)
+                elif page + 1 in seen:
+                    add(f"Rule {rule_id} in full", page)
+                elif not continues:
+                    add(f"Rule {rule_id} (first part)", page)
+        return policies
+
+    def _handler(self):
+        standin = self
+        handler = super()._handler()
+
+        class Handler(handler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                content = body['messages'][0]['content']
+                prompt = content[-1]['text']
+                images = [block['source']['data'] for block in content if block['type'] == 'image']
+                labels = [int(m) - 1 for block in content if block['type'] == 'text'
+                          for m in re.findall(r'^Page (\d+):$', block['text'])]
+                pages = labels or [standin.image_pages[hashlib.sha1(images[0].encode()).hexdigest()]]
+
+                match = re.search(r'Page (\d+) is included only as context', prompt)
+                context = int(match.group(1)) - 1 if match else None
+                if context is not None:
+                    pages = [page for page in pages if page != context]
+                # A single page sent alone can't be told a rule continues, so it reports halves
+                continues = 'The document continues after page' in prompt
+
+                output = {"policies": standin.policies(pages, context, continues)}
+                output_tokens = len(json.dumps(output)) // 4
+                input_tokens = len(prompt) // 4 + IMAGE_TOKENS * len(images)
+                with standin._lock:
+                    standin.calls += 1
+                    standin.input_tokens += input_tokens
+                    standin.output_tokens += output_tokens
+                time.sleep(standin.time_scale * (0.6 + 0.1 * len(images) + output_tokens / 80))
+                block = {"type": "tool_use", "id": "toolu_standin", "name": body['tool_choice']['name'], "input": output}
+                self._reply(200, {"id": "msg_standin", "type": "message", "role": "assistant", "content": [block],
+                                  "stop_reason": "tool_use",
+                                  "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}})
+
+        return Handler
+
+def render(args):
+    """Synthetic pages as share_page results, and the page each image encodes"""
+    pages = [bench_render_pool.synthetic_page(page_num, args.dpi) for page_num in range(args.pages)]
+    image_pages = {}
+    for page in pages:
+        name, lengths = page['shared']
+        block = shared_memory.SharedMemory(name=name)
+        data = bytes(block.buf[:lengths[0]])
+        block.close()
+        image_pages[hashlib.sha1(data).hexdigest()] = page['pageNum']
+    return pages, image_pages
+
+def score(document, policies):
+    found = {}
+    misplaced = 0
+    for policy in policies:
+        rule_id = int(re.search(r'Rule (\d+)', policy['text']).group(1))
+        found.setdefault(rule_id, []).append(policy['text'])
+        start = next(page for page, rules in document.items() if any(rule[0] == rule_id for rule in rules))
+        if policy['page'] != start + 1 and 'second part' not in policy['text']:
+            misplaced += 1
+    rules = [rule for rules in document.values() for rule in rules]
+    whole = sum(1 for rule_id, _ in rules if any('in full' in text for text in found.get(rule_id, [])))
+    split = sum(1 for rule_id, _ in rules if any('part)' in text for text in found.get(rule_id, [])))
+    duplicated = sum(1 for texts in found.values() if sum('in full' in text for text in texts) > 1)
+    return len(rules), whole, split, duplicated, misplaced
+
+def run(label, pack, args, document):
+    pages, image_pages = render(args)
+    standin = PolicyStandIn(document, image_pages, args.time_scale, args.seed).start()
+    bedrock_pool._pool = bedrock_pool.BedrockPool(
+        bedrock_pool.parse_endpoints(json.dumps([{"region": "us-east-1", "endpoint_url": standin.url}])))
+    try:
+        start = time.perf_counter()
+        result = expensereportextractor.extract_rendered_policies(
+            (page for page in pages), args.pages, args.dpi, rerender=None, max_workers=args.workers, pack_pages=pack)
+        elapsed = time.perf_counter() - start
+    finally:
+        standin.stop()
+
+    total, whole, split, duplicated, misplaced = score(document, result['policies'])
+    return label, standin.calls, standin.input_tokens, standin.output_tokens, elapsed, total, whole, split, duplicated, misplaced
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pages', type=int, default=36)
+    parser.add_argument('--dpi', type=int, default=50, help='Synthetic page resolution (token estimates assume full size)')
+    parser.add_argument('--workers', type=int, default=12, help='LLM worker threads')
+    parser.add_argument('--time-scale', type=float, default=0.25, help='Multiplier on the simulated call latency')
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    render_pool.RENDER_POOL_ENABLED = False
+    scheduler.SCHEDULER_ENABLED = False
+    document = make_document(args.pages, args.seed)
+    rows = [run('per page', False, args, document), run('packed', True, args, document)]
+
+    print(f"\n{args.pages} pages, {sum(map(len, document.values()))} rules "
+          f"({sum(1 for rules in document.values() if rules[-1][1])} running onto the next page)")
+    print(f"{'mode':10} {'requests':>8} {'input tok':>10} {'output tok':>10} {'wall s':>7}   "
+          f"{'whole':>5} {'split':>5} {'dup':>4} {'wrong page':>10}")
+    for label, calls, input_tokens, output_tokens, elapsed, total, whole, split, duplicated, misplaced in rows:
+        print(f"{label:10} {calls:8} {input_tokens:10,} {output_tokens:10,} {elapsed:7.2f}   "
+              f"{whole:5} {split:5} {duplicated:4} {misplaced:10}")
+
+if __name__ == '__main__':
+    main()
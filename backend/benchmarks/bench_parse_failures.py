@@ -0,0 +1,64 @@
+"""
+Measure LLM response parse-failure rates in text and tool (structured) mode.
+
+Runs every receipt in the corpus directory (PDF/JPG) through extractfields
+once per output mode against Bedrock and reports how many responses could
+not be parsed or failed schema validation. Requires AWS credentials.
+Run from the backend directory:
+
+    python benchmarks/bench_parse_failures.py path/to/receipts/ [--modes text tool]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['RECEIPT_INDEX_ENABLED'] = 'False'  # every receipt must reach the model
+import expensereportextractor
+import llm_output
+import llm_utils
+import metrics
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('corpus', help='Directory containing receipt PDFs/JPGs')
+    parser.add_argument('--modes', nargs='+', default=['text', 'tool'], choices=['text', 'tool'])
+    args = parser.parse_args()
+
+    files = sorted(
+        name for name in os.listdir(args.corpus)
+        if name.lower().endswith(('.pdf', '.jpg', '.jpeg'))
+    )
+    if not files:
+        print("No receipts found")
+        return
+
+    for mode in args.modes:
+        llm_utils.STRUCTURED_OUTPUT = mode == 'tool'
+        metrics.reset()
+        invalid = 0
+        start = time.perf_counter()
+
+        for name in files:
+            file_type = 'pdf' if name.lower().endswith('.pdf') else 'image'
+            try:
+                response = expensereportextractor.extractfields(os.path.join(args.corpus, name), file_type=file_type)
+                receipt = json.loads(response) if isinstance(response, str) else None
+                invalid += receipt is None or bool(llm_output.validate(receipt, llm_output.RECEIPT_SCHEMA))
+            except ValueError:
+                invalid += 1
+            except Exception as e:
+                print(f"{name}: {e}")
+                invalid += 1
+
+        responses = metrics.counter('llm_responses', kind='receipt', mode=mode)
+        failures = metrics.counter('llm_parse_failures', kind='receipt', mode=mode)
+        errors = metrics.counter('llm_errors', kind='receipt', mode=mode)
+        print(f"{mode:>4} mode: {len(files)} receipts in {time.perf_counter() - start:.1f}s, "
+              f"{responses} responses, parse failures {failures} ({failures / max(1, responses):.1%}), "
+              f"call errors {errors}, invalid results {invalid} ({invalid / len(files):.1%})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark near-duplicate lookups in the receipt index.
+
+Fills an in-memory index with random receipt hashes, then times lookups for
+exact copies, near-duplicates (a few flipped bits) and unseen receipts.
+Run from the backend directory:
+
+    python benchmarks/bench_receipt_index.py [--receipts 1000000] [--queries 20000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import receipt_index
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+def time_lookups(index, queries):
+    timings = []
+    hits = 0
+    for phash in queries:
+        start = time.perf_counter()
+        if index.nearest(phash):
+            hits += 1
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'hits': hits,
+        'p50_us': statistics.median(timings) * 1e6,
+        'p99_us': timings[int(len(timings) * 0.99)] * 1e6,
+        'max_us': timings[-1] * 1e6
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--receipts', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=20_000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    index = receipt_index.ReceiptIndex(path=':memory:')
+
+    start = time.perf_counter()
+    hashes = [rng.getrandbits(64) for _ in range(args.receipts)]
+    index.add_many((phash, '{}') for phash in hashes)
+    print(f"Indexed {len(index):,} receipts in {time.perf_counter() - start:.1f}s")
+
+    cases = {
+        'exact': [rng.choice(hashes) for _ in range(args.queries)],
+        'near (3 bits)': [flip_bits(rng.choice(hashes), 3, rng) for _ in range(args.queries)],
+        'near (7 bits)': [flip_bits(rng.choice(hashes), 7, rng) for _ in range(args.queries)],
+        'unseen': [rng.getrandbits(64) for _ in range(args.queries)]
+    }
+    for name, queries in cases.items():
+        result = time_lookups(index, queries)
+        print(f"{name:<14} hits {result['hits']:>6}/{len(queries)}  "
+              f"p50 {result['p50_us']:7.1f}us  p99 {result['p99_us']:7.1f}us  max {result['max_us']:8.1f}us")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark card statement reconciliation on synthetic data.
+
+Generates N receipts and a CSV card statement of N transactions: most
+transactions have a receipt (posted 0-3 days later, with a card-style
+merchant descriptor, some paid in a foreign currency or with a tip added),
+the rest have none. Charges are negative amounts; refunds of receipted
+purchases and card payments are positive and must not be matched.
+Reports index build and streaming parse+match time, plus the precision and
+recall of confident matches. Run from the backend directory:
+
+    python benchmarks/bench_reconciliation.py --count 100000
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fx_rates
+import reconciliation
+
+# Generic words shared by many merchants, plus generated brand names
+GENERIC_WORDS = ['cafe', 'grill', 'market', 'express', 'airlines', 'hotel', 'coffee', 'books', 'taxi', 'bistro',
+                 'store', 'pharmacy', 'parking', 'restaurant', 'bar', 'kitchen', 'supply', 'travel', 'inn', 'deli']
+SYLLABLES = ['ka', 'lo', 'mi', 'ran', 'tek', 'vo', 'su', 'bel', 'dor', 'fin', 'gra', 'hal', 'jen', 'kor', 'lum',
+             'mar', 'nov', 'pel', 'qui', 'ros', 'sil', 'tor', 'ul', 'ven', 'wes', 'xan', 'yor', 'zen']
+FOREIGN_CURRENCIES = ['EUR', 'GBP', 'CAD', 'JPY']
+
+def card_descriptor(vendor, rng):
+    """Turn a receipt vendor into what a card statement shows"""
+    name = vendor.upper()
+    if rng.random() < 0.3:
+        name = name[:rng.randint(8, 14)]
+    prefix = rng.choice(['', '', 'SQ *', 'TST* ', 'PAYPAL *'])
+    return f"{prefix}{name} {rng.randint(100, 9999)}"
+
+def synthetic_data(count, matched_fraction=0.85, seed=11):
+    rng = random.Random(seed)
+    vendors = [
+        ' '.join([''.join(rng.sample(SYLLABLES, rng.randint(2, 3)))] + rng.sample(GENERIC_WORDS, rng.randint(0, 2))).title()
+        for _ in range(20000)
+    ]
+    start = date(2024, 1, 1)
+    receipts, rows, truth = [], [], {}
+    credits = 0
+
+    for index in range(count):
+        vendor = rng.choice(vendors)
+        day = start + timedelta(days=rng.randrange(365))
+        cents = rng.randint(300, 90_000)
+        txn_id = f"T{index}"
+        receipt_id = f"R{index}"
+
+        currency = 'USD'
+        receipt_cents = cents
+        if rng.random() < 0.05:
+            currency = rng.choice(FOREIGN_CURRENCIES)
+            receipt_cents = int(cents * float(fx_rates.rate('USD', currency)) * rng.uniform(0.99, 1.01))
+
+        receipts.append({'id': receipt_id, 'date': day.isoformat(), 'vendor': vendor,
+                         'total': f"{receipt_cents / 100:.2f}", 'currency': currency})
+
+        if rng.random() < matched_fraction:
+            truth[txn_id] = receipt_id
+            posted = day + timedelta(days=rng.choice([0, 0, 1, 1, 2, 3]))
+            charged = cents
+            if currency == 'USD' and rng.random() < 0.05:
+                charged = int(cents * rng.uniform(1.1, 1.25))  # tip added after the receipt was printed
+            rows.append((txn_id, posted.isoformat(), card_descriptor(vendor, rng), f"-{charged / 100:.2f}"))
+            if rng.random() < 0.02:
+                # Refunded in full a few days later: same merchant and amount
+                credits += 1
+                refunded = posted + timedelta(days=rng.randint(1, 4))
+                rows.append((f"{txn_id}-refund", refunded.isoformat(), card_descriptor(vendor, rng), f"{charged / 100:.2f}"))
+        else:
+            other = start + timedelta(days=rng.randrange(365))
+            rows.append((txn_id, other.isoformat(), card_descriptor(rng.choice(vendors), rng),
+                         f"-{rng.randint(300, 90_000) / 100:.2f}"))
+
+    for month in range(12):
+        credits += 1
+        rows.append((f"P{month}", date(2024, month + 1, 20).isoformat(), "PAYMENT THANK YOU",
+                     f"{rng.randint(50_000, 5_000_000) / 100:.2f}"))
+
+    rng.shuffle(rows)
+    statement = io.StringIO()
+    statement.write("Transaction ID,Transaction Date,Description,Amount,Card Number\n")
+    for txn_id, posted, description, amount in rows:
+        statement.write(f'{txn_id},{posted},"{description}",{amount},****4567\n')
+    return receipts, statement.getvalue().encode(), truth, credits
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=100_000, help='Receipts and transactions to generate')
+    args = parser.parse_args()
+
+    receipts, statement, truth, credits = synthetic_data(args.count)
+    print(f"Statement: {len(statement) / 1024 / 1024:.1f} MiB, {args.count:,} transactions, {len(receipts):,} receipts")
+
+    start = time.perf_counter()
+    matcher = reconciliation.ReceiptMatcher(receipts)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = reconciliation.reconcile(reconciliation.iter_statement(io.BytesIO(statement), 'statement.csv'), matcher)
+    match_time = time.perf_counter() - start
+
+    correct = sum(1 for item in result['matched'] if truth.get(item['id']) == item['match']['receiptId'])
+    summary = result['summary']
+    print(f"Index build:          {build:.2f} s")
+    print(f"Parse + match:        {match_time:.2f} s ({summary['transactions'] / match_time:,.0f} transactions/s)")
+    print(f"Confident matches:    {summary['matched']:,} (precision {correct / max(summary['matched'], 1):.2%}, "
+          f"recall {correct / len(truth):.2%})")
+    print(f"Review queue:         {summary['review']:,}")
+    print(f"Unmatched:            {summary['unmatched']:,} (expected about {args.count - len(truth):,})")
+    print(f"Credits:              {summary['credits']:,} (expected {credits:,})")
+
+if __name__ == '__main__':
+    main()
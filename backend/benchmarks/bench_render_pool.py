@@ -0,0 +1,104 @@
+"""
+Measure how policy page rendering and encoding scale with the render pool.
+
+Runs the per-page CPU work of extract_policies_from_pdf (render, greyscale
+analysis, JPEG encode, base64, hand-off through shared memory) for every
+page, first on 12 threads in one process as before the render pool, then
+in the render pool with 1, 2, 4, ... worker processes up to the core count,
+and reports pages per second. No LLM calls are made. Pages come from a PDF
+(requires poppler) or, without one, are drawn synthetically in the worker
+as a stand-in for rasterisation. Run from the backend directory:
+
+    python benchmarks/bench_render_pool.py --pages 48
+    python benchmarks/bench_render_pool.py --pdf path/to/policy.pdf
+"""
+import argparse
+import concurrent.futures
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from PIL import Image, ImageDraw
+import expensereportextractor
+import page_filter
+import render_pool
+
+LETTER_INCHES = (8.5, 11)
+
+def synthetic_page(page_num, dpi):
+    """Draw a text page at dpi and prepare it like render_policy_page does"""
+    rng = random.Random(page_num)
+    size = (int(LETTER_INCHES[0] * dpi), int(LETTER_INCHES[1] * dpi))
+    image = Image.effect_noise(size, 6).point(lambda level: 255 - level // 4).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    line_height = max(12, dpi // 6)
+    for top in range(dpi // 2, size[1] - dpi // 2, line_height):
+        words = ' '.join(rng.choice(['Expenses', 'must', 'be', 'approved', 'within', '30', 'days', 'receipt'])
+                         for _ in range(14))
+        draw.text((dpi // 2, top), words, fill='black')
+
+    gray = page_filter.load_analysis_image(image)
+    ink_coverage, _ = page_filter.ink_statistics(gray)
+    return expensereportextractor.share_page(image, page_num, dpi, gray, ink_coverage)
+
+def page_jobs(args):
+    if args.pdf:
+        from pdf2image import pdfinfo_from_path
+        page_count = pdfinfo_from_path(args.pdf).get('Pages', 0)
+        return expensereportextractor.render_policy_page, [(args.pdf, n, args.dpi) for n in range(page_count)]
+
+    # Referenced through the module (not __main__) so workers can import it
+    import bench_render_pool
+    return bench_render_pool.synthetic_page, [(n, args.dpi) for n in range(args.pages)]
+
+def run_threads(function, jobs, threads):
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(function, *job) for job in jobs]
+        for future in futures:
+            expensereportextractor.load_shared_page(future.result())
+    return time.perf_counter() - start
+
+def run_pool(function, jobs, workers):
+    render_pool.RENDER_POOL_WORKERS = workers
+    render_pool._executor = None
+    executor = render_pool.get_executor()
+    # Start the workers first: the pool is reused across requests, so its
+    # start-up is not part of the per-document cost
+    list(executor.map(abs, range(workers * 4)))
+
+    start = time.perf_counter()
+    for page in render_pool.map_ordered(function, jobs):
+        expensereportextractor.load_shared_page(page)
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pdf', help='PDF to render (default: synthetic pages)')
+    parser.add_argument('--pages', type=int, default=48, help='Synthetic pages to generate')
+    parser.add_argument('--dpi', type=int, default=150)
+    parser.add_argument('--threads', type=int, default=12, help='Threads in the single-process baseline')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    function, jobs = page_jobs(args)
+    print(f"{len(jobs)} pages at {args.dpi} DPI, {os.cpu_count()} cores")
+
+    baseline = run_threads(function, jobs, args.threads)
+    print(f"{args.threads} threads, 1 process   {len(jobs) / baseline:7.1f} pages/s")
+
+    workers = 1
+    while True:
+        elapsed = run_pool(function, jobs, workers)
+        print(f"render pool, {workers:2} workers  {len(jobs) / elapsed:7.1f} pages/s  ({baseline / elapsed:.1f}x threads)")
+        if workers >= args.max_workers:
+            break
+        workers = min(workers * 2, args.max_workers)
+
+if __name__ == '__main__':
+    main()
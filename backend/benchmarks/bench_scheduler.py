@@ -0,0 +1,115 @@
+"""
+Simulate interactive receipts arriving during bulk policy extraction.
+
+Two tenants upload large policy documents (tenant "a" three, tenant "b"
+one), each processed by 12 page threads, while interactive receipt
+requests arrive at a steady rate. Every LLM call is a simulated sleep
+holding one of the scheduler's slots. The run is repeated with a single
+FIFO class (every request treated alike, as before the scheduler) and with
+priority classes, and the interactive latency, the bulk pages completed per
+tenant and the requests rejected with 429 are reported. No AWS access is
+needed. Run from the backend directory:
+
+    python benchmarks/bench_scheduler.py --seconds 10
+"""
+import argparse
+import concurrent.futures
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+import scheduler
+
+def llm_call(sched, rng, lock, median):
+    with lock:
+        duration = rng.lognormvariate(0, 0.3) * median
+    with sched.slot():
+        time.sleep(duration)
+
+def bulk_document(sched, prioritised, tenant, pages, args, rng, lock, done):
+    try:
+        with sched.admit(scheduler.BULK, tenant if prioritised else scheduler.DEFAULT_TENANT):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=12) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, llm_call, sched, rng, lock, args.median)
+                           for _ in range(pages)]
+                for future in futures:
+                    future.result()
+                    with lock:
+                        done[tenant] = done.get(tenant, 0) + 1
+    except scheduler.Overloaded:
+        metrics.increment('bench_rejected', priority=scheduler.BULK)
+
+def interactive_request(sched, prioritised, rng, lock, args):
+    start = time.perf_counter()
+    try:
+        if prioritised:
+            admission = sched.admit(scheduler.INTERACTIVE, f"user{rng.randrange(50)}")
+        else:
+            admission = sched.admit(scheduler.BULK, scheduler.DEFAULT_TENANT)
+        with admission:
+            llm_call(sched, rng, lock, args.median)
+        metrics.observe('bench_interactive_seconds', time.perf_counter() - start)
+    except scheduler.Overloaded:
+        metrics.increment('bench_rejected', priority=scheduler.INTERACTIVE)
+
+def run(label, prioritised, args):
+    metrics.reset()
+    if prioritised:
+        sched = scheduler.Scheduler(slots=args.slots)
+    else:
+        # One class and tenant with no limits: a plain FIFO, as before
+        sched = scheduler.Scheduler(slots=args.slots, max_requests={p: 10_000 for p in scheduler.PRIORITIES},
+                                    tenant_max_share=1.0, bulk_max_slot_share=1.0)
+    rng = random.Random(args.seed)
+    lock = threading.Lock()
+    done = {}
+
+    bulk_threads = [
+        threading.Thread(target=bulk_document,
+                         args=(sched, prioritised, tenant, args.pages, args, rng, lock, done))
+        for tenant in ('a', 'a', 'a', 'b')
+    ]
+    for thread in bulk_threads:
+        thread.start()
+
+    stop = time.perf_counter() + args.seconds
+    interactive_threads = []
+    while time.perf_counter() < stop:
+        thread = threading.Thread(target=interactive_request, args=(sched, prioritised, rng, lock, args))
+        thread.start()
+        interactive_threads.append(thread)
+        time.sleep(rng.expovariate(args.rate))
+    for thread in interactive_threads:
+        thread.join()
+    pages_in_window = dict(done)
+    for thread in bulk_threads:
+        thread.join()
+
+    summary = metrics.snapshot()['summaries'].get('bench_interactive_seconds', {})
+    rejected = {p: metrics.counter('bench_rejected', priority=p) for p in (scheduler.INTERACTIVE, scheduler.BULK)}
+    print(f"\n{label}")
+    print(f"  interactive  p50 {summary.get('p50', 0) * 1000:6.0f} ms   p99 {summary.get('p99', 0) * 1000:6.0f} ms   "
+          f"completed {summary.get('count', 0):4}   rejected {rejected[scheduler.INTERACTIVE]}")
+    print(f"  bulk pages done while receipts arrived: tenant a {pages_in_window.get('a', 0):4}, "
+          f"tenant b {pages_in_window.get('b', 0):4}   documents rejected {rejected[scheduler.BULK]}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=10.0, help='How long interactive requests keep arriving')
+    parser.add_argument('--rate', type=float, default=20.0, help='Interactive requests per second')
+    parser.add_argument('--pages', type=int, default=500, help='Pages per bulk document')
+    parser.add_argument('--slots', type=int, default=16)
+    parser.add_argument('--median', type=float, default=0.1, help='Median simulated LLM call in seconds')
+    parser.add_argument('--seed', type=int, default=5)
+    args = parser.parse_args()
+
+    run('single FIFO class', False, args)
+    run('priority classes', True, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Measure single-flight coalescing of identical receipt uploads and compliance checks.
+
+Serves the app on a local threaded server against a Bedrock stand-in that
+answers receipts and compliance checks after a fixed latency (streaming
+when asked to). Bursts of identical requests (the same receipt uploaded,
+or the same check body with keys in a different order) are sent at once,
+with coalescing off and on; reported per route are Bedrock calls, requests
+coalesced, 429s and latency. Then identical checks are sent on raw sockets
+that are closed before the answer, with SINGLE_FLIGHT_CANCEL_STREAMS on:
+the computation they share should be cancelled (its stream closed) and the
+next identical request computed afresh. No AWS access is needed. Run from the backend directory:
+
+    python benchmarks/bench_single_flight.py --bursts 5 --duplicates 8
+"""
+import argparse
+import concurrent.futures
+import io
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'standin')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'standin')
+os.environ.setdefault('RECEIPT_INDEX_ENABLED', 'False')
+import requests
+from PIL import Image, ImageDraw
+from werkzeug.serving import make_server
+from bedrock_standin import StandIn
+import app
+import bedrock_pool
+import metrics
+import single_flight
+
+RECEIPT = {"invoiceNumber": "R-1042", "date": "2025-03-01", "vendor": "Cafe Central", "currency": "USD",
+           "total": "18.50", "expenseType": "meals", "items": [{"description": "Lunch", "quantity": 1, "amount": "18.50"}]}
+VERDICT = {"isCompliant": True, "violations": []}
+
+CHECK = {
+    "invoiceNumber": "R-1042", "date": "2025-03-01", "vendor": "Cafe Central", "currency": "USD", "total": "18.50",
+    "expenseCountry": "united states", "expenseType": "meals", "numberOfPeople": 1,
+    "items": [{"description": "Lunch", "quantity": 1, "amount": "18.50"}],
+    "seniority": "senior",
+    "policyRules": [{"rule": "Meals must not exceed $60 per person.", "country": "global", "seniority": "all",
+                     "expenseType": "meals"}]
+}
+
+class ExpenseStandIn(StandIn):
+    """Answers receipt extraction and compliance tool calls"""
+
+    def response(self, body):
+        name = (body.get('tool_choice') or {}).get('name')
+        output = RECEIPT if name == 'record_receipt' else VERDICT
+        content = [{"type": "tool_use", "id": "toolu_standin", "name": name, "input": output}]
+        return {"id": "msg_standin", "type": "message", "role": "assistant", "content": content,
+                "stop_reason": "tool_use", "usage": {"input_tokens": 900, "output_tokens": 60}}
+
+def receipt_jpeg():
+    image = Image.new('RGB', (600, 900), 'white')
+    draw = ImageDraw.Draw(image)
+    for row, line in enumerate(["CAFE CENTRAL", "2025-03-01", "Lunch   18.50", "TOTAL   18.50"]):
+        draw.text((60, 80 + row * 60), line, fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+def shuffled_check(rng):
+    """The same check body with its keys in a different order"""
+    items = list(CHECK.items())
+    rng.shuffle(items)
+    return json.dumps(dict(items), indent=rng.choice([None, 2]))
+
+def burst(url, route, duplicates, rng, jpeg):
+    def send(body):
+        start = time.perf_counter()
+        if route == 'receipt':
+            response = requests.post(f"{url}/expenseextractor", data={'fileType': 'image'},
+                                     files={'file': ('receipt.jpg', jpeg, 'image/jpeg')}, timeout=60)
+        else:
+            response = requests.post(f"{url}/expensepolicycheck", data=body,
+                                     headers={'Content-Type': 'application/json'}, timeout=60)
+        return response.status_code, time.perf_counter() - start
+
+    bodies = [shuffled_check(rng) for _ in range(duplicates)]
+    with concurrent.futures.ThreadPoolExecutor(duplicates) as pool:
+        return list(pool.map(send, bodies))
+
+def abandoned_checks(url, clients, wait):
+    """Send identical checks on raw sockets and close them all before the answer"""
+    host, port = url.replace('http://', '').split(':')
+    body = json.dumps(CHECK).encode()
+    sockets = []
+    for _ in range(clients):
+        sock = socket.create_connection((host, int(port)))
+        sock.sendall(b"POST /expensepolicycheck HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                     + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        sockets.append(sock)
+    time.sleep(wait)
+    for sock in sockets:
+        sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--bursts', type=int, default=5, help='Bursts per route and mode')
+    parser.add_argument('--duplicates', type=int, default=8, help='Identical requests per burst')
+    parser.add_argument('--latency', type=float, default=1.0, help='Stand-in response latency in seconds')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    standin = ExpenseStandIn(latency=args.latency, jitter=0).start()
+    bedrock_pool._pool = bedrock_pool.BedrockPool(
+        bedrock_pool.parse_endpoints(json.dumps([{"region": "us-east-1", "endpoint_url": standin.url}])))
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    rng = random.Random(args.seed)
+    jpeg = receipt_jpeg()
+
+    rows = []
+    try:
+        for route in ('receipt', 'compliance'):
+            for enabled in (False, True):
+                single_flight.SINGLE_FLIGHT_ENABLED = enabled
+                metrics.reset()
+                calls = standin.requests
+                results = []
+                for _ in range(args.bursts):
+                    results.extend(burst(url, route, args.duplicates, rng, jpeg))
+                latencies = sorted(seconds for status, seconds in results if status == 200)
+                rows.append((route, 'on' if enabled else 'off', len(results), standin.requests - calls,
+                             metrics.counter('single_flight_coalesced', kind=route),
+                             sum(status == 429 for status, _ in results), sum(status != 200 for status, _ in results),
+                             latencies[len(latencies) // 2] if latencies else 0, latencies[-1] if latencies else 0))
+
+        # Every client of a check going away cancels it; the next request computes afresh
+        single_flight.SINGLE_FLIGHT_ENABLED = True
+        single_flight.CANCEL_STREAMS = True
+        metrics.reset()
+        calls, cancelled = standin.requests, standin.cancelled
+        abandoned_checks(url, args.duplicates, args.latency * 0.4)
+        time.sleep(args.latency + single_flight.POLL_INTERVAL)
+        abandoned_calls, abandoned_streams = standin.requests - calls, standin.cancelled - cancelled
+        status, seconds = burst(url, 'compliance', 1, rng, jpeg)[0]
+    finally:
+        server.shutdown()
+        standin.stop()
+
+    print(f"\n{'route':10} {'coalesce':8} {'requests':>8} {'Bedrock calls':>13} {'coalesced':>9} "
+          f"{'429s':>5} {'errors':>6} {'p50 s':>6} {'max s':>6}")
+    for route, mode, count, calls, coalesced, rejected, errors, p50, slowest in rows:
+        print(f"{route:10} {mode:8} {count:8} {calls:13} {coalesced:9} {rejected:5} {errors:6} {p50:6.2f} {slowest:6.2f}")
+    print(f"\n{args.duplicates} identical checks abandoned by their clients: {abandoned_calls} Bedrock call(s), "
+          f"{abandoned_streams} stream(s) closed early, "
+          f"{metrics.counter('single_flight_disconnects', kind='compliance')} disconnects seen, "
+          f"{metrics.counter('single_flight_cancelled', kind='compliance')} computation(s) cancelled")
+    print(f"Next identical check: status {status} in {seconds:.2f}s, "
+          f"{metrics.counter('single_flight_computations', kind='compliance')} computations in total")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Evaluate relevance-ranked rule retrieval for compliance checks.
+
+Generates a large tenant policy set (a few hundred mostly global rules
+over meals, hotels, travel, phones, software, gifts and office purchases)
+in which every rule has a checkable condition, and a set of invoices of
+different expense types, some with violating line items. For each top-K,
+the rules rule_index.select_rules would send are compared with the rules
+each invoice actually violates, and the compact compliance prompt is
+measured with and without retrieval. Reports the recall of violated rules
+against the prompt size reduction. No LLM calls are made. Run from the
+backend directory:
+
+    python benchmarks/eval_rule_retrieval.py --rules 300 --invoices 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import expensereportextractor
+import llm_utils
+import rule_index
+
+DEPARTMENTS = ['sales', 'engineering', 'marketing', 'finance', 'support', 'operations', 'legal', 'hr']
+
+def has_item(invoice, *words):
+    return any(any(word in item['description'].lower() for word in words) for item in invoice['items'])
+
+def item_amount(invoice, *words):
+    return sum(item['amount'] for item in invoice['items'] if any(word in item['description'].lower() for word in words))
+
+def per_person(invoice):
+    return invoice['total'] / max(1, invoice['numberOfPeople'])
+
+# (text, predicate(invoice, limit)); {limit} and {dept} are filled in per rule
+TEMPLATES = [
+    ("Meal expenses for {dept} staff must not exceed ${limit} per person.",
+     lambda inv, limit: inv['expenseType'] == 'meals' and per_person(inv) > limit),
+    ("Alcoholic beverages such as wine, beer or spirits are not reimbursable for {dept} staff.",
+     lambda inv, limit: has_item(inv, 'wine', 'beer', 'spirits', 'cocktail')),
+    ("Tips above ${limit} on a restaurant bill are not reimbursed for {dept} staff.",
+     lambda inv, limit: item_amount(inv, 'tip') > limit),
+    ("Hotel room rates for {dept} staff must not exceed ${limit} per night.",
+     lambda inv, limit: item_amount(inv, 'room night') > limit),
+    ("Hotel minibar and room service charges are not reimbursable for {dept} staff.",
+     lambda inv, limit: has_item(inv, 'minibar', 'room service')),
+    ("{dept} staff must book flights in economy class; business class fares are not reimbursed.",
+     lambda inv, limit: has_item(inv, 'business class')),
+    ("Taxi and ride share fares above ${limit} require a written business justification from {dept} staff.",
+     lambda inv, limit: item_amount(inv, 'taxi', 'uber') > limit),
+    ("Car rentals for {dept} staff are limited to compact cars; SUV rentals are not approved.",
+     lambda inv, limit: has_item(inv, 'suv')),
+    ("Mobile phone bills for {dept} staff are reimbursed up to ${limit} per month.",
+     lambda inv, limit: inv['expenseType'] == 'mobile' and inv['total'] > limit),
+    ("International roaming charges require prior approval for {dept} staff.",
+     lambda inv, limit: has_item(inv, 'roaming')),
+    ("Software subscriptions bought by {dept} staff above ${limit} need IT approval.",
+     lambda inv, limit: inv['expenseType'] == 'software' and inv['total'] > limit),
+    ("Client gifts given by {dept} staff must not exceed ${limit} per recipient.",
+     lambda inv, limit: item_amount(inv, 'gift') > limit),
+    ("Office chairs and desks bought by {dept} staff require facilities approval.",
+     lambda inv, limit: has_item(inv, 'chair', 'desk')),
+    ("Parking fines and traffic penalties incurred by {dept} staff are never reimbursed.",
+     lambda inv, limit: has_item(inv, 'parking fine', 'penalty')),
+    ("Conference registration fees for {dept} staff above ${limit} need director sign-off.",
+     lambda inv, limit: has_item(inv, 'registration') and item_amount(inv, 'registration') > limit),
+    ("Laundry and dry cleaning during hotel stays of fewer than five nights are not covered for {dept} staff.",
+     lambda inv, limit: has_item(inv, 'laundry', 'dry cleaning')),
+]
+
+ITEMS = {
+    'meals': [('Set lunch', 25, 60), ('Dinner menu', 40, 120), ('Bottle of wine', 30, 90), ('Beer', 6, 12),
+              ('Tip', 5, 40), ('Coffee', 3, 8), ('Dessert', 6, 14)],
+    'accommodation': [('Room night', 120, 420), ('Minibar', 8, 40), ('Room service', 20, 70),
+                      ('Laundry service', 10, 45), ('City tax', 3, 12)],
+    'transportation': [('Taxi to airport', 20, 110), ('Uber ride', 10, 60), ('Economy flight', 150, 600),
+                       ('Business class flight', 900, 3500), ('SUV rental', 80, 220), ('Parking fine', 40, 120),
+                       ('Train ticket', 20, 140)],
+    'mobile': [('Monthly plan', 30, 90), ('Roaming data pack', 15, 80), ('Handset installment', 20, 60)],
+    'software': [('Annual license', 100, 1200), ('Monthly subscription', 10, 90)],
+    'entertainment': [('Client gift basket', 40, 250), ('Event tickets', 60, 300), ('Cocktail reception', 80, 400)],
+    'office_supplies': [('Office chair', 150, 600), ('Standing desk', 300, 900), ('Printer paper', 5, 30)],
+    'conferences': [('Conference registration', 200, 1800), ('Workshop ticket', 50, 300)],
+}
+
+def make_rules(count, seed):
+    rng = random.Random(seed)
+    rules = []
+    for index in range(count):
+        template, predicate = TEMPLATES[index % len(TEMPLATES)]
+        limit = rng.choice([20, 25, 30, 40, 50, 60, 75, 100, 150, 200, 250, 300, 500])
+        dept = rng.choice(DEPARTMENTS)
+        scope = rng.random()
+        rule = {
+            'rule': template.format(limit=limit, dept=dept.title() if template.startswith('{dept}') else dept),
+            # Mostly global, as in a large tenant; a few country or level specific rules
+            'country': 'united states' if scope < 0.05 else 'global',
+            'seniority': 'junior' if 0.05 <= scope < 0.08 else 'all',
+            'expenseType': 'all',
+        }
+        rules.append((rule, lambda invoice, predicate=predicate, limit=limit: predicate(invoice, limit)))
+    return rules
+
+def make_invoices(count, seed):
+    rng = random.Random(seed)
+    invoices = []
+    for _ in range(count):
+        expense_type = rng.choice(list(ITEMS))
+        items = [{'description': name, 'quantity': 1, 'amount': rng.randint(low, high)}
+                 for name, low, high in rng.sample(ITEMS[expense_type], k=min(len(ITEMS[expense_type]), rng.randint(1, 4)))]
+        people = rng.choice([1, 1, 1, 2, 4]) if expense_type in ('meals', 'entertainment') else 1
+        invoices.append({
+            'invoiceNumber': f"INV-{rng.randint(1000, 9999)}", 'date': '2025-03-01', 'vendor': 'Vendor',
+            'currency': 'USD', 'total': sum(item['amount'] for item in items), 'expenseCountry': 'united states',
+            'expenseType': expense_type, 'numberOfPeople': people, 'items': items
+        })
+    return invoices
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rules', type=int, default=300)
+    parser.add_argument('--invoices', type=int, default=200)
+    parser.add_argument('--top-k', type=int, nargs='+', default=[10, 25, 50, 100])
+    parser.add_argument('--seed', type=int, default=4)
+    args = parser.parse_args()
+
+    rules = make_rules(args.rules, args.seed)
+    policy_rules = [rule for rule, _ in rules]
+    checks = {rule_index.rule_key(rule): check for rule, check in rules}
+    invoices = make_invoices(args.invoices, args.seed + 1)
+
+    start = time.perf_counter()
+    rule_index.get_index('eval', policy_rules)
+    print(f"Indexed {len(policy_rules)} rules in {(time.perf_counter() - start) * 1000:.1f} ms")
+    # A policy update touching a few rules is applied to the index in place
+    changed = policy_rules[:-5] + [dict(rule, rule=rule['rule'] + ' Exceptions need CFO approval.') for rule in policy_rules[-5:]]
+    start = time.perf_counter()
+    rule_index.get_index('eval', changed)
+    rule_index.get_index('eval', policy_rules)
+    print(f"Applied and reverted a 5 rule update in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def prompt_tokens(invoice, selected):
+        prompt, _ = expensereportextractor.get_compact_compliance_prompt(
+            'senior', invoice, selected, '2025-03-10', budget=10 ** 9)
+        return llm_utils.estimate_tokens(prompt)
+
+    baseline = {}
+    for number, invoice in enumerate(invoices):
+        applicable = expensereportextractor.filter_applicable_policies(
+            policy_rules, 'united states', 'senior', invoice['expenseType'])
+        baseline[number] = (applicable, prompt_tokens(invoice, applicable))
+
+    violations = sum(1 for number, invoice in enumerate(invoices) for rule in baseline[number][0]
+                     if checks[rule_index.rule_key(rule)](invoice))
+    print(f"{len(invoices)} invoices, {violations} rule violations among the applicable rules")
+    print(f"\n{'top K':>6} {'rules sent':>10} {'recall':>7} {'invoices fully covered':>22} "
+          f"{'prompt tokens':>13} {'reduction':>9} {'select ms':>9}")
+
+    for top_k in args.top_k:
+        found = missed = fully_covered = sent = tokens = base_tokens = 0
+        elapsed = 0.0
+        for number, invoice in enumerate(invoices):
+            applicable, full_tokens = baseline[number]
+            start = time.perf_counter()
+            selected = rule_index.select_rules(policy_rules, applicable, invoice, 'eval', top_k=top_k)
+            elapsed += time.perf_counter() - start
+            selected_keys = {rule_index.rule_key(rule) for rule in selected}
+            violated = [rule_index.rule_key(rule) for rule in applicable if checks[rule_index.rule_key(rule)](invoice)]
+            hits = sum(key in selected_keys for key in violated)
+            found += hits
+            missed += len(violated) - hits
+            fully_covered += hits == len(violated)
+            sent += len(selected)
+            tokens += prompt_tokens(invoice, selected)
+            base_tokens += full_tokens
+        recall = found / max(1, found + missed)
+        print(f"{top_k:6} {sent / len(invoices):10.1f} {recall:7.1%} {fully_covered / len(invoices):22.1%} "
+              f"{tokens / len(invoices):13,.0f} {1 - tokens / base_tokens:9.1%} {elapsed / len(invoices) * 1000:9.2f}")
+    print(f"{'all':>6} {sum(len(a) for a, _ in baseline.values()) / len(invoices):10.1f} {1:7.1%} {1:22.1%} "
+          f"{base_tokens / len(invoices):13,.0f} {0:9.1%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,499 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+import numpy as np
+import fx_rates
+import llm_output
+
+DATA_FOLDER = os.getenv('DATA_FOLDER', os.path.join(os.path.dirname(__file__), 'data'))
+EXPENSE_STORE_PATH = os.getenv('EXPENSE_STORE_PATH', os.path.join(DATA_FOLDER, 'expenses.db'))
+
+GROUP_DIMENSIONS = ('category', 'department', 'currency', 'month')
+
+# Columns kept in memory for aggregation; amounts are integer cents in the
+# expense's own currency so running sums stay exact
+COLUMNS = (
+    ('amount_cents', np.int64),
+    ('day', np.int32),          # days since 1970-01-01
+    ('month', np.int32),        # months since 1970-01
+    ('category', np.int32),
+    ('department', np.int32),
+    ('currency', np.int32),
+    ('alive', np.bool_)
+)
+
+UNCATEGORIZED = 'uncategorized'
+UNASSIGNED = 'unassigned'
+UNKNOWN_CURRENCY = 'UNKNOWN'
+
+# Each tenant's expenses are stored, summed and deleted separately
+DEFAULT_TENANT = 'default'
+
+# Removed and replaced expenses leave dead rows in the columns, which scans
+# still step over; a tenant's columns are compacted once at least
+# COMPACT_MIN_DEAD_ROWS of its rows, and COMPACT_DEAD_RATIO of them, are dead
+COMPACT_DEAD_RATIO = 0.25
+COMPACT_MIN_DEAD_ROWS = 1024
+
+_EPOCH = date(1970, 1, 1)
+
+class _Vocabulary:
+    """Dictionary encoding of a string column"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+def _to_day(iso_date):
+    return (date.fromisoformat(iso_date) - _EPOCH).days
+
+def _filter_day(value, name):
+    """Days since epoch of a date filter; ValueError when it is not a parsable date"""
+    try:
+        return _to_day(llm_output.parse_date(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} is not a parsable date: {value!r}")
+
+def _month_label(month_code):
+    return f"{1970 + month_code // 12:04d}-{month_code % 12 + 1:02d}"
+
+def _months(days):
+    """Vectorised days-since-epoch -> months-since-epoch"""
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+def expense_record(expense):
+    """
+    Normalise an expense (an extraction in the get_extraction_prompt schema,
+    optionally with id/department/category) into a storable record.
+
+    Raises ValueError when the total or date cannot be parsed.
+    """
+    if not isinstance(expense, dict):
+        raise ValueError("Expense must be a JSON object")
+
+    amount = llm_output.parse_amount(expense.get('total', expense.get('amount')))
+    if amount is None:
+        raise ValueError("Expense has no parsable total")
+
+    iso_date = llm_output.parse_date(expense.get('date'))
+    try:
+        day = _to_day(iso_date)
+    except (TypeError, ValueError):
+        raise ValueError(f"Expense has no parsable date: {expense.get('date')!r}")
+
+    category = expense.get('category') or expense.get('expenseType')
+    department = expense.get('department')
+
+    return {
+        'id': str(expense.get('id') or uuid.uuid4()),
+        'date': iso_date,
+        'day': day,
+        'category': category.strip().lower() if isinstance(category, str) and category.strip() else UNCATEGORIZED,
+        'department': department.strip() if isinstance(department, str) and department.strip() else UNASSIGNED,
+        'currency': fx_rates.normalize_currency(expense.get('currency')) or UNKNOWN_CURRENCY,
+        'amount_cents': int((amount * 100).quantize(Decimal('1'))),
+        'vendor': expense.get('vendor') or expense.get('merchantName'),
+        'data': json.dumps(expense, default=str)
+    }
+
+class _Partition:
+    """One tenant's expenses: NumPy columns, row index and running aggregates"""
+
+    def __init__(self, capacity):
+        self.size = 0
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS}
+        self.rows = {}  # expense id -> row index
+        # dimension -> (group code, currency code) -> [cents, count]
+        self.aggregates = {dimension: defaultdict(lambda: [0, 0]) for dimension in GROUP_DIMENSIONS}
+
+class ExpenseStore:
+    """
+    Store of extracted expenses with columnar, vectorised aggregation.
+
+    Expenses are persisted in SQLite and mirrored into NumPy columns for
+    filtered group-bys, kept per tenant so a tenant's summaries only ever
+    see (and scan) its own expenses. Unfiltered totals per dimension are
+    kept as running per-currency sums that are adjusted on every
+    add/remove, so they never need a rescan. Currency conversion happens at
+    query time from the offline rate table.
+    """
+
+    def __init__(self, path=EXPENSE_STORE_PATH, capacity=1024):
+        self.path = path
+        self._lock = threading.RLock()
+        self._capacity = capacity
+        self._partitions = {}  # tenant -> _Partition
+        self._vocabularies = {name: _Vocabulary() for name in ('category', 'department', 'currency')}
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS expenses ("
+            " tenant TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " date TEXT NOT NULL,"
+            " category TEXT NOT NULL,"
+            " department TEXT NOT NULL,"
+            " currency TEXT NOT NULL,"
+            " amount_cents INTEGER NOT NULL,"
+            " vendor TEXT,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (tenant, id))"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(expenses)")}
+        if 'tenant' not in columns:
+            # Stores created before expenses were kept per tenant: ids are
+            # only unique per tenant now, so the key changes and the table is rebuilt
+            self._db.executescript(f"""
+                ALTER TABLE expenses RENAME TO expenses_untenanted;
+                CREATE TABLE expenses (
+                    tenant TEXT NOT NULL, id TEXT NOT NULL, date TEXT NOT NULL, category TEXT NOT NULL,
+                    department TEXT NOT NULL, currency TEXT NOT NULL, amount_cents INTEGER NOT NULL,
+                    vendor TEXT, data TEXT NOT NULL, PRIMARY KEY (tenant, id));
+                INSERT INTO expenses
+                    SELECT '{DEFAULT_TENANT}', id, date, category, department, currency, amount_cents, vendor, data
+                    FROM expenses_untenanted;
+                DROP TABLE expenses_untenanted;
+            """)
+        self._db.commit()
+
+        loaded = defaultdict(list)
+        for row in self._db.execute(
+            "SELECT tenant, id, date, category, department, currency, amount_cents FROM expenses"
+        ):
+            loaded[row[0]].append({'id': row[1], 'day': _to_day(row[2]), 'category': row[3], 'department': row[4],
+                                   'currency': row[5], 'amount_cents': row[6]})
+        for tenant, records in loaded.items():
+            self._append(self._partition(tenant), records)
+
+    def __len__(self):
+        return sum(len(partition.rows) for partition in self._partitions.values())
+
+    def _partition(self, tenant):
+        """The tenant's partition, created on first write (lock held)"""
+        partition = self._partitions.get(tenant)
+        if partition is None:
+            partition = self._partitions[tenant] = _Partition(self._capacity)
+        return partition
+
+    def _existing(self, tenant):
+        """The tenant's partition for reading: an empty one when it has stored nothing"""
+        return self._partitions.get(tenant) or _Partition(1)
+
+    def _ensure_capacity(self, partition, needed):
+        capacity = len(partition.columns['alive'])
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, column in partition.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:partition.size] = column[:partition.size]
+            partition.columns[name] = grown
+
+    def _append(self, partition, records):
+        """Append records to a partition's columns and running aggregates (lock held)"""
+        if not records:
+            return
+
+        start = partition.size
+        self._ensure_capacity(partition, start + len(records))
+        end = start + len(records)
+
+        columns = partition.columns
+        vocabularies = self._vocabularies
+        columns['amount_cents'][start:end] = [record['amount_cents'] for record in records]
+        columns['day'][start:end] = [record['day'] for record in records]
+        columns['month'][start:end] = _months(columns['day'][start:end])
+        for name in ('category', 'department', 'currency'):
+            vocabulary = vocabularies[name]
+            columns[name][start:end] = [vocabulary.code(record[name]) for record in records]
+        columns['alive'][start:end] = True
+
+        for offset, record in enumerate(records):
+            partition.rows[record['id']] = start + offset
+        partition.size = end
+
+        self._adjust_aggregates(partition, np.arange(start, end), sign=1)
+
+    def _adjust_aggregates(self, partition, rows, sign):
+        """Add (sign=1) or subtract (sign=-1) rows from the partition's running aggregates"""
+        columns = partition.columns
+        cents = columns['amount_cents'][rows]
+        currencies = columns['currency'][rows]
+        keys = {
+            'category': columns['category'][rows],
+            'department': columns['department'][rows],
+            'currency': currencies,
+            'month': columns['month'][rows]
+        }
+
+        for dimension, codes in keys.items():
+            aggregate = partition.aggregates[dimension]
+            pairs, inverse = np.unique(np.stack([codes, currencies]), axis=1, return_inverse=True)
+            inverse = inverse.ravel()
+            sums = np.zeros(pairs.shape[1], dtype=np.int64)
+            np.add.at(sums, inverse, cents)
+            counts = np.bincount(inverse, minlength=pairs.shape[1])
+            for index in range(pairs.shape[1]):
+                entry = aggregate[(int(pairs[0, index]), int(pairs[1, index]))]
+                entry[0] += sign * int(sums[index])
+                entry[1] += sign * int(counts[index])
+
+    def _compact(self, partition):
+        """Drop a partition's dead rows once there are enough of them (lock held)"""
+        live = len(partition.rows)
+        dead = partition.size - live
+        if dead < COMPACT_MIN_DEAD_ROWS or dead < partition.size * COMPACT_DEAD_RATIO:
+            return
+
+        alive = partition.columns['alive'][:partition.size]
+        moved_to = np.cumsum(alive) - 1
+        capacity = max(self._capacity, live * 2)
+        for name, column in partition.columns.items():
+            compacted = np.zeros(capacity, dtype=column.dtype)
+            compacted[:live] = column[:partition.size][alive]
+            partition.columns[name] = compacted
+        partition.rows = {expense_id: int(moved_to[row]) for expense_id, row in partition.rows.items()}
+        partition.size = live
+
+    def _remove_row(self, partition, expense_id):
+        row = partition.rows.pop(expense_id, None)
+        if row is None:
+            return False
+        self._adjust_aggregates(partition, np.array([row]), sign=-1)
+        partition.columns['alive'][row] = False
+        return True
+
+    def add_many(self, expenses, tenant=DEFAULT_TENANT):
+        """
+        Store a tenant's expenses, replacing any of its own with the same id
+        (within the batch too: the last one wins). Returns their ids.
+        """
+        records = [dict(expense_record(expense), tenant=tenant) for expense in expenses]
+        latest = list({record['id']: record for record in records}.values())
+
+        with self._lock:
+            partition = self._partition(tenant)
+            for record in latest:
+                self._remove_row(partition, record['id'])
+            self._db.executemany(
+                "INSERT OR REPLACE INTO expenses"
+                " (tenant, id, date, category, department, currency, amount_cents, vendor, data)"
+                " VALUES (:tenant, :id, :date, :category, :department, :currency, :amount_cents, :vendor, :data)",
+                latest
+            )
+            self._db.commit()
+            self._append(partition, latest)
+            self._compact(partition)
+
+        return [record['id'] for record in records]
+
+    def add(self, expense, tenant=DEFAULT_TENANT):
+        """Store a single expense and return its id"""
+        return self.add_many([expense], tenant)[0]
+
+    def remove(self, expense_id, tenant=DEFAULT_TENANT):
+        """Delete one of a tenant's expenses; returns False when it has no such expense"""
+        with self._lock:
+            partition = self._partitions.get(tenant)
+            if partition is None or not self._remove_row(partition, expense_id):
+                return False
+            self._db.execute("DELETE FROM expenses WHERE tenant = ? AND id = ?", (tenant, expense_id))
+            self._db.commit()
+            self._compact(partition)
+            return True
+
+    def receipts(self, tenant=DEFAULT_TENANT):
+        """
+        Return a tenant's stored expenses as reconciliation receipts
+        ({id, date, vendor, currency, amount_cents}).
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, date, vendor, currency, amount_cents FROM expenses WHERE tenant = ?", (tenant,)
+            ).fetchall()
+        return [
+            {'id': row[0], 'date': row[1], 'vendor': row[2], 'currency': row[3], 'amount_cents': row[4]}
+            for row in rows
+        ]
+
+    def _currency_rates(self, currency):
+        """Conversion multipliers to currency for every currency code (None if unknown)"""
+        return [fx_rates.rate(code, currency) for code in self._vocabularies['currency'].values]
+
+    def _group_label(self, dimension, code):
+        if dimension == 'month':
+            return _month_label(code)
+        return self._vocabularies[dimension].values[code]
+
+    def summary(self, group_by='category', start_date=None, end_date=None, currency=fx_rates.BASE_CURRENCY,
+                category=None, department=None, tenant=DEFAULT_TENANT):
+        """
+        A tenant's total spend grouped by category, department, currency or
+        month, converted to currency. Optional filters: ISO date range
+        (inclusive), category and department.
+        """
+        if group_by not in GROUP_DIMENSIONS:
+            raise ValueError(f"groupBy must be one of {', '.join(GROUP_DIMENSIONS)}")
+        currency = fx_rates.normalize_currency(currency) or fx_rates.BASE_CURRENCY
+
+        with self._lock:
+            partition = self._existing(tenant)
+            if not any((start_date, end_date, category, department)):
+                cells = {key: tuple(value) for key, value in partition.aggregates[group_by].items() if value[1]}
+            else:
+                cells = self._scan(partition, group_by, start_date, end_date, category, department)
+            rates = self._currency_rates(currency)
+            return self._format_summary(group_by, currency, cells, rates)
+
+    def _filter_mask(self, partition, start_date=None, end_date=None, category=None, department=None):
+        """Boolean mask over a partition's live rows matching the filters (lock held)"""
+        n = partition.size
+        columns = partition.columns
+        mask = columns['alive'][:n].copy()
+        if start_date:
+            mask &= columns['day'][:n] >= _filter_day(start_date, 'startDate')
+        if end_date:
+            mask &= columns['day'][:n] <= _filter_day(end_date, 'endDate')
+        for name, value in (('category', category), ('department', department)):
+            if value is not None:
+                code = self._vocabularies[name].codes.get(value.strip().lower() if name == 'category' else value.strip())
+                if code is None:
+                    return np.zeros(n, dtype=np.bool_)
+                mask &= columns[name][:n] == code
+        return mask
+
+    def _grouped_cells(self, partition, group_by, mask):
+        """
+        Vectorised group-by over a partition's masked rows: {(group code, currency code): (cents, count)}.
+        """
+        n = partition.size
+        columns = partition.columns
+        currencies = columns['currency'][:n][mask].astype(np.int64)
+        cents = columns['amount_cents'][:n][mask]
+        keys = columns[group_by][:n][mask].astype(np.int64)
+        if not len(keys):
+            return {}
+
+        offset = int(keys.min())
+        n_currencies = len(self._vocabularies['currency'].values)
+        combined = (keys - offset) * n_currencies + currencies
+        # float64 sums of integer cents are exact below 2**53 cents
+        sums = np.bincount(combined, weights=cents)
+        counts = np.bincount(combined)
+
+        cells = {}
+        for index in np.flatnonzero(counts):
+            key, currency_code = divmod(int(index), n_currencies)
+            cells[(key + offset, currency_code)] = (int(sums[index]), int(counts[index]))
+        return cells
+
+    def _scan(self, partition, group_by, start_date, end_date, category, department):
+        mask = self._filter_mask(partition, start_date, end_date, category, department)
+        return self._grouped_cells(partition, group_by, mask)
+
+    def _format_summary(self, group_by, currency, cells, rates):
+        currency_values = self._vocabularies['currency'].values
+        groups = {}
+        unconverted = defaultdict(int)
+        total = Decimal(0)
+        count = 0
+
+        for (code, currency_code), (cents, cell_count) in cells.items():
+            label = self._group_label(group_by, code)
+            group = groups.setdefault(label, {'key': label, 'amount': Decimal(0), 'count': 0, 'byCurrency': {}})
+            group['count'] += cell_count
+            count += cell_count
+            original = Decimal(cents) / 100
+            group['byCurrency'][currency_values[currency_code]] = float(original)
+
+            multiplier = rates[currency_code]
+            if multiplier is None:
+                unconverted[currency_values[currency_code]] += cents
+                continue
+            converted = original * multiplier
+            group['amount'] += converted
+            total += converted
+
+        result_groups = sorted(groups.values(), key=lambda group: group['amount'], reverse=True)
+        for group in result_groups:
+            group['amount'] = float(round(group['amount'], 2))
+
+        return {
+            'groupBy': group_by,
+            'currency': currency,
+            'total': float(round(total, 2)),
+            'count': count,
+            'groups': result_groups,
+            'unconverted': {code: float(Decimal(cents) / 100) for code, cents in unconverted.items()}
+        }
+
+    def budget_summary(self, budgets, currency=fx_rates.BASE_CURRENCY, tenant=DEFAULT_TENANT):
+        """
+        Compute spent/remaining of a tenant's expenses for budgets shaped like
+        the frontend's ({startDate, endDate, amount, categories: [{name}], departments: [{name}]}).
+        """
+        currency = fx_rates.normalize_currency(currency) or fx_rates.BASE_CURRENCY
+        results = []
+
+        with self._lock:
+            rates = self._currency_rates(currency)
+            partition = self._existing(tenant)
+            for budget in budgets:
+                if not isinstance(budget, dict):
+                    raise ValueError("Each budget must be a JSON object")
+                try:
+                    amount = float(budget.get('amount') or 0)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Budget amount is not a number: {budget.get('amount')!r}")
+                mask = self._filter_mask(partition, budget.get('startDate'), budget.get('endDate'))
+                by_category = self._format_summary('category', currency,
+                                                   self._grouped_cells(partition, 'category', mask), rates)
+                by_department = self._format_summary('department', currency,
+                                                     self._grouped_cells(partition, 'department', mask), rates)
+                category_spent = {group['key']: group['amount'] for group in by_category['groups']}
+                department_spent = {group['key']: group['amount'] for group in by_department['groups']}
+
+                spent = by_category['total']
+                results.append(dict(
+                    budget,
+                    currency=currency,
+                    spent=spent,
+                    remaining=round(amount - spent, 2),
+                    categories=[
+                        dict(item, spent=category_spent.get(str(item.get('name', '')).strip().lower(), 0.0))
+                        for item in budget.get('categories', [])
+                    ],
+                    departments=[
+                        dict(item, spent=department_spent.get(str(item.get('name', '')).strip(), 0.0))
+                        for item in budget.get('departments', [])
+                    ]
+                ))
+
+        return results
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide expense store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ExpenseStore()
+        return _store
@@ -1,4 +1,4 @@
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import llm_utils
 import os
 import base64
@@ -7,57 +7,216 @@ import logging
 import json
 import tempfile
 import concurrent.futures
+import contextvars
 import time
 import re
-
-def extractfields(file_path, file_type='pdf', page_num=0):
+import io
+import queue
+import page_filter
+import page_packing
+import receipt_index
+import rule_index
+import single_flight
+import adaptive_dpi
+import llm_output
+import metrics
+import hedging
+import render_pool
+import scheduler
+from PIL import Image
+
+# Pages whose extracted policies average below this confidence are retried at full resolution
+POLICY_MIN_CONFIDENCE = 0.8
+
+# Compliance checks use a compact prompt (rules grouped by scope, the
+# invoice stated once) kept within an input token budget, with max_tokens
+# sized to the verdict rather than a fixed COMPLIANCE_MAX_TOKENS
+COMPACT_COMPLIANCE_PROMPT = os.getenv('COMPACT_COMPLIANCE_PROMPT', 'True').lower() == 'true'
+COMPLIANCE_INPUT_TOKEN_BUDGET = int(os.getenv('COMPLIANCE_INPUT_TOKEN_BUDGET', 8000))
+COMPLIANCE_MAX_TOKENS = 5000
+# Line items kept when the invoice alone would exceed the budget
+COMPACT_MAX_ITEMS = 20
+
+# Expected verdict size: the JSON envelope plus one short message per
+# violation, for the policies and the rules the prompt always checks
+VERDICT_BASE_TOKENS = 128
+VERDICT_TOKENS_PER_VIOLATION = 48
+ALWAYS_CHECKED_RULES = 5
+
+# Room for the date, vendor and total a near-duplicate receipt is confirmed by
+KEY_FIELDS_MAX_TOKENS = 200
+
+def extractfields(file_path, file_type='pdf', page_num=0, source=None):
     """
     Extract expense fields from a PDF or image file
+
+    The first pass uses a reduced resolution; the receipt is retried at full
+    resolution only when the first extraction fails validation.
     """
     try:
         if file_type == 'image':
-            # Process image directly
+            # Process image directly, downscaled to what the model actually uses
             print(f"Processing image file: {file_path}")
-            with open(file_path, 'rb') as image_file:
-                response = llm_utils.invoke_bedrock_claude_sonnet37_with_image(
-                    prompt=get_extraction_prompt(),
-                    image_file=image_file
-                )
-            return response
+            with Image.open(file_path) as image:
+                original_size = image.size
+                first_pass = adaptive_dpi.fit_long_edge(image)
+                if first_pass is image:
+                    first_pass = None
+
+            if first_pass is None:
+                return extract_receipt_image(file_path, source=source)
+
+            print(f"Downscaled image from {original_size} to {first_pass.size} for first pass")
+            return extract_receipt_image(
+                first_pass,
+                source=source,
+                escalate=lambda: Path(file_path).read_bytes()
+            )
 
         else:  # PDF processing
             print(f"Processing PDF file: {file_path}")
-            # Convert PDF to images
-            output_paths = convert_pdf_to_images(file_path, dpi=300, fmt='jpeg')
+            info = pdfinfo_from_path(file_path)
+            page_count = info.get('Pages', 0)
 
-            if not output_paths:
+            if not page_count:
                 raise ValueError("No images were extracted from the PDF")
 
             # Get the specified page
-            if page_num >= len(output_paths):
-                raise ValueError(f"Page {page_num} not found in PDF. PDF has {len(output_paths)} pages.")
-
-            image_path = output_paths[page_num]
-
-            # Process the image
-            with open(image_path, 'rb') as image_file:
-                response = llm_utils.invoke_bedrock_claude_sonnet37_with_image(
-                    prompt=get_extraction_prompt(),
-                    image_file=image_file
-                )
-
-            # Clean up temporary image files
-            for path in output_paths:
-                if os.path.exists(path):
-                    os.remove(path)
-
-            return response
+            if page_num >= page_count:
+                raise ValueError(f"Page {page_num} not found in PDF. PDF has {page_count} pages.")
+
+            # Render only the requested page, at a DPI chosen from its size
+            dpi = adaptive_dpi.choose_dpi(adaptive_dpi.page_size_from_pdfinfo(info))
+            start_time = time.time()
+            image = render_pdf_page(file_path, page_num, dpi)
+            print(f"Rendered page {page_num + 1} at {dpi} DPI in {time.time() - start_time:.2f} seconds")
+
+            return extract_receipt_image(
+                image,
+                source=source,
+                escalate=lambda: encode_jpeg(render_pdf_page(file_path, page_num, adaptive_dpi.ESCALATION_DPI))
+            )
 
     except Exception as e:
         logging.error(f"Error processing file {file_path}: {str(e)}")
         print(f"Error processing file {file_path}: {str(e)}")
         raise
 
+def extract_receipt_image(image, source=None, escalate=None):
+    """
+    Extract expense fields from a single receipt image (a path or PIL image).
+
+    A receipt identical to one the tenant extracted before (same content
+    digest) is answered from the receipt index without an LLM call and
+    flagged as a probable duplicate. One that only hashes close to a stored
+    receipt is answered from the index too when its date, vendor and total,
+    read by the fast model, agree with the stored extraction (see
+    confirm_near_duplicate); otherwise it is extracted as usual and flagged
+    as a possible duplicate.
+    The fast model is tried first and the Sonnet models only if its answer
+    fails validation (see invoke_tiered). When escalate is given it must
+    return a higher resolution JPEG of the receipt, which is retried if the
+    first extraction fails validation.
+    """
+    index = receipt_index.get_index()
+    tenant = scheduler.current_tenant()
+    image_hash = digest = match = None
+
+    if index is not None:
+        try:
+            image_hash = receipt_index.receipt_hash(image)
+            digest = receipt_index.content_digest(image)
+            match = index.lookup(image_hash, digest, tenant)
+            if match and match['exact']:
+                print(f"Receipt is identical to stored receipt {match['receiptId']}, skipping LLM call")
+                return receipt_index.mark_duplicate(match)
+        except Exception as e:
+            logging.error(f"Receipt index lookup failed: {str(e)}")
+            image_hash = match = None
+
+    image_data = Path(image).read_bytes() if isinstance(image, (str, Path)) else encode_jpeg(image)
+
+    if match:
+        if receipt_index.CONFIRM_NEAR_MATCHES and confirm_near_duplicate(image_data, match):
+            print(f"Receipt's date, vendor and total agree with stored receipt {match['receiptId']} "
+                  f"(distance {match['distance']}), skipping full extraction")
+            metrics.increment('receipt_near_duplicates', outcome='confirmed')
+            return receipt_index.mark_duplicate(match)
+        print(f"Receipt hashes close to stored receipt {match['receiptId']} "
+              f"(distance {match['distance']}), extracting it anyway")
+        metrics.increment('receipt_near_duplicates', outcome='extracted')
+    response, receipt, errors = invoke_tiered('receipt', get_extraction_prompt(), llm_output.RECEIPT_TOOL,
+                                              parse_receipt, llm_output.check_receipt,
+                                              image_data=image_data, kind='receipt')
+
+    if escalate is not None and errors:
+        print(f"Receipt extraction failed validation at reduced resolution "
+              f"({len(image_data)} bytes): {'; '.join(errors)}. Retrying at full resolution")
+        response = invoke_structured(get_extraction_prompt(), llm_output.RECEIPT_TOOL, image_data=escalate(), kind='receipt')
+        receipt, errors = parse_receipt(response)
+
+    if receipt is None:
+        # Nothing parsable: pass the raw response (or error) through as before
+        return response
+
+    if errors:
+        logging.warning(f"Receipt extraction failed validation: {'; '.join(errors)}")
+        print(f"Receipt extraction failed validation: {'; '.join(errors)}")
+
+    result = json.dumps(receipt, default=str)
+
+    # Only successful extractions are worth remembering
+    if image_hash is not None and not errors:
+        index.add(image_hash, result, source=source, digest=digest, tenant=tenant)
+
+    if match:
+        return receipt_index.mark_possible_duplicate(result, match)
+    return result
+
+def confirm_near_duplicate(image_data, match):
+    """
+    Read a receipt's date, vendor and total with the fast model (a small
+    fraction of a full extraction's cost) and return whether they agree
+    with the stored extraction of its near match (see receipt_index.lookup)
+    """
+    try:
+        stored = json.loads(match['extraction'])
+    except (TypeError, json.JSONDecodeError):
+        return False
+    response = invoke_structured(get_key_fields_prompt(), llm_output.RECEIPT_KEY_FIELDS_TOOL, image_data=image_data,
+                                 max_tokens=KEY_FIELDS_MAX_TOKENS, model_ids=[llm_utils.FAST_MODEL_ID])
+    fields = parse_llm_json(response, 'receipt_key_fields', required_key='total')
+    return isinstance(fields, dict) and isinstance(stored, dict) and llm_output.same_receipt(fields, stored)
+
+def parse_receipt(response):
+    """
+    Parse and normalise a receipt extraction response.
+
+    Returns (receipt, errors); receipt is None when the response holds no JSON object.
+    """
+    receipt = parse_llm_json(response, 'receipt', required_key='total')
+    if receipt is None:
+        return None, ["no JSON object in response"]
+    return llm_output.normalize_receipt(receipt)
+
+def parse_compliance(response):
+    """
+    Parse and normalise a compliance check response. Returns (result, errors).
+    """
+    result = parse_llm_json(response, 'compliance', required_key='isCompliant')
+    if result is None:
+        return None, ["no JSON object in response"]
+    return llm_output.normalize_compliance(result)
+
+def get_key_fields_prompt():
+    """Prompt for just the fields a near-duplicate receipt is confirmed by"""
+    return '''Read this invoice or receipt image and give only:
+- date: the invoice date in YYYY-MM-DD format
+- vendor: the vendor or company name
+- total: the total amount, without currency symbol
+
+Respond only with a JSON object: {"date": "...", "vendor": "...", "total": "..."}'''
+
 def get_extraction_prompt():
     """
     Returns the standard prompt for invoice extraction
@@ -113,22 +272,243 @@ Do not include any markdown formatting, code block indicators, or additional tex
 def convert_pdf_to_images(pdf_path, dpi=300, fmt='jpeg'):
     """
     Convert a PDF file to images and save them to a folder.
+
+    Pages are rendered in parallel in the render pool.
     """
     image_folder = Path('temp_images')
     image_folder.mkdir(exist_ok=True)
 
-    # Convert PDF to images
-    images = convert_from_path(pdf_path, dpi=dpi, fmt=fmt)
-
-    # Save images
-    output_paths = []
-    for i, image in enumerate(images):
-        output_path = image_folder / f"page_{i + 1}.{fmt}"
-        image.save(output_path, fmt.upper())
-        output_paths.append(str(output_path))
+    page_count = pdfinfo_from_path(pdf_path).get('Pages', 0)
+    output_paths = [str(image_folder / f"page_{i + 1}.{fmt}") for i in range(page_count)]
+    list(render_pool.map_ordered(
+        save_pdf_page,
+        ((pdf_path, page_num, dpi, fmt, output_path) for page_num, output_path in enumerate(output_paths))
+    ))
 
     return output_paths
 
+def save_pdf_page(pdf_path, page_num, dpi, fmt, output_path):
+    """Render a zero-based page of a PDF to an image file (runs in a render pool worker)"""
+    image = convert_from_path(pdf_path, dpi=dpi, fmt=fmt, first_page=page_num + 1, last_page=page_num + 1)[0]
+    image.save(output_path, fmt.upper())
+    image.close()
+
+def render_pdf_page(pdf_path, page_num, dpi):
+    """Render a single zero-based page of a PDF as a PIL image"""
+    return convert_from_path(
+        pdf_path,
+        dpi=dpi,
+        fmt='jpeg',
+        first_page=page_num + 1,
+        last_page=page_num + 1,
+        use_pdftocairo=True
+    )[0]
+
+def encode_jpeg(image):
+    """Encode a PIL image as JPEG bytes and release its pixel buffer"""
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG')
+    image.close()
+    return buffer.getvalue()
+
+def render_policy_page(pdf_path, page_num, dpi, analyse=True):
+    """
+    Render one page for policy extraction (runs in a render pool worker).
+
+    With analyse, a greyscale analysis copy is made and a page dense with
+    ink is re-rendered at DENSE_PAGE_DPI. The page is returned through
+    shared memory; see share_page and load_shared_page.
+    """
+    image = render_pdf_page(pdf_path, page_num, dpi)
+    if not analyse:
+        return share_page(image, page_num, dpi)
+
+    gray = page_filter.load_analysis_image(image)
+    ink_coverage, _ = page_filter.ink_statistics(gray)
+    if adaptive_dpi.needs_dense_rerender(dpi, ink_coverage):
+        image.close()
+        dpi = adaptive_dpi.DENSE_PAGE_DPI
+        image = render_pdf_page(pdf_path, page_num, dpi)
+    return share_page(image, page_num, dpi, gray, ink_coverage)
+
+def share_page(image, page_num, dpi, gray=None, ink_coverage=None):
+    """
+    Encode a page as base64 JPEG and put it, with its greyscale analysis
+    image if given, in shared memory. Returns a small picklable dict.
+    """
+    buffers = [base64.b64encode(encode_jpeg(image))]
+    if gray is not None:
+        buffers.append(gray.tobytes())
+    return {
+        'pageNum': page_num,
+        'dpi': dpi,
+        'inkCoverage': ink_coverage,
+        'graySize': gray.size if gray is not None else None,
+        'shared': render_pool.share(*buffers)
+    }
+
+def load_shared_page(page):
+    """Return (llm_utils.Base64Image, greyscale PIL image or None) for a share_page result"""
+    buffers = render_pool.take(page['shared'])
+    gray = Image.frombytes('L', page['graySize'], buffers[1]) if page['graySize'] else None
+    return llm_utils.Base64Image(buffers[0].decode('ascii')), gray
+
+def release_shared_page(page):
+    render_pool.discard(page['shared'])
+
+def invoke_structured(prompt, tool, image_data=None, max_tokens=4000, temperature=0.1, kind=None, model_ids=None):
+    """
+    Ask the LLM for a schema-shaped answer.
+
+    In structured output mode the schema is sent as a forced tool and the
+    parsed tool input comes back; otherwise the free-text response is
+    returned for parse_llm_json to extract. image_data is JPEG bytes, an
+    already encoded llm_utils.Base64Image, or a list of (label, image) pairs.
+
+    The call first waits for a scheduler slot, which may raise
+    scheduler.Overloaded; in a cancelled single flight (see
+    single_flight.current_cancel) it raises llm_utils.Cancelled instead.
+    When kind is given (e.g. 'receipt') it goes through hedging.hedged_call:
+    its latency is recorded under that kind and, if hedging is enabled, a
+    slow call is raced against a second request.
+    model_ids overrides the models tried (default llm_utils.SONNET_MODEL_IDS).
+    """
+    def as_file(data):
+        return io.BytesIO(data) if isinstance(data, bytes) else data
+
+    def attempt(model_ids):
+        def call(cancel):
+            if isinstance(image_data, list):
+                image_file = [(label, as_file(data)) for label, data in image_data]
+            else:
+                image_file = as_file(image_data)
+            if llm_utils.STRUCTURED_OUTPUT:
+                return llm_utils.invoke_bedrock_claude_structured(
+                    prompt=prompt,
+                    tool=tool,
+                    image_file=image_file,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    model_ids=model_ids,
+                    cancel=cancel
+                )
+            if image_file is not None:
+                return llm_utils.invoke_bedrock_claude_sonnet37_with_image(
+                    prompt=prompt,
+                    image_file=image_file,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    model_ids=model_ids,
+                    cancel=cancel
+                )
+            return llm_utils.invoke_bedrock_claude_sonnet_37(
+                prompt=prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                model_ids=model_ids
+            )
+        return call
+
+    # A coalesced request's computation stops making calls once every
+    # client waiting for it has gone. Its calls are streamed, and closed
+    # when it is cancelled, only where streaming is allowed (see
+    # single_flight.CANCEL_STREAMS; hedging needs it anyway)
+    cancel = single_flight.current_cancel()
+    if cancel is not None and cancel.cancelled:
+        raise llm_utils.Cancelled("Request cancelled: no client is waiting for it")
+    stream_cancel = cancel if single_flight.CANCEL_STREAMS or hedging.HEDGE_ENABLED else None
+
+    # Waits for an LLM slot of the current request's priority class
+    with scheduler.slot():
+        if cancel is not None and cancel.cancelled:
+            raise llm_utils.Cancelled("Request cancelled: no client is waiting for it")
+        if kind is None:
+            return attempt(model_ids)(stream_cancel)
+
+        # A fast-tier call is hedged with the same model, under its own latency
+        if model_ids is not None:
+            return hedging.hedged_call(f"{kind}_fast", attempt(model_ids), attempt(model_ids), cancel=stream_cancel)
+        hedge_models = [llm_utils.SONNET_35_MODEL_ID] if hedging.HEDGE_TO_FALLBACK else None
+        return hedging.hedged_call(kind, attempt(None), attempt(hedge_models), cancel=stream_cancel)
+
+def invoke_tiered(name, prompt, tool, parse, check, image_data=None, max_tokens=4000, temperature=0.1, kind=None,
+                  tiered=True):
+    """
+    Call invoke_structured on the fast model first and escalate to the
+    Sonnet models only when its answer fails validation. With tiered False
+    (or tiering disabled) only the Sonnet models are called.
+
+    parse(response) returns (result, errors) and check(result) a list of
+    further consistency problems; the fast answer is accepted only when
+    both are empty. Returns (response, result, errors) of the tier used.
+    Calls, acceptances, escalations and latency are counted per tier under name.
+    """
+    def run(tier, model_ids):
+        start = time.perf_counter()
+        response = invoke_structured(prompt, tool, image_data=image_data, max_tokens=max_tokens,
+                                     temperature=temperature, kind=kind, model_ids=model_ids)
+        metrics.observe('llm_tier_seconds', time.perf_counter() - start, kind=name, tier=tier)
+        metrics.increment('llm_tier_calls', kind=name, tier=tier)
+        result, errors = parse(response)
+        return response, result, errors
+
+    if llm_utils.MODEL_TIERING_ENABLED and tiered:
+        response, result, errors = run('fast', [llm_utils.FAST_MODEL_ID])
+        if result is not None and not errors:
+            errors = check(result)
+        if not errors:
+            metrics.increment('llm_tier_accepted', kind=name, tier='fast')
+            return response, result, errors
+        print(f"Fast model answer for {name} failed validation: {'; '.join(errors)}. Escalating")
+        metrics.increment('llm_tier_escalations', kind=name)
+
+    response, result, errors = run('full', None)
+    if result is not None and not errors:
+        metrics.increment('llm_tier_accepted', kind=name, tier='full')
+    return response, result, errors
+
+def tier_status():
+    """Per-kind calls, acceptance rate and latency of each model tier"""
+    status = {'enabled': llm_utils.MODEL_TIERING_ENABLED, 'complianceEnabled': llm_utils.COMPLIANCE_TIERING_ENABLED,
+              'fastModel': llm_utils.FAST_MODEL_ID, 'kinds': {}}
+    for kind in ('receipt', 'compliance'):
+        tiers = {}
+        for tier in ('fast', 'full'):
+            calls = metrics.counter('llm_tier_calls', kind=kind, tier=tier)
+            accepted = metrics.counter('llm_tier_accepted', kind=kind, tier=tier)
+            tiers[tier] = {
+                'calls': calls,
+                'accepted': accepted,
+                'acceptRate': round(accepted / calls, 3) if calls else None,
+                'p50Seconds': metrics.percentile('llm_tier_seconds', 50, kind=kind, tier=tier),
+                'p95Seconds': metrics.percentile('llm_tier_seconds', 95, kind=kind, tier=tier)
+            }
+        fast_calls = tiers['fast']['calls']
+        escalations = metrics.counter('llm_tier_escalations', kind=kind)
+        status['kinds'][kind] = {
+            'tiers': tiers,
+            'escalations': escalations,
+            'escalationRate': round(escalations / fast_calls, 3) if fast_calls else None
+        }
+    return status
+
+def parse_llm_json(response, kind, required_key=None):
+    """
+    Extract the JSON object from an LLM response and count parse failures
+    per kind of call and output mode.
+    """
+    mode = llm_utils.output_mode()
+    if isinstance(response, dict) and 'error' in response:
+        # The call itself failed; that is not a parse failure
+        metrics.increment('llm_errors', kind=kind, mode=mode)
+        return None
+
+    result = llm_output.extract_json(response, required_key=required_key)
+    metrics.increment('llm_responses', kind=kind, mode=mode)
+    if result is None:
+        metrics.increment('llm_parse_failures', kind=kind, mode=mode)
+    return result
+
 def format_line_items(items):
     """Format line items for LLM prompt"""
     if not items:
@@ -143,27 +523,6 @@ def format_line_items(items):
         )
     return "\n".join(formatted_items)
 
-def extract_json(response):
-    """Extract JSON object from LLM response"""
-    try:
-        # First try to parse the entire response as JSON
-        json.loads(response)
-        return response
-    except json.JSONDecodeError:
-        # If that fails, try to extract JSON using regex
-        json_pattern = r'\{[\s\S]*\}'
-        matches = re.findall(json_pattern, response)
-
-        # Try each match until we find valid JSON
-        for match in matches:
-            try:
-                json.loads(match)
-                return match
-            except json.JSONDecodeError:
-                continue
-
-        return None
-
 def check_policy_compliance(seniority, extraction_results, policy_rules):
     """
     Check if the extracted invoice data complies with policy rules using LLM.
@@ -186,6 +545,62 @@ def check_policy_compliance(seniority, extraction_results, policy_rules):
         invoice_exp_type
     )
 
+    # Of a large set, only the rules relevant to this invoice (and those always sent)
+    selected_rules = rule_index.select_rules(policy_rules, applicable_rules, extraction_results, scheduler.current_tenant())
+    if len(selected_rules) < len(applicable_rules):
+        print(f"Selected {len(selected_rules)} of {len(applicable_rules)} applicable policies by relevance")
+        metrics.observe('compliance_rules_selected_ratio', len(selected_rules) / len(applicable_rules))
+    applicable_rules = selected_rules
+
+    unchecked = 0
+    if COMPACT_COMPLIANCE_PROMPT:
+        encoding = 'compact'
+        prompt, unchecked = get_compact_compliance_prompt(seniority, extraction_results, applicable_rules, current_date)
+        max_tokens = compliance_max_tokens(len(applicable_rules) - unchecked)
+    else:
+        encoding = 'verbose'
+        prompt = get_compliance_prompt(seniority, extraction_results, applicable_rules, current_date)
+        max_tokens = COMPLIANCE_MAX_TOKENS
+    estimated_tokens = llm_utils.estimate_tokens(prompt)
+
+    try:
+        # Log diagnostics
+        print(f"Applying {len(applicable_rules)} applicable policies out of {len(policy_rules)} total policies")
+        print(f"Invoice metadata: Country={invoice_country}, ExpType={invoice_exp_type}, Seniority={employee_seniority}")
+
+        # Call LLM for policy check
+        start = time.perf_counter()
+        with llm_utils.record_usage() as usage:
+            _, result, errors = invoke_tiered('compliance', prompt, llm_output.COMPLIANCE_TOOL, parse_compliance,
+                                              lambda verdict: llm_output.check_compliance(verdict, applicable_rules),
+                                              max_tokens=max_tokens, temperature=0.1,
+                                              tiered=llm_utils.COMPLIANCE_TIERING_ENABLED)
+        record_compliance_usage(encoding, estimated_tokens, max_tokens, usage, time.perf_counter() - start)
+        if errors:
+            print(f"Policy checker response failed validation: {'; '.join(errors)}")
+            return {
+                "isCompliant": False,
+                "violations": [{"message": "Failed to get valid response from policy checker"}]
+            }
+
+        if unchecked:
+            # Left out of the prompt to stay within the input token budget
+            result['uncheckedPolicies'] = unchecked
+        return result
+
+    except (scheduler.Overloaded, llm_utils.Cancelled):
+        raise
+    except Exception as e:
+        return {
+            "isCompliant": False,
+            "violations": [{"message": f"Error checking policy compliance: {str(e)}"}]
+        }
+
+def get_compliance_prompt(seniority, extraction_results, applicable_rules, current_date):
+    """
+    The verbose compliance prompt: each rule with its scope spelled out and
+    the invoice described in full.
+    """
     invoice_description = f"""
 Invoice Details:
 - Invoice Number: {extraction_results.get('invoiceNumber', 'Not provided')}
@@ -206,7 +621,7 @@ Line Items:
     # Extract just the rule texts for the prompt
     formatted_rules = format_applicable_policies(applicable_rules)
 
-    prompt = f"""You are an expense policy compliance checker. Your task is to check if this invoice complies with company policies.
+    return f"""You are an expense policy compliance checker. Your task is to check if this invoice complies with company policies.
 
 Current date is {current_date}
 
@@ -252,34 +667,119 @@ CRITICAL INSTRUCTIONS FOR POLICY ENFORCEMENT:
 
 Check the invoice against each policy and include any violations in the JSON response."""
 
-    try:
-        # Log diagnostics
-        print(f"Applying {len(applicable_rules)} applicable policies out of {len(policy_rules)} total policies")
-        print(f"Invoice metadata: Country={invoice_country}, ExpType={invoice_exp_type}, Seniority={employee_seniority}")
-
-        # Call LLM for policy check
-        response = llm_utils.invoke_bedrock_claude_sonnet_37(
-            prompt=prompt,
-            max_tokens=5000,
-            temperature=0.1
-        )
-
-        # Extract JSON from response
-        json_match = extract_json(response)
-        if not json_match:
-            return {
-                "isCompliant": False,
-                "violations": [{"message": "Failed to get valid response from policy checker"}]
-            }
-
-        result = json.loads(json_match)
-        return result
+def compliance_max_tokens(rule_count):
+    """max_tokens for a verdict on rule_count rules: enough for every rule (and the always-checked ones) to be violated"""
+    return min(COMPLIANCE_MAX_TOKENS, VERDICT_BASE_TOKENS + VERDICT_TOKENS_PER_VIOLATION * (rule_count + ALWAYS_CHECKED_RULES))
+
+def record_compliance_usage(encoding, estimated_tokens, max_tokens, usage, seconds):
+    """Record and print the tokens and latency of one compliance check"""
+    input_tokens = usage['inputTokens'] or estimated_tokens
+    metrics.observe('compliance_input_tokens', input_tokens, prompt=encoding)
+    metrics.observe('compliance_output_tokens', usage['outputTokens'], prompt=encoding)
+    metrics.observe('compliance_seconds', seconds, prompt=encoding)
+    print(f"Compliance check ({encoding} prompt): ~{estimated_tokens} input tokens estimated, "
+          f"{usage['inputTokens']} in / {usage['outputTokens']} out (max {max_tokens}) "
+          f"over {usage['calls']} calls in {seconds:.2f}s")
+
+def _scope_label(rule):
+    country = (rule.get('country') or 'global').lower()
+    seniority = (rule.get('seniority') or 'all').lower()
+    expense_type = (rule.get('expenseType') or 'all').lower()
+    return ", ".join([
+        "all countries" if country == 'global' else country,
+        "all levels" if seniority == 'all' else f"{seniority} level",
+        "all expense types" if expense_type == 'all' else expense_type.replace('_', ' ')
+    ])
+
+def format_compact_invoice(seniority, extraction_results, max_items=None):
+    """The invoice fields and line items, one short line each"""
+    def value(key, default='not provided'):
+        field = extraction_results.get(key)
+        return default if field in (None, '') else field
+
+    lines = [
+        f"number: {value('invoiceNumber')}",
+        f"date: {value('date')}",
+        f"vendor: {value('vendor')}",
+        f"total: {value('total')} {value('currency', '')}".rstrip(),
+        f"location: {value('expenseLocation')}, country: {value('expenseCountry')}",
+        f"expense type: {value('expenseType')}",
+        f"employee seniority: {seniority or 'not provided'}",
+        f"people: {value('numberOfPeople', 1)}"
+    ]
+    items = extraction_results.get('items') or []
+    shown = items if max_items is None else items[:max_items]
+    if items:
+        lines.append("items:")
+    for item in shown:
+        quantity = item.get('quantity')
+        lines.append(f"- {item.get('description') or 'item'}"
+                     f"{f' x{quantity}' if quantity not in (None, '') else ''}: {item.get('amount', 'not provided')}")
+    if len(shown) < len(items):
+        lines.append(f"- {len(items) - len(shown)} more items")
+    return "\n".join(lines)
+
+def get_compact_compliance_prompt(seniority, extraction_results, applicable_rules, current_date, budget=None):
+    """
+    The compliance prompt with rules grouped under one line per shared scope
+    (most specific scopes first) and the invoice stated once, kept within
+    budget estimated input tokens (default COMPLIANCE_INPUT_TOKEN_BUDGET):
+    line items are cut first, then rules that don't fit are left out.
 
-    except Exception as e:
-        return {
-            "isCompliant": False,
-            "violations": [{"message": f"Error checking policy compliance: {str(e)}"}]
-        }
+    Returns (prompt, number of rules left out).
+    """
+    budget = budget or COMPLIANCE_INPUT_TOKEN_BUDGET
+    ending = (
+        "Also always check that the invoice number is valid, the vendor is given, the date is not in the future "
+        "and not older than any maximum age above (count the days from the invoice date to today), and the "
+        "required fields are filled. Country-specific policies apply only to invoices from that country.\n"
+        "Report isCompliant and one short message per violation (none if compliant)."
+    )
+    if not llm_utils.STRUCTURED_OUTPUT:
+        ending += '\nRespond only with JSON: {"isCompliant": boolean, "violations": [{"message": "..."}]}'
+
+    def opening(invoice):
+        return f"Check this expense invoice against company policy. Today is {current_date}.\n\nINVOICE\n{invoice}\n\nPOLICIES\n"
+
+    invoice = format_compact_invoice(seniority, extraction_results)
+    used = llm_utils.estimate_tokens(opening(invoice) + ending)
+    if used > budget:
+        invoice = format_compact_invoice(seniority, extraction_results, max_items=COMPACT_MAX_ITEMS)
+        used = llm_utils.estimate_tokens(opening(invoice) + ending)
+
+    groups = {}
+    for rule in applicable_rules:
+        text = ' '.join(str(rule.get('rule', '')).split())
+        if text:
+            groups.setdefault(_scope_label(rule), []).append(text)
+    if not groups:
+        groups[_scope_label({})] = ["Invoice must have valid information and comply with general expense guidelines."]
+    general = ("all countries", "all levels", "all expense types")
+    order = sorted(groups, key=lambda scope: sum(part in general for part in scope.split(", ")))
+
+    lines = []
+    number = 0
+    unchecked = 0
+    for scope in order:
+        header = f"[{scope}]"
+        header_added = False
+        for text in groups[scope]:
+            line = f"{number + 1}. {text}"
+            cost = llm_utils.estimate_tokens(line) + (0 if header_added else llm_utils.estimate_tokens(header))
+            if used + cost > budget:
+                unchecked += 1
+                continue
+            if not header_added:
+                lines.append(header)
+                header_added = True
+            lines.append(line)
+            number += 1
+            used += cost
+
+    if unchecked:
+        print(f"Compliance prompt over its {budget} token budget: {unchecked} policies left out")
+        metrics.increment('compliance_policies_over_budget', unchecked)
+    return opening(invoice) + "\n".join(lines) + "\n\n" + ending, unchecked
 
 def filter_applicable_policies(policy_rules, invoice_country, employee_seniority, invoice_exp_type):
     """
@@ -419,76 +919,219 @@ Important:
 - Use the id format "p1", "p2", etc.
 - Set approved to false for all extracted policies'''
 
-def extract_policies_from_pdf(file_path, max_workers=12):
+def extract_policies_from_pdf(file_path, max_workers=12, skip_pages=True, queue_depth=None, render_ahead=None,
+                              pack_pages=None):
     """
     Extract policy rules from a PDF document using LLM with parallel processing.
-    """
-    try:
-        print(f"Processing policy document: {file_path}")
 
-        # Convert PDF to images
-        start_time = time.time()
-        output_paths = convert_pdf_to_images(file_path, dpi=300, fmt='jpeg')
-
-        if not output_paths:
-            raise ValueError("No images were extracted from the PDF")
+    Pages are rendered and encoded in the render pool, at most render_ahead
+    pages ahead, and pushed in order through a bounded queue to the LLM
+    worker threads, so the first Bedrock calls start while later pages are
+    still rendering and memory is bounded by queue_depth rather than page count.
 
-        page_count = len(output_paths)
-        print(f"Converted PDF to {page_count} images in {time.time() - start_time:.2f} seconds")
+    When skip_pages is set, blank pages are not sent to the LLM and pages that
+    duplicate an earlier page reuse that page's result.
 
-        all_policies = []
+    Pages are first rendered at a DPI chosen from the page size (higher for
+    dense pages); a page whose result fails validation is re-rendered at
+    full resolution and retried.
 
-        # Process pages in parallel
-        start_time = time.time()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Create a dictionary of futures to their corresponding page numbers
-            future_to_page = {
-                executor.submit(process_page, image_path, page_num): page_num
-                for page_num, image_path in enumerate(output_paths)
-            }
+    With pack_pages (default page_packing.PAGE_PACKING_ENABLED), consecutive
+    pages are sent several to a request; see extract_rendered_policies.
+    """
+    try:
+        print(f"Processing policy document: {file_path}")
 
-            # Process results as they complete
-            for future in concurrent.futures.as_completed(future_to_page):
-                page_num = future_to_page[future]
-                try:
-                    page_policies = future.result()
-                    if page_policies:
-                        all_policies.extend(page_policies)
-                        print(f"Processed page {page_num + 1}: Found {len(page_policies)} policies")
-                    else:
-                        print(f"Processed page {page_num + 1}: No policies found")
-                except Exception as e:
-                    print(f"Error processing page {page_num + 1}: {str(e)}")
-                    logging.error(f"Error processing page {page_num + 1}: {str(e)}")
-
-        processing_time = time.time() - start_time
-        print(f"Processed {page_count} pages in {processing_time:.2f} seconds")
-        print(f"Average time per page: {processing_time/max(1, page_count):.2f} seconds")
-
-        # Clean up temporary image files
-        for path in output_paths:
-            if os.path.exists(path):
-                os.remove(path)
+        info = pdfinfo_from_path(file_path)
+        page_count = info.get('Pages', 0)
+        if not page_count:
+            raise ValueError("No images were extracted from the PDF")
 
-        # Post-process to remove duplicates
-        start_time = time.time()
-        unique_policies = remove_duplicate_policies(all_policies)
-        print(f"Removed duplicates in {time.time() - start_time:.2f} seconds. {len(all_policies)} → {len(unique_policies)} policies")
+        dpi = adaptive_dpi.choose_dpi(adaptive_dpi.page_size_from_pdfinfo(info))
+        print(f"Rendering {page_count} pages at {dpi} DPI")
 
-        # Reassign IDs to be sequential
-        for i, policy in enumerate(unique_policies):
-            policy['id'] = f"p{i+1}"
+        def rerender(page_num):
+            return render_pool.submit(render_policy_page, file_path, page_num,
+                                      adaptive_dpi.ESCALATION_DPI, False).result()
 
-        return {
-            'policies': unique_policies,
-            'pageCount': page_count
-        }
+        pages = render_pool.map_ordered(
+            render_policy_page,
+            ((file_path, page_num, dpi) for page_num in range(page_count)),
+            window=render_ahead,
+            discard=release_shared_page
+        )
+        return extract_rendered_policies(pages, page_count, dpi, rerender, max_workers=max_workers,
+                                         skip_pages=skip_pages, queue_depth=queue_depth, pack_pages=pack_pages)
 
     except Exception as e:
         logging.error(f"Error extracting policies from {file_path}: {str(e)}")
         print(f"Error extracting policies from {file_path}: {str(e)}")
         raise
 
+def extract_rendered_policies(pages, page_count, dpi, rerender, max_workers=12, skip_pages=True, queue_depth=None,
+                              pack_pages=None):
+    """
+    Extract policy rules from rendered pages: an iterator of share_page
+    results in page order (closed when done). rerender(page_num) returns a
+    page re-rendered at full resolution.
+
+    When packing, consecutive pages are grouped by page_packing.PagePacker
+    and each pack is sent in one request with the previous pack's last page
+    as context, so a rule running across pages is extracted once, on the
+    page it starts on. A pack that fails validation is retried page by page.
+    """
+    if pack_pages is None:
+        pack_pages = page_packing.PAGE_PACKING_ENABLED
+
+    page_queue = queue.Queue(maxsize=queue_depth or max_workers)
+    page_results = {}
+    duplicate_of = {}
+    pre_filter = page_filter.PageFilter() if skip_pages else None
+    packer = page_packing.PagePacker() if pack_pages else None
+    context = None
+    requests = 0
+
+    start_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Workers run in copies of this context so their LLM calls are
+        # scheduled under the request's priority class and tenant
+        workers = [
+            executor.submit(contextvars.copy_context().run, policy_page_worker, page_queue, page_results, rerender)
+            for _ in range(max_workers)
+        ]
+
+        try:
+            for page in pages:
+                page_num = page['pageNum']
+                image_data, gray = load_shared_page(page)
+                if pre_filter:
+                    decision = pre_filter.classify(gray, page_num)
+                    if decision.action != 'process':
+                        if decision.action == 'duplicate':
+                            duplicate_of[page_num] = decision.source_page
+                        print(f"Skipping page {page_num + 1}: {decision.describe()}")
+                        logging.info(f"Skipping page {page_num + 1}: {decision.describe()}")
+                        continue
+
+                if page['dpi'] != dpi:
+                    print(f"Page {page_num + 1} is dense (ink {page['inkCoverage']:.3f}), re-rendered at {page['dpi']} DPI")
+
+                item = (page_num, image_data, page['dpi'])
+                if packer is None:
+                    # Blocks while the queue is full, throttling rendering to the LLM workers
+                    page_queue.put(([item], None, True))
+                    requests += 1
+                    continue
+
+                pack = packer.add(item, len(image_data.data), page['inkCoverage'])
+                if pack:
+                    page_queue.put((pack, context, True))
+                    requests += 1
+                    context = pack[-1][:2]
+
+            if packer is not None and packer.pages:
+                page_queue.put((packer.flush(), context, False))
+                requests += 1
+
+            print(f"Rendered {page_count} pages in {time.time() - start_time:.2f} seconds")
+        finally:
+            pages.close()
+            for _ in workers:
+                page_queue.put(None)
+
+        escalated_pages = sum(worker.result() for worker in workers)
+
+    processing_time = time.time() - start_time
+    print(f"Processed {page_count} pages in {processing_time:.2f} seconds "
+          f"({len(page_results)} sent to LLM in {requests} requests, {page_count - len(page_results)} skipped, "
+          f"{escalated_pages} escalated to {adaptive_dpi.ESCALATION_DPI} DPI)")
+    print(f"Average time per page: {processing_time/max(1, page_count):.2f} seconds")
+
+    # Duplicate pages reuse the result of the page they repeat (but not a
+    # packed rule that started on the page before it)
+    for page_num, source_page in duplicate_of.items():
+        page_results[page_num] = [
+            dict(policy, page=page_num + 1) for policy in page_results.get(source_page, [])
+            if policy.get('page') == source_page + 1
+        ]
+
+    all_policies = []
+    for page_num in sorted(page_results):
+        all_policies.extend(page_results[page_num])
+
+    # Post-process to remove duplicates
+    start_time = time.time()
+    unique_policies = remove_duplicate_policies(all_policies)
+    print(f"Removed duplicates in {time.time() - start_time:.2f} seconds. {len(all_policies)} → {len(unique_policies)} policies")
+
+    # Reassign IDs to be sequential
+    for i, policy in enumerate(unique_policies):
+        policy['id'] = f"p{i+1}"
+
+    return {
+        'policies': unique_policies,
+        'pageCount': page_count
+    }
+
+def policy_page_worker(page_queue, page_results, rerender):
+    """
+    Consume (pages, context, continues) items from the page queue until a
+    None sentinel. pages is a list of (page_num, image_data, dpi); a single
+    page without context is processed on its own, anything else as a pack
+    (see extract_packed_policies).
+
+    Returns the number of pages that had to be escalated to full resolution.
+    """
+    escalated_pages = 0
+    while True:
+        item = page_queue.get()
+        if item is None:
+            return escalated_pages
+
+        pages, context, continues = item
+        if len(pages) > 1 or context is not None:
+            first, last = pages[0][0] + 1, pages[-1][0] + 1
+            try:
+                by_page, parsed = extract_packed_policies(pages, context, continues)
+                if policy_page_is_valid([policy for policies in by_page.values() for policy in policies], parsed):
+                    page_results.update(by_page)
+                    print(f"Processed pages {first}-{last}: Found {sum(map(len, by_page.values()))} policies")
+                    continue
+                print(f"Pages {first}-{last} failed validation as a pack, retrying page by page")
+            except Exception as e:
+                print(f"Error processing pages {first}-{last}: {str(e)}. Retrying page by page")
+                logging.error(f"Error processing pages {first}-{last}: {str(e)}")
+
+        for page_num, image_data, dpi in pages:
+            escalated_pages += process_policy_page(page_num, image_data, dpi, page_results, rerender)
+
+def process_policy_page(page_num, image_data, dpi, page_results, rerender):
+    """
+    Extract one page's policies into page_results, re-rendering it at full
+    resolution if the result fails validation. Returns 1 if it was escalated.
+    """
+    escalated = 0
+    try:
+        page_policies, parsed = extract_page_policies(image_data, page_num)
+
+        if dpi < adaptive_dpi.ESCALATION_DPI and not policy_page_is_valid(page_policies, parsed):
+            print(f"Page {page_num + 1} failed validation at {dpi} DPI, "
+                  f"retrying at {adaptive_dpi.ESCALATION_DPI} DPI")
+            escalated = 1
+            retry_policies, retry_parsed = extract_page_policies(load_shared_page(rerender(page_num))[0], page_num)
+            if retry_parsed:
+                page_policies = retry_policies
+
+        page_results[page_num] = page_policies
+        if page_policies:
+            print(f"Processed page {page_num + 1}: Found {len(page_policies)} policies")
+        else:
+            print(f"Processed page {page_num + 1}: No policies found")
+    except Exception as e:
+        print(f"Error processing page {page_num + 1}: {str(e)}")
+        logging.error(f"Error processing page {page_num + 1}: {str(e)}")
+    return escalated
+
 def remove_duplicate_policies(policies):
     """
     Remove duplicate or very similar policy rules
@@ -514,40 +1157,125 @@ def remove_duplicate_policies(policies):
 
     return unique_policies
 
-def process_page(image_path, page_num):
+def policy_page_is_valid(page_policies, parsed):
+    """
+    A page result is valid when the response parsed and the policies found
+    have at least POLICY_MIN_CONFIDENCE average confidence.
+    """
+    if not parsed:
+        return False
+    if not page_policies:
+        return True
+
+    confidences = []
+    for policy in page_policies:
+        try:
+            confidences.append(float(policy.get('confidence', 0)))
+        except (TypeError, ValueError):
+            confidences.append(0.0)
+    return sum(confidences) / len(confidences) >= POLICY_MIN_CONFIDENCE
+
+def process_page(image, page_num):
+    """
+    Process a single page image (a path or JPEG bytes) with LLM to extract policies.
+    """
+    page_policies, _ = extract_page_policies(image, page_num)
+    return page_policies
+
+def extract_page_policies(image, page_num):
     """
-    Process a single page image with LLM to extract policies.
+    Extract policies from a single page image (a path, JPEG bytes or a
+    llm_utils.Base64Image).
+
+    Returns (policies, parsed) where parsed tells whether the LLM response
+    contained valid JSON, so callers can tell "no policies" from a failure.
     """
     try:
         page_policies = []
+        parsed = False
 
         # Process the image with LLM
-        with open(image_path, 'rb') as image_file:
-            response = llm_utils.invoke_bedrock_claude_sonnet37_with_image(
-                prompt=get_policy_extraction_prompt(),
-                image_file=image_file
-            )
+        image_data = image if isinstance(image, (bytes, llm_utils.Base64Image)) else Path(image).read_bytes()
+        response = invoke_structured(get_policy_extraction_prompt(), llm_output.POLICY_LIST_TOOL, image_data=image_data)
 
         # Extract JSON from response
-        json_match = extract_json(response)
-        if json_match:
-            try:
-                page_result = json.loads(json_match)
-                # Add page number to each policy for reference
-                for policy in page_result.get('policies', []):
-                    policy['page'] = page_num + 1
-                    page_policies.append(policy)
-            except json.JSONDecodeError:
-                logging.error(f"Failed to parse JSON from page {page_num + 1}")
-                print(f"Failed to parse JSON from page {page_num + 1}")
-
-        return page_policies
+        page_result = parse_llm_json(response, 'policy_page', required_key='policies')
+        if page_result is not None:
+            # Add page number to each policy for reference
+            for policy in llm_output.normalize_policies(page_result):
+                policy['page'] = page_num + 1
+                page_policies.append(policy)
+            parsed = True
+        else:
+            logging.error(f"Failed to parse JSON from page {page_num + 1}")
+            print(f"Failed to parse JSON from page {page_num + 1}")
+
+        return page_policies, parsed
 
     except Exception as e:
         logging.error(f"Error in process_page for page {page_num + 1}: {str(e)}")
         print(f"Error in process_page for page {page_num + 1}: {str(e)}")
         raise
 
+def extract_packed_policies(pages, context=None, continues=False):
+    """
+    Extract policies from several consecutive pages in one request.
+
+    pages is a list of (page_num, image_data, dpi). context is the
+    (page_num, image_data) of the page before them, already processed, sent
+    so a rule continuing from it is seen whole; continues tells whether more
+    pages follow, whose request will see a rule cut off at the end of this one.
+
+    Returns ({page_num: policies}, parsed). Each policy's page is the page its
+    text starts on; a rule starting on the context page is kept with the first page.
+    """
+    page_numbers = [page_num for page_num, _, _ in pages]
+    images = [(f"Page {page_num + 1}:", image_data) for page_num, image_data, _ in pages]
+    if context is not None:
+        images.insert(0, (f"Page {context[0] + 1}:", context[1]))
+
+    prompt = get_packed_policy_extraction_prompt(page_numbers, context[0] if context else None, continues)
+    response = invoke_structured(prompt, llm_output.PACKED_POLICY_LIST_TOOL, image_data=images,
+                                 max_tokens=page_packing.PACK_MAX_TOKENS)
+
+    result = parse_llm_json(response, 'policy_pack', required_key='policies')
+    if result is None:
+        logging.error(f"Failed to parse JSON from pages {page_numbers[0] + 1}-{page_numbers[-1] + 1}")
+        return {}, False
+
+    by_page = {page_num: [] for page_num in page_numbers}
+    starts = set(page_numbers) | ({context[0]} if context else set())
+    for policy in llm_output.normalize_policies(result):
+        try:
+            page_num = int(policy.get('page')) - 1
+        except (TypeError, ValueError):
+            page_num = None
+        if page_num not in starts:
+            page_num = page_numbers[0]
+        policy['page'] = page_num + 1
+        by_page[page_num if page_num in by_page else page_numbers[0]].append(policy)
+    return by_page, True
+
+def get_packed_policy_extraction_prompt(page_numbers, context_page=None, continues=False):
+    """
+    The policy extraction prompt for consecutive pages sent together, each
+    image labelled with its page number. page_numbers are zero-based.
+    """
+    first, last = page_numbers[0] + 1, page_numbers[-1] + 1
+    notes = [
+        f"The images are consecutive pages of the document, pages {first} to {last}, each labelled with its page number.",
+        'Set "page" on every policy to the page number its text starts on.',
+        "A policy that runs from one page onto the next must be extracted once, with its complete text."
+    ]
+    if context_page is not None:
+        notes.append(f"Page {context_page + 1} is included only as context and was processed separately: "
+                     f"do not extract policies that are entirely on it, but extract a policy that starts on it "
+                     f"and continues onto page {first}, with page {context_page + 1}.")
+    if continues:
+        notes.append(f"The document continues after page {last}: skip a policy that is cut off at the end of "
+                     f"page {last}, it will be extracted with the following pages.")
+    return get_policy_extraction_prompt() + "\n\nThese pages:\n" + "\n".join(f"- {note}" for note in notes)
+
 def extract_policies_from_text(text_content):
     """
     Extract policy rules from text content using LLM.
@@ -570,22 +1298,21 @@ def extract_policies_from_text(text_content):
         all_policies = []
 
         # Process the text with LLM
-        response = llm_utils.invoke_bedrock_claude_sonnet_37(
-            prompt=get_policy_extraction_prompt_for_text(text_content),
+        response = invoke_structured(
+            get_policy_extraction_prompt_for_text(text_content),
+            llm_output.POLICY_LIST_TOOL,
             max_tokens=4000
         )
 
         # Extract JSON from response
-        json_match = extract_json(response)
-        if json_match:
-            try:
-                result = json.loads(json_match)
-                policies = result.get('policies', [])
-                all_policies.extend(policies)
-                print(f"Extracted {len(policies)} policies from text")
-            except json.JSONDecodeError:
-                logging.error("Failed to parse JSON from text processing")
-                print("Failed to parse JSON from text processing")
+        result = parse_llm_json(response, 'policy_text', required_key='policies')
+        if result is not None:
+            policies = llm_output.normalize_policies(result)
+            all_policies.extend(policies)
+            print(f"Extracted {len(policies)} policies from text")
+        else:
+            logging.error("Failed to parse JSON from text processing")
+            print("Failed to parse JSON from text processing")
 
         # Post-process to remove duplicates
         unique_policies = remove_duplicate_policies(all_policies)
@@ -0,0 +1,51 @@
+import json
+import os
+from decimal import Decimal
+from functools import lru_cache
+
+FX_RATES_PATH = os.getenv('FX_RATES_PATH', os.path.join(os.path.dirname(__file__), 'fx_rates.json'))
+BASE_CURRENCY = os.getenv('BASE_CURRENCY', 'USD').upper()
+
+# Common symbols and names the extractor returns instead of ISO codes
+CURRENCY_ALIASES = {
+    '$': 'USD', 'US$': 'USD', 'USD$': 'USD', 'DOLLAR': 'USD',
+    '€': 'EUR', 'EURO': 'EUR',
+    '£': 'GBP', 'POUND': 'GBP',
+    '¥': 'JPY', 'YEN': 'JPY', 'RMB': 'CNY',
+    '₹': 'INR', 'RS': 'INR', 'RS.': 'INR', 'RUPEE': 'INR',
+    '₩': 'KRW', 'R$': 'BRL', 'C$': 'CAD', 'A$': 'AUD', 'S$': 'SGD', 'HK$': 'HKD'
+}
+
+@lru_cache(maxsize=1)
+def load_rates(path=FX_RATES_PATH):
+    """
+    Load the offline rate table: {currency: units per 1 table-base unit}.
+
+    The table is read once and cached for the life of the process.
+    """
+    with open(path) as f:
+        table = json.load(f)
+    return {code.upper(): Decimal(str(rate)) for code, rate in table['rates'].items()}
+
+def normalize_currency(currency):
+    """Map an extracted currency (code, symbol or name) to an ISO code, or None"""
+    if not currency or not isinstance(currency, str):
+        return None
+    code = currency.strip().upper()
+    return CURRENCY_ALIASES.get(code, code if len(code) == 3 and code.isalpha() else None)
+
+def rate(from_currency, to_currency=BASE_CURRENCY):
+    """
+    Multiplier converting an amount in from_currency to to_currency, or None
+    when either currency is missing from the table.
+    """
+    rates = load_rates()
+    source, target = rates.get(from_currency), rates.get(to_currency)
+    if source is None or target is None:
+        return None
+    return target / source
+
+def convert(amount, from_currency, to_currency=BASE_CURRENCY):
+    """Convert a Decimal amount, returning None for unknown currencies"""
+    multiplier = rate(from_currency, to_currency)
+    return None if multiplier is None else amount * multiplier
@@ -0,0 +1,222 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+import metrics
+import scheduler
+
+# Hedged LLM requests: when a call has not returned after a high percentile
+# of recent latency, an identical second request is issued and whichever
+# succeeds first is used. Attempts are streamed so the loser can be closed,
+# which needs the bedrock:InvokeModelWithResponseStream IAM permission
+HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'False').lower() == 'true'
+HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 95))
+# Send the hedge to the fallback model rather than the same one
+HEDGE_TO_FALLBACK = os.getenv('LLM_HEDGE_TO_FALLBACK', 'True').lower() == 'true'
+
+# Delay used until MIN_SAMPLES latencies have been seen, and the floor after
+DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', 15.0))
+MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 1.0))
+MIN_SAMPLES = 20
+
+# At most MAX_RATE of the last BUDGET_WINDOW calls may be hedged (of the
+# calls made so far until there are that many, so the first 1/MAX_RATE
+# calls are never hedged)
+MAX_RATE = float(os.getenv('LLM_HEDGE_MAX_RATE', 0.1))
+BUDGET_WINDOW = 200
+
+class CancelToken:
+    """
+    Cancellation flag for one attempt. Callbacks registered with on_cancel
+    (e.g. closing a response stream) run when it is cancelled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+class HedgeBudget:
+    """
+    Caps hedging at max_rate of the last window calls, or of every call so
+    far while there have been fewer.
+    """
+
+    def __init__(self, max_rate=MAX_RATE, window=BUDGET_WINDOW):
+        self.max_rate = max_rate
+        self._calls = deque(maxlen=window)
+        self._hedged = 0
+        self._lock = threading.Lock()
+
+    def _record(self, hedged):
+        if len(self._calls) == self._calls.maxlen and self._calls[0]:
+            self._hedged -= 1
+        self._calls.append(hedged)
+        if hedged:
+            self._hedged += 1
+
+    def record_unhedged(self):
+        with self._lock:
+            self._record(False)
+
+    def try_acquire(self):
+        """Record a hedged call and return True if the budget allows one"""
+        with self._lock:
+            if self._hedged + 1 > self.max_rate * min(len(self._calls) + 1, self._calls.maxlen):
+                return False
+            self._record(True)
+            return True
+
+_budget = HedgeBudget()
+
+def hedge_delay(kind):
+    """Seconds to wait for the first attempt before hedging, from recent primary attempt latency"""
+    if metrics.count('llm_attempt_seconds', kind=kind) < MIN_SAMPLES:
+        return DEFAULT_DELAY
+    return max(MIN_DELAY, metrics.percentile('llm_attempt_seconds', HEDGE_PERCENTILE, kind=kind))
+
+def _is_error(result):
+    return isinstance(result, dict) and 'error' in result
+
+class _Race:
+    """Attempts of one call running in background threads; the first success wins"""
+
+    def __init__(self, kind, cancel=None):
+        self.kind = kind
+        self.cancel = cancel
+        self.winner = None
+        self._condition = threading.Condition()
+        self._tokens = {}
+        self._running = 0
+        self._result = None
+        self._error = None
+
+    def start(self, role, call):
+        token = CancelToken()
+        with self._condition:
+            self._tokens[role] = token
+            self._running += 1
+        if self.cancel is not None:
+            self.cancel.on_cancel(token.cancel)
+        # In a copy of the caller's context, so context-scoped state (e.g.
+        # llm_utils.record_usage) follows the attempt
+        threading.Thread(target=contextvars.copy_context().run, args=(self._run, role, call, token),
+                         name=f"llm-{role}", daemon=True).start()
+
+    def _run(self, role, call, token):
+        start = time.perf_counter()
+        try:
+            result = call(token)
+        except Exception as e:
+            result = {"error": str(e)}
+        elapsed = time.perf_counter() - start
+
+        losers = []
+        with self._condition:
+            self._running -= 1
+            if token.cancelled:
+                metrics.increment('llm_attempts_cancelled', kind=self.kind, role=role)
+            else:
+                # Only primary attempts set the hedge delay: a hedge may go to
+                # the fallback model, whose latency is no guide to the primary's
+                metrics.observe('llm_attempt_seconds' if role == 'primary' else 'llm_hedge_attempt_seconds',
+                                elapsed, kind=self.kind)
+            if self.winner is None and not _is_error(result):
+                self.winner = role
+                self._result = result
+                losers = [other for name, other in self._tokens.items() if name != role]
+            elif self._error is None:
+                self._error = result
+            self._condition.notify_all()
+
+        for loser in losers:
+            loser.cancel()
+
+    def wait(self, timeout=None):
+        """Wait until there is a winner or every attempt has failed; False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.winner is not None or self._running == 0, timeout)
+
+    def result(self):
+        with self._condition:
+            return self._result if self.winner is not None else self._error
+
+def _releasing_slot(call):
+    """call, giving back the scheduler slot taken for it when it returns"""
+    def run(token):
+        try:
+            return call(token)
+        finally:
+            scheduler.release_slot()
+    return run
+
+def hedged_call(kind, primary, hedge=None, cancel=None):
+    """
+    Run primary(cancel_token); if it has not returned after hedge_delay(kind)
+    and the hedge budget allows, start hedge(cancel_token) as well, on an
+    LLM slot of its own (not hedging when no slot is free right away). The
+    first successful result is returned and the other attempt is cancelled.
+
+    primary and hedge return llm_utils results ({"error": ...} on failure).
+    Without hedging (disabled, or hedge is None) primary runs inline. When
+    cancel (a CancelToken of the caller) is cancelled, so are the attempts.
+    """
+    start = time.perf_counter()
+
+    if not HEDGE_ENABLED or hedge is None:
+        result = primary(cancel)
+        elapsed = time.perf_counter() - start
+        metrics.increment('llm_calls', kind=kind)
+        metrics.observe('llm_attempt_seconds', elapsed, kind=kind)
+        metrics.observe('llm_call_seconds', elapsed, kind=kind)
+        return result
+
+    race = _Race(kind, cancel)
+    race.start('primary', primary)
+
+    hedged = False
+    if not race.wait(hedge_delay(kind)):
+        if not scheduler.try_slot():
+            # A hedge must not take capacity other requests are waiting for
+            metrics.increment('llm_hedges_no_slot', kind=kind)
+        elif not _budget.try_acquire():
+            scheduler.release_slot()
+            metrics.increment('llm_hedges_suppressed', kind=kind)
+        else:
+            hedged = True
+            metrics.increment('llm_hedges', kind=kind)
+            race.start('hedge', _releasing_slot(hedge))
+        race.wait()
+
+    if not hedged:
+        _budget.record_unhedged()
+    if race.winner == 'hedge':
+        metrics.increment('llm_hedge_wins', kind=kind)
+
+    metrics.increment('llm_calls', kind=kind)
+    metrics.observe('llm_call_seconds', time.perf_counter() - start, kind=kind)
+    return race.result()
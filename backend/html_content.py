@@ -0,0 +1,359 @@
+import os
+import re
+from html.parser import HTMLParser
+
+# Main content extraction for policy pages fetched from a URL. Intranet
+# pages carry navigation menus, cookie banners, sidebars and footers that
+# otherwise count toward the text extraction's character cap and tokens.
+# The page is parsed in one streaming pass into a light tree, boilerplate
+# is pruned by tag, ARIA role and id/class words, and the main content
+# region is chosen from semantic tags or, failing those, by text and link
+# density. Headings, list items and table rows are kept as lines of their
+# own, so section boundaries survive in the compact text.
+HTML_CONTENT_EXTRACTION = os.getenv('HTML_CONTENT_EXTRACTION', 'True').lower() == 'true'
+
+# Elements whose content is never text
+SKIP_TAGS = frozenset(['script', 'style', 'noscript', 'template', 'svg', 'math', 'iframe', 'object', 'canvas',
+                       'button', 'select', 'textarea', 'head', 'title'])
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                       'source', 'track', 'wbr'])
+# Elements that start a new line of output
+BLOCK_TAGS = frozenset(['address', 'article', 'aside', 'blockquote', 'body', 'dd', 'details', 'div', 'dl', 'dt',
+                        'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                        'header', 'hr', 'html', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'summary', 'table',
+                        'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul', 'caption'])
+HEADINGS = {f'h{level}': level for level in range(1, 7)}
+# Opening one of these closes an open element of the listed kinds
+IMPLIED_END = {
+    'p': {'p'}, 'li': {'li'}, 'dt': {'dt', 'dd'}, 'dd': {'dt', 'dd'}, 'tr': {'tr', 'td', 'th'},
+    'td': {'td', 'th'}, 'th': {'td', 'th'}, 'option': {'option'}
+}
+# Opening a block closes an open paragraph
+CLOSES_P = BLOCK_TAGS - {'body', 'html', 'td', 'th', 'li', 'dd', 'dt', 'tbody', 'thead', 'tfoot', 'tr'}
+
+BOILERPLATE_TAGS = frozenset(['nav', 'aside', 'footer', 'dialog'])
+# Forms are pruned only when small (search boxes, logins) or mostly links:
+# CMS and ASP.NET pages wrap the whole body in one
+BOILERPLATE_ROLES = frozenset(['navigation', 'banner', 'contentinfo', 'complementary', 'search', 'menu', 'menubar',
+                               'dialog', 'alertdialog', 'toolbar'])
+# Words in an id or class that mark boilerplate, unless a content word is present too
+BOILERPLATE_WORDS = frozenset(['nav', 'navbar', 'navigation', 'menu', 'menubar', 'megamenu', 'breadcrumb',
+                               'breadcrumbs', 'sidebar', 'footer', 'masthead', 'cookie', 'cookies', 'consent',
+                               'gdpr', 'banner', 'share', 'social', 'sharing', 'skip', 'popup', 'modal', 'newsletter',
+                               'subscribe', 'related', 'promo', 'advert', 'ad', 'ads', 'comments', 'toolbar',
+                               'login', 'search', 'widget', 'rating', 'feedback', 'toc'])
+CONTENT_WORDS = frozenset(['content', 'article', 'main', 'body', 'post', 'entry', 'policy', 'document', 'text'])
+_WORDS = re.compile(r'[a-z]+')
+_SPACE = re.compile(r'\s+')
+_CHARSET = re.compile(rb'charset=["\']?([\w-]+)', re.I)
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.I)
+
+# Density scoring (when the page has no main or article element): blocks
+# shorter than this don't score, nor do blocks mostly made of links
+MIN_SCORED_TEXT = 25
+MAX_SCORED_LINK_DENSITY = 0.5
+# Siblings of the best container are kept when they score this fraction of it
+SIBLING_SCORE_RATIO = 0.2
+# Within the content, lists and blocks at least this much link text are dropped
+MAX_LINK_DENSITY = 0.75
+# A region with less text than this falls back to the pruned page
+MIN_REGION_TEXT = 200
+# An extraction shorter than this isn't trusted; callers should fall back
+# to the page's full text
+MIN_EXTRACTED_TEXT = 200
+
+class Node:
+    __slots__ = ('tag', 'attrs', 'parent', 'children', 'text_length', 'link_length', 'score')
+
+    def __init__(self, tag, attrs, parent):
+        self.tag = tag
+        self.attrs = attrs
+        self.parent = parent
+        self.children = []
+        self.text_length = 0
+        self.link_length = 0
+        self.score = 0.0
+
+    def link_density(self):
+        return self.link_length / self.text_length if self.text_length else 0.0
+
+    def iter(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(child for child in reversed(node.children) if isinstance(child, Node))
+
+class _TreeBuilder(HTMLParser):
+    """Streaming parse into Nodes, skipping non-text elements and mending unclosed ones"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node('document', {}, None)
+        self.open = [self.root]
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'body':
+            # </head> is optional
+            self.skipping = 0
+        if self.skipping:
+            if tag in SKIP_TAGS and tag not in VOID_TAGS:
+                self.skipping += 1
+            return
+        if tag in SKIP_TAGS:
+            self.skipping = 1
+            return
+        closes = IMPLIED_END.get(tag, set()) | ({'p'} if tag in CLOSES_P else set())
+        if closes:
+            self._close_open(closes)
+        node = Node(tag, {name: value or '' for name, value in attrs if name in ('id', 'class', 'role', 'href', 'hidden', 'aria-hidden')}, self.open[-1])
+        self.open[-1].children.append(node)
+        if tag not in VOID_TAGS:
+            self.open.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.skipping and tag not in SKIP_TAGS:
+            self.handle_starttag(tag, attrs)
+            if tag not in VOID_TAGS and self.open[-1].tag == tag:
+                self.open.pop()
+
+    def handle_endtag(self, tag):
+        if self.skipping:
+            if tag in SKIP_TAGS:
+                self.skipping -= 1
+            return
+        for depth in range(len(self.open) - 1, 0, -1):
+            if self.open[depth].tag == tag:
+                del self.open[depth:]
+                return
+
+    def _close_open(self, tags):
+        # Only within the nearest list, table or block container
+        for depth in range(len(self.open) - 1, 0, -1):
+            open_tag = self.open[depth].tag
+            if open_tag in tags:
+                del self.open[depth:]
+                return
+            if open_tag in ('ul', 'ol', 'dl', 'table', 'div', 'section', 'article', 'main', 'body'):
+                return
+
+    def handle_data(self, data):
+        if not self.skipping and data:
+            self.open[-1].children.append(data)
+
+def parse(html):
+    builder = _TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+def _words(node):
+    return set(_WORDS.findall(f"{node.attrs.get('id', '')} {node.attrs.get('class', '')}".lower()))
+
+def is_boilerplate(node, in_content):
+    """Whether an element is page furniture rather than content"""
+    if node.tag in ('html', 'body', 'main', 'article'):
+        return False
+    if 'hidden' in node.attrs or node.attrs.get('aria-hidden') == 'true':
+        return True
+    role = node.attrs.get('role', '').lower()
+    if role in BOILERPLATE_ROLES:
+        return True
+    if role == 'main':
+        return False
+    if node.tag in BOILERPLATE_TAGS:
+        return True
+    # A page header is a banner; a header within an article is its title
+    if node.tag == 'header' and not in_content:
+        return True
+    words = _words(node)
+    return bool(words & BOILERPLATE_WORDS) and not words & CONTENT_WORDS
+
+def prune(root):
+    """Remove boilerplate elements and count each remaining element's text and link text"""
+    # An explicit stack rather than recursion: generated pages can nest
+    # deeper than Python's recursion limit. Each element is visited on the
+    # way down, to drop boilerplate children, and again on the way up, to
+    # add up its children's text
+    stack = [(root, False, False, False)]
+    while stack:
+        node, in_content, in_link, counted = stack.pop()
+        if not counted:
+            in_content = in_content or node.tag in ('main', 'article') or node.attrs.get('role') == 'main'
+            in_link = in_link or node.tag == 'a'
+            node.children = [child for child in node.children
+                             if not (isinstance(child, Node) and is_boilerplate(child, in_content))]
+            stack.append((node, in_content, in_link, True))
+            stack.extend((child, in_content, in_link, False) for child in node.children if isinstance(child, Node))
+            continue
+        kept = []
+        for child in node.children:
+            if isinstance(child, Node):
+                if child.tag == 'form' and (child.text_length < MIN_REGION_TEXT
+                                            or child.link_density() > MAX_SCORED_LINK_DENSITY):
+                    continue
+                node.text_length += child.text_length
+                node.link_length += child.link_length
+            else:
+                length = len(child.strip())
+                node.text_length += length
+                if in_link:
+                    node.link_length += length
+            kept.append(child)
+        node.children = kept
+
+def _own_text(node):
+    return ''.join(child for child in node.children if isinstance(child, str))
+
+def score(root):
+    """
+    Readability-style scoring: each paragraph-like block with enough text
+    and few links adds to its parent and half as much to its grandparent.
+    Returns the best scoring container, weighted by its link density.
+    """
+    best = None
+    for node in root.iter():
+        if node.tag not in ('p', 'pre', 'blockquote', 'li', 'td', 'dd') and not (
+                node.tag in ('div', 'section') and len(_own_text(node).strip()) >= MIN_SCORED_TEXT):
+            continue
+        if node.text_length < MIN_SCORED_TEXT or node.link_density() > MAX_SCORED_LINK_DENSITY:
+            continue
+        points = 1 + _own_text(node).count(',') + min(node.text_length / 100, 3)
+        for ancestor, share in ((node.parent, 1.0), (node.parent and node.parent.parent, 0.5)):
+            if ancestor is not None and ancestor.tag != 'document':
+                ancestor.score += points * share
+    for node in root.iter():
+        if node.score and (best is None or node.score * (1 - node.link_density()) > best.score * (1 - best.link_density())):
+            best = node
+    return best
+
+def main_region(root):
+    """The elements holding the page's main content, in document order"""
+    semantic = [node for node in root.iter() if node.tag == 'main' or node.attrs.get('role') == 'main']
+    if not semantic:
+        articles = [node for node in root.iter() if node.tag == 'article']
+        # Several articles side by side are a listing, not one document
+        if len(articles) == 1:
+            semantic = articles
+    if semantic:
+        region = max(semantic, key=lambda node: node.text_length)
+        if region.text_length >= MIN_REGION_TEXT:
+            return [region]
+
+    best = score(root)
+    if best is None or best.text_length < MIN_REGION_TEXT or best.parent is None:
+        return [root]
+    threshold = max(best.score * SIBLING_SCORE_RATIO, 1)
+    region = []
+    for sibling in best.parent.children:
+        if sibling is best:
+            region.append(sibling)
+        elif isinstance(sibling, Node):
+            # Headings introduce the content next to them
+            if sibling.score >= threshold or sibling.tag in HEADINGS or (
+                    sibling.tag in ('p', 'ul', 'ol', 'table') and sibling.text_length >= MIN_SCORED_TEXT
+                    and sibling.link_density() < MAX_SCORED_LINK_DENSITY):
+                region.append(sibling)
+    return region
+
+class _Renderer:
+    """Compact text: one line per block, '#' headings, '-' list items and '|' separated cells"""
+
+    def __init__(self):
+        self.lines = []
+        self.line = []
+        self.prefix = ''
+        self.top = None
+
+    def flush(self):
+        text = _SPACE.sub(' ', ''.join(self.line)).strip()
+        if text:
+            self.lines.append(self.prefix + text)
+        self.line = []
+        self.prefix = ''
+
+    def render(self, node):
+        # Walked with an explicit stack, like prune, so deeply nested pages
+        # don't hit the recursion limit
+        stack = [('enter', node, 0)]
+        while stack:
+            action, item, list_depth = stack.pop()
+            if action == 'text':
+                self.line.append(item)
+            elif action == 'cell':
+                self.render_inline(item)
+                self.line.append(' | ')
+            elif action == 'exit':
+                if item.tag == 'tr' and self.line:
+                    self.line = [''.join(self.line).rstrip().rstrip('|')]
+                self.flush()
+            else:
+                self._enter(item, list_depth, stack)
+
+    def _enter(self, node, list_depth, stack):
+        tag = node.tag
+        if tag in ('ul', 'ol', 'div', 'section', 'table', 'dl') and node is not self.top \
+                and node.link_density() >= MAX_LINK_DENSITY:
+            return
+        if tag == 'br':
+            self.flush()
+            return
+        block = tag in BLOCK_TAGS
+        if block:
+            self.flush()
+        if tag in HEADINGS:
+            self.prefix = '#' * HEADINGS[tag] + ' '
+        elif tag == 'li':
+            self.prefix = '  ' * max(list_depth - 1, 0) + '- '
+        depth = list_depth + (tag in ('ul', 'ol'))
+        if block:
+            stack.append(('exit', node, depth))
+        for child in reversed(node.children):
+            if isinstance(child, Node):
+                if tag == 'tr' and child.tag in ('td', 'th') and not any(
+                        descendant.tag in BLOCK_TAGS for descendant in child.iter() if descendant is not child):
+                    # Cells of a row stay on its line, unless they hold blocks (a layout table)
+                    stack.append(('cell', child, depth))
+                else:
+                    stack.append(('enter', child, depth))
+            else:
+                stack.append(('text', child, depth))
+
+    def render_inline(self, node):
+        stack = list(reversed(node.children))
+        while stack:
+            child = stack.pop()
+            if isinstance(child, Node):
+                if child.tag == 'br' or child.tag in BLOCK_TAGS:
+                    self.line.append(' ')
+                stack.extend(reversed(child.children))
+            else:
+                self.line.append(child)
+
+    def text(self, region):
+        for node in region:
+            self.top = node
+            self.render(node)
+        self.flush()
+        return '\n'.join(self.lines)
+
+def decode(content, content_type=''):
+    """Text of an HTML response: in the charset of the Content-Type header, else of the page's meta tag, else UTF-8"""
+    candidates = [match.group(1).decode('ascii', 'ignore') for match in
+                  (_CHARSET.search(content_type.encode('latin-1', 'ignore')), _META_CHARSET.search(content[:4096])) if match]
+    for encoding in candidates + ['utf-8']:
+        try:
+            return content.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return content.decode('utf-8', errors='replace')
+
+def extract_main_text(html):
+    """
+    Compact text of the main content of an HTML page, with headings as
+    '#' lines, list items as '-' lines and table rows as '|' separated cells
+    """
+    root = parse(html)
+    prune(root)
+    return _Renderer().text(main_region(root))
@@ -0,0 +1,59 @@
+import math
+from PIL import Image
+
+HASH_SIZE = 8
+HIGHFREQ_FACTOR = 4
+
+# Cosine table for the low-frequency rows of a 32-point DCT-II, built once
+_DCT_SIZE = HASH_SIZE * HIGHFREQ_FACTOR
+_DCT_TABLE = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+    for u in range(HASH_SIZE)
+]
+
+def phash(image):
+    """
+    Compute a 64-bit perceptual hash (DCT based) of a PIL image.
+    """
+    size = _DCT_SIZE
+    small = image.convert('L').resize((size, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    rows = [pixels[i * size:(i + 1) * size] for i in range(size)]
+
+    # Separable 2D DCT, keeping only the top-left HASH_SIZE x HASH_SIZE block
+    row_coeffs = [
+        [sum(c * p for c, p in zip(_DCT_TABLE[u], row)) for u in range(HASH_SIZE)]
+        for row in rows
+    ]
+    coeffs = []
+    for v in range(HASH_SIZE):
+        table = _DCT_TABLE[v]
+        for u in range(HASH_SIZE):
+            coeffs.append(sum(table[r] * row_coeffs[r][u] for r in range(size)))
+
+    # Compare against the median of the AC coefficients (DC dominates otherwise)
+    ac = sorted(coeffs[1:])
+    median = ac[len(ac) // 2]
+
+    value = 0
+    for coeff in coeffs:
+        value = (value << 1) | (1 if coeff > median else 0)
+    return value
+
+def dhash(image):
+    """
+    Compute a 64-bit difference hash of a PIL image.
+    """
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = list(small.getdata())
+
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return value
+
+def hamming_distance(a, b):
+    """Number of differing bits between two integer hashes"""
+    return (a ^ b).bit_count()
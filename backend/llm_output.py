@@ -0,0 +1,509 @@
+import json
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+_decoder = json.JSONDecoder()
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+# JSON schemas for the objects the prompts ask the model to return. They are
+# used to validate parsed responses and double as tool input schemas.
+RECEIPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "invoiceNumber": {"type": ["string", "null"]},
+        "date": {"type": ["string", "null"], "description": "Invoice date in YYYY-MM-DD format"},
+        "currency": {"type": ["string", "null"], "description": "ISO currency code"},
+        "vendor": {"type": ["string", "null"]},
+        "expenseType": {"type": ["string", "null"]},
+        "expenseLocation": {"type": ["string", "null"]},
+        "expenseCountry": {"type": ["string", "null"]},
+        "numberOfPeople": {"type": ["string", "integer", "null"]},
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "description": {"type": ["string", "null"]},
+                    "quantity": {"type": ["string", "number", "null"]},
+                    "amount": {"type": ["string", "number", "null"]}
+                }
+            }
+        },
+        "amount": {"type": ["string", "number", "null"], "description": "Subtotal without currency symbol"},
+        "taxes": {"type": ["string", "number", "null"], "description": "Tax amount without currency symbol"},
+        "total": {"type": ["string", "number"], "description": "Total amount without currency symbol"}
+    },
+    "required": ["total"]
+}
+
+# What a near-duplicate receipt is confirmed by (see receipt_index)
+RECEIPT_KEY_FIELDS_SCHEMA = {
+    "type": "object",
+    "properties": {key: RECEIPT_SCHEMA["properties"][key] for key in ("date", "vendor", "total")},
+    "required": ["total"]
+}
+
+POLICY_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "policies": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "text": {"type": "string", "description": "Exact policy text"},
+                    "country": {"type": "string", "description": "Country name or 'global'"},
+                    "expenseType": {"type": "string"},
+                    "seniority": {"type": "string", "description": "Seniority level or 'all'"},
+                    "confidence": {"type": "number"},
+                    "approved": {"type": "boolean"}
+                },
+                "required": ["text"]
+            }
+        }
+    },
+    "required": ["policies"]
+}
+
+# Policies found on several pages at once carry the page each one starts on
+PACKED_POLICY_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "policies": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": dict(
+                    POLICY_LIST_SCHEMA["properties"]["policies"]["items"]["properties"],
+                    page={"type": "integer", "description": "Page number the policy text starts on"}
+                ),
+                "required": ["text", "page"]
+            }
+        }
+    },
+    "required": ["policies"]
+}
+
+COMPLIANCE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "isCompliant": {"type": "boolean"},
+        "violations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"message": {"type": "string"}},
+                "required": ["message"]
+            }
+        }
+    },
+    "required": ["isCompliant", "violations"]
+}
+
+# Bedrock tool definitions for structured (tool use) output
+RECEIPT_TOOL = {
+    "name": "record_receipt",
+    "description": "Record the fields extracted from the invoice or receipt image.",
+    "input_schema": RECEIPT_SCHEMA
+}
+
+RECEIPT_KEY_FIELDS_TOOL = {
+    "name": "record_receipt_key_fields",
+    "description": "Record the date, vendor and total of the invoice or receipt image.",
+    "input_schema": RECEIPT_KEY_FIELDS_SCHEMA
+}
+
+POLICY_LIST_TOOL = {
+    "name": "record_policies",
+    "description": "Record the expense policy rules found in the document.",
+    "input_schema": POLICY_LIST_SCHEMA
+}
+
+PACKED_POLICY_LIST_TOOL = {
+    "name": "record_policies",
+    "description": "Record the expense policy rules found on the document pages, with the page each starts on.",
+    "input_schema": PACKED_POLICY_LIST_SCHEMA
+}
+
+COMPLIANCE_TOOL = {
+    "name": "record_compliance_verdict",
+    "description": "Record whether the invoice complies with the expense policies and list any violations.",
+    "input_schema": COMPLIANCE_SCHEMA
+}
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None)
+}
+
+def extract_json(response, required_key=None):
+    """
+    Extract a JSON object from an LLM response and return it parsed.
+
+    The response is scanned once for balanced top-level {...} spans (string
+    literals are respected), each span is decoded with raw_decode, and the
+    first object containing required_key (or the first object at all) wins.
+    If the response ends inside an unterminated object, e.g. because
+    max_tokens cut it off, the complete elements are salvaged.
+    Returns None when nothing usable is found.
+
+    A dict response is an already-parsed structured (tool use) result and is
+    returned as is, unless it is an {"error": ...} from llm_utils.
+    """
+    if isinstance(response, dict):
+        return None if 'error' in response else response
+    if not isinstance(response, str):
+        return None
+
+    first_object = None
+    stack = []
+    start = None
+    in_string = False
+    escaped = False
+    last_safe = None  # (end index, open containers) after the last closed container
+
+    for index, char in enumerate(response):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            if stack:
+                in_string = True
+        elif char in '{[':
+            if not stack:
+                if char == '[':
+                    continue
+                start = index
+            stack.append(char)
+        elif char in '}]' and stack:
+            if _CLOSERS[stack[-1]] != char:
+                # Mismatched bracket: not JSON, abandon this span
+                stack = []
+                start = None
+                last_safe = None
+                continue
+            stack.pop()
+            if stack:
+                last_safe = (index + 1, list(stack))
+                continue
+
+            obj = _decode_span(response, start)
+            start = None
+            last_safe = None
+            if isinstance(obj, dict):
+                if required_key is None or required_key in obj:
+                    return obj
+                if first_object is None:
+                    first_object = obj
+
+    if stack and start is not None and last_safe is not None:
+        repaired = _repair_truncated(response, start, *last_safe)
+        if isinstance(repaired, dict) and (required_key is None or required_key in repaired):
+            return repaired
+
+    return first_object
+
+def _decode_span(text, start):
+    try:
+        obj, _ = _decoder.raw_decode(text, start)
+        return obj
+    except json.JSONDecodeError:
+        return None
+
+def _repair_truncated(text, start, end, open_containers):
+    """
+    Close a truncated object after its last complete element.
+    """
+    closing = ''.join(_CLOSERS[char] for char in reversed(open_containers))
+    candidate = text[start:end].rstrip().rstrip(',') + closing
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        return None
+
+def validate(value, schema, path='$'):
+    """
+    Validate a parsed value against the subset of JSON schema used above.
+
+    Returns a list of error strings (empty when valid).
+    """
+    errors = []
+    expected = schema.get('type')
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_matches_type(value, name) for name in types):
+            return [f"{path}: expected {'/'.join(types)}, got {type(value).__name__}"]
+
+    if isinstance(value, dict):
+        for key in schema.get('required', []):
+            if value.get(key) in (None, ''):
+                errors.append(f"{path}.{key}: required")
+        for key, subschema in schema.get('properties', {}).items():
+            if key in value and value[key] is not None:
+                errors.extend(validate(value[key], subschema, f"{path}.{key}"))
+    elif isinstance(value, list) and 'items' in schema:
+        for index, item in enumerate(value):
+            errors.extend(validate(item, schema['items'], f"{path}[{index}]"))
+
+    return errors
+
+def _matches_type(value, name):
+    if name in ('number', 'integer'):
+        if isinstance(value, bool):
+            return False
+        if name == 'integer':
+            return isinstance(value, int)
+        return isinstance(value, (int, float, Decimal))
+    return isinstance(value, _JSON_TYPES[name])
+
+def parse_amount(value):
+    """
+    Parse a monetary amount into a Decimal, or None.
+
+    Handles currency symbols/codes, thousands separators in either
+    convention ("1,234.56" / "1.234,56") and accounting negatives "(12.00)".
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+
+    # Currency symbols, codes and spaces go first, so "$ -5.00" and
+    # "USD -5.00" show their sign
+    text = re.sub(r'[^\d.,()\-]', '', str(value))
+    negative = text.startswith('(') and text.endswith(')') or text.startswith('-') or text.endswith('-')
+    text = re.sub(r'[^\d.,]', '', text)
+    if not re.search(r'\d', text):
+        return None
+
+    last_dot, last_comma = text.rfind('.'), text.rfind(',')
+    if last_dot >= 0 and last_comma >= 0:
+        # Whichever separator comes last is the decimal point
+        decimal_sep = '.' if last_dot > last_comma else ','
+    elif last_comma >= 0:
+        # A lone comma followed by exactly three digits is a thousands separator
+        decimal_sep = None if len(text) - last_comma - 1 == 3 or text.count(',') > 1 else ','
+    elif last_dot >= 0 and text.count('.') == 1:
+        decimal_sep = '.'
+    else:
+        decimal_sep = None
+
+    if decimal_sep:
+        whole, _, fraction = text.rpartition(decimal_sep)
+        text = re.sub(r'[.,]', '', whole) + '.' + fraction
+    else:
+        text = re.sub(r'[.,]', '', text)
+
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        return None
+    return -amount if negative else amount
+
+_DATE_FORMATS = (
+    '%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d',
+    '%d %b %Y', '%d %B %Y', '%b %d, %Y', '%B %d, %Y', '%b %d %Y', '%B %d %Y',
+    '%d-%b-%Y', '%d-%B-%Y', '%d %b %y', '%d-%b-%y'
+)
+
+def parse_date(value):
+    """
+    Normalise a date string to ISO format (YYYY-MM-DD), or None.
+
+    Numeric day/month orders are only resolved when unambiguous (one part
+    greater than 12); ambiguous dates are returned unchanged.
+    """
+    if not value or not isinstance(value, str):
+        return None
+
+    text = value.strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+
+    match = re.fullmatch(r'(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{2}|\d{4})', text)
+    if not match:
+        return text
+
+    first, second, year = int(match.group(1)), int(match.group(2)), int(match.group(3))
+    if year < 100:
+        year += 2000
+    if first > 12 and second <= 12:
+        day, month = first, second
+    elif second > 12 and first <= 12:
+        month, day = first, second
+    elif first == second:
+        day = month = first
+    else:
+        return text
+
+    try:
+        return datetime(year, month, day).strftime('%Y-%m-%d')
+    except ValueError:
+        return text
+
+def normalize_receipt(receipt):
+    """
+    Normalise a parsed receipt in place: amounts become Decimals, the date
+    ISO format, numberOfPeople an int. Returns (receipt, errors).
+    """
+    if not isinstance(receipt, dict):
+        return receipt, ["$: expected object"]
+
+    for key in ('amount', 'taxes', 'total'):
+        if key in receipt:
+            receipt[key] = parse_amount(receipt[key])
+
+    items = receipt.get('items')
+    if not isinstance(items, list):
+        receipt['items'] = []
+    else:
+        receipt['items'] = [item for item in items if isinstance(item, dict)]
+        for item in receipt['items']:
+            item['amount'] = parse_amount(item.get('amount'))
+            if item.get('quantity') is not None:
+                quantity = parse_amount(item['quantity'])
+                item['quantity'] = quantity if quantity is not None else item['quantity']
+
+    if receipt.get('date'):
+        receipt['date'] = parse_date(receipt['date'])
+
+    if isinstance(receipt.get('currency'), str):
+        receipt['currency'] = receipt['currency'].strip().upper()
+
+    people = receipt.get('numberOfPeople')
+    if people not in (None, ''):
+        match = re.search(r'\d+', str(people))
+        receipt['numberOfPeople'] = int(match.group()) if match else None
+
+    return receipt, validate(receipt, RECEIPT_SCHEMA)
+
+def normalize_policies(result):
+    """
+    Normalise a parsed policy list, dropping elements without policy text.
+    Returns the list of policies.
+    """
+    policies = result.get('policies') if isinstance(result, dict) else None
+    if not isinstance(policies, list):
+        return []
+
+    normalized = []
+    for policy in policies:
+        if not isinstance(policy, dict) or not isinstance(policy.get('text'), str) or not policy['text'].strip():
+            continue
+
+        policy['text'] = policy['text'].strip()
+        for key, default in (('country', 'global'), ('expenseType', 'other'), ('seniority', 'all')):
+            value = policy.get(key)
+            policy[key] = value.strip().lower() if isinstance(value, str) and value.strip() else default
+
+        try:
+            policy['confidence'] = min(1.0, max(0.0, float(policy.get('confidence', 0.7))))
+        except (TypeError, ValueError):
+            policy['confidence'] = 0.7
+        policy['approved'] = bool(policy.get('approved', False))
+        normalized.append(policy)
+
+    return normalized
+
+def normalize_compliance(result):
+    """
+    Normalise a parsed compliance verdict. Returns (result, errors).
+    """
+    if not isinstance(result, dict):
+        return result, validate(result, COMPLIANCE_SCHEMA)
+
+    violations = result.get('violations')
+    if not isinstance(violations, list):
+        violations = []
+    result['violations'] = [
+        violation if isinstance(violation, dict) else {'message': str(violation)}
+        for violation in violations
+    ]
+    if isinstance(result.get('isCompliant'), str):
+        result['isCompliant'] = result['isCompliant'].strip().lower() == 'true'
+
+    return result, validate(result, COMPLIANCE_SCHEMA)
+
+# How far a receipt's amounts may be from adding up: rounding on the
+# receipt, or 1% of the total for discounts and tips on larger bills
+AMOUNT_TOLERANCE = Decimal('0.02')
+AMOUNT_RELATIVE_TOLERANCE = Decimal('0.01')
+
+def check_receipt(receipt):
+    """
+    Consistency checks beyond the schema, used to decide whether an answer
+    from a cheaper model can be trusted: a total, an ISO date, subtotal plus
+    taxes equal to the total, and line items that add up to the subtotal or
+    total. Returns a list of problems.
+    """
+    total = receipt.get('total')
+    if not isinstance(total, Decimal):
+        return ["total: missing or not a number"]
+
+    problems = []
+    date = receipt.get('date')
+    if not isinstance(date, str) or not re.fullmatch(r'\d{4}-\d{2}-\d{2}', date):
+        problems.append(f"date: not a parsable date ({date!r})")
+
+    tolerance = max(AMOUNT_TOLERANCE, abs(total) * AMOUNT_RELATIVE_TOLERANCE)
+    subtotal = receipt.get('amount')
+    subtotal = subtotal if isinstance(subtotal, Decimal) else None
+    taxes = receipt.get('taxes') if isinstance(receipt.get('taxes'), Decimal) else Decimal(0)
+    if subtotal is not None and abs(subtotal + taxes - total) > tolerance:
+        problems.append(f"amounts: subtotal {subtotal} + taxes {taxes} != total {total}")
+
+    amounts = [item['amount'] for item in receipt.get('items', []) if isinstance(item.get('amount'), Decimal)]
+    if amounts:
+        items_total = sum(amounts)
+        targets = [total, total - taxes] + ([subtotal] if subtotal is not None else [])
+        if all(abs(items_total - target) > tolerance for target in targets):
+            problems.append(f"items: sum {items_total} matches neither the subtotal nor the total {total}")
+
+    return problems
+
+def _vendor_key(vendor):
+    return re.sub(r'[^a-z0-9]', '', vendor.lower()) if isinstance(vendor, str) else ''
+
+def same_receipt(fields, stored):
+    """
+    Whether key fields read from a receipt (total, date, vendor) agree with
+    a stored extraction: totals within AMOUNT_TOLERANCE, the same date, and
+    vendor names where both have one that contain each other.
+    """
+    total, stored_total = parse_amount(fields.get('total')), parse_amount(stored.get('total'))
+    if total is None or stored_total is None or abs(total - stored_total) > AMOUNT_TOLERANCE:
+        return False
+    receipt_date = parse_date(fields.get('date'))
+    if not receipt_date or receipt_date != parse_date(stored.get('date')):
+        return False
+    vendor, stored_vendor = _vendor_key(fields.get('vendor')), _vendor_key(stored.get('vendor'))
+    return not vendor or not stored_vendor or vendor in stored_vendor or stored_vendor in vendor
+
+def check_compliance(result, applicable_rules=()):
+    """
+    Consistency checks for a compliance verdict, used to decide whether an
+    answer from a cheaper model can be trusted: a non-compliant verdict
+    must list its violations, and a compliant one is not trusted when any
+    rule applied (a missed violation can't be seen in the answer itself).
+    Returns a list of problems.
+    """
+    if result.get('isCompliant') is False and not result.get('violations'):
+        return ["violations: non-compliant verdict without violations"]
+    if result.get('isCompliant') is True and applicable_rules:
+        return [f"isCompliant: compliant verdict on {len(applicable_rules)} applicable rules"]
+    return []
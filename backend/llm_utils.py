@@ -1,13 +1,182 @@
-import boto3
 import json
 import base64
+import contextvars
+import math
+import os
+import re
+import threading
+from contextlib import contextmanager
 from botocore.exceptions import ClientError
+import bedrock_pool
+
+# When enabled, callers that have a schema ask for it as a forced tool call
+# and read the tool input back instead of parsing JSON out of free text
+STRUCTURED_OUTPUT = os.getenv('LLM_STRUCTURED_OUTPUT', 'True').lower() == 'true'
+
+SONNET_37_MODEL_ID = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+SONNET_35_MODEL_ID = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
+
+# Try to use Claude 3.7 if available, otherwise fall back to 3.5
+SONNET_MODEL_IDS = [SONNET_37_MODEL_ID, SONNET_35_MODEL_ID]
+
+# Tiered routing: receipts are first sent to a fast, cheaper model and only
+# escalated to SONNET_MODEL_IDS when its answer fails validation. The fast
+# model must accept images.
+MODEL_TIERING_ENABLED = os.getenv('LLM_MODEL_TIERING', 'True').lower() == 'true'
+FAST_MODEL_ID = os.getenv('LLM_FAST_MODEL_ID', "us.anthropic.claude-3-haiku-20240307-v1:0")
+# Compliance checks too. Only the fast model's violations can be accepted:
+# a "compliant" verdict on an invoice that any rule applied to is always
+# escalated, so this saves calls only where most invoices break a rule
+COMPLIANCE_TIERING_ENABLED = os.getenv('LLM_COMPLIANCE_TIERING', 'False').lower() == 'true'
+
+# Token usage of the calls made inside record_usage(), per context
+_usage = contextvars.ContextVar('llm_usage', default=None)
+_usage_lock = threading.Lock()
+
+class Cancelled(Exception):
+    """Raised when a streamed call is cancelled by its caller"""
+
+class Base64Image:
+    """
+    A JPEG that is already base64 encoded (e.g. by a render pool worker).
+    Accepted wherever an image_file is, so the encoding isn't repeated.
+    """
+
+    def __init__(self, data: str):
+        self.data = data
+
+def encode_image(image_file):
+    """Base64 text of an image file object or Base64Image"""
+    if isinstance(image_file, Base64Image):
+        return image_file.data
+    return base64.b64encode(image_file.read()).decode()
+
+def image_content(image_file):
+    """
+    Message content blocks for an image (a file object or Base64Image), or
+    for a list of (label, image) pairs, each image preceded by its label.
+    """
+    images = image_file if isinstance(image_file, list) else [(None, image_file)]
+    content = []
+    for label, image in images:
+        if label:
+            content.append({"type": "text", "text": label})
+        content.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": "image/jpeg",
+                "data": encode_image(image)
+            }
+        })
+    return content
+
+def estimate_tokens(text):
+    """
+    Rough local estimate of the tokens in a text: words of up to four
+    characters count one token, longer ones one per four characters, and
+    each punctuation mark one. Good enough for budgets that leave some headroom.
+    """
+    return sum(max(1, math.ceil(len(piece) / 4)) if piece[0].isalnum() or piece[0] == '_' else 1
+               for piece in re.findall(r'\w+|[^\w\s]', text))
+
+@contextmanager
+def record_usage():
+    """
+    Collect the token usage reported by the model calls made inside (in
+    this context or copies of it). Yields a dict of calls, inputTokens and
+    outputTokens, updated as calls finish.
+    """
+    usage = {'calls': 0, 'inputTokens': 0, 'outputTokens': 0}
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+def _add_usage(model_response):
+    usage = _usage.get()
+    reported = model_response.get("usage") if isinstance(model_response, dict) else None
+    if usage is None or not reported:
+        return
+    with _usage_lock:
+        usage['calls'] += 1
+        usage['inputTokens'] += reported.get("input_tokens", 0)
+        usage['outputTokens'] += reported.get("output_tokens", 0)
+
+def output_mode():
+    """Name of the active output mode, used to label metrics"""
+    return 'tool' if STRUCTURED_OUTPUT else 'text'
+
+def _invoke(client, model_id, request, cancel=None):
+    """
+    Invoke a model and return the decoded response body.
+
+    cancel is an optional token with a cancelled property and an
+    on_cancel(callback) method. When given, the response is streamed so the
+    call can be abandoned part-way: cancelling closes the stream and this
+    raises Cancelled. The streamed events are reassembled into the same
+    shape invoke_model returns.
+    """
+    if cancel is None:
+        response = client.invoke_model(modelId=model_id, body=request)
+        model_response = json.loads(response["body"].read())
+        _add_usage(model_response)
+        return model_response
+
+    if cancel.cancelled:
+        raise Cancelled("Request cancelled")
+
+    response = client.invoke_model_with_response_stream(modelId=model_id, body=request)
+    stream = response["body"]
+    cancel.on_cancel(stream.close)
+
+    blocks = {}
+    parts = {}
+    stop_reason = None
+    usage = {}
+    try:
+        for event in stream:
+            if cancel.cancelled:
+                raise Cancelled("Request cancelled")
+            if "chunk" not in event:
+                raise RuntimeError(f"Stream error: {event}")
+
+            data = json.loads(event["chunk"]["bytes"])
+            event_type = data.get("type")
+            if event_type == "content_block_start":
+                blocks[data["index"]] = dict(data["content_block"])
+                parts[data["index"]] = []
+            elif event_type == "content_block_delta":
+                delta = data["delta"]
+                parts.setdefault(data["index"], []).append(delta.get("text") or delta.get("partial_json") or "")
+            elif event_type == "message_start":
+                usage.update(data.get("message", {}).get("usage", {}))
+            elif event_type == "message_delta":
+                stop_reason = data.get("delta", {}).get("stop_reason", stop_reason)
+                usage.update(data.get("usage", {}))
+    except Exception:
+        if cancel.cancelled:
+            raise Cancelled("Request cancelled")
+        raise
+
+    content = []
+    for index in sorted(blocks):
+        block = blocks[index]
+        text = "".join(parts.get(index, []))
+        if block.get("type") == "tool_use":
+            block["input"] = json.loads(text) if text else block.get("input", {})
+        else:
+            block["text"] = block.get("text", "") + text
+        content.append(block)
+    model_response = {"content": content, "stop_reason": stop_reason, "usage": usage}
+    _add_usage(model_response)
+    return model_response
 
 def invoke_bedrock_claude_sonnet(prompt: str, max_tokens: int = 512, temperature: float = 0.1):
     """
     Generic function to invoke Bedrock Claude model with given prompt and parameters.
     """
-    client = boto3.client("bedrock-runtime", region_name="us-east-1")
     model_id = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
 
     native_request = {
@@ -25,26 +194,23 @@ def invoke_bedrock_claude_sonnet(prompt: str, max_tokens: int = 512, temperature
     request = json.dumps(native_request)
 
     try:
-        response = client.invoke_model(modelId=model_id, body=request)
-        model_response = json.loads(response["body"].read())
+        model_response = bedrock_pool.call(lambda client: _invoke(client, model_id, request))
         print('''(''' + model_response["content"][0]["text"] + ''')''')
 
         return model_response["content"][0]["text"]
 
+    except Cancelled:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
-def invoke_bedrock_claude_sonnet_37(prompt: str, max_tokens: int = 512, temperature: float = 0.1):
+def invoke_bedrock_claude_sonnet_37(prompt: str, max_tokens: int = 512, temperature: float = 0.1, model_ids=None):
     """
     Generic function to invoke Bedrock Claude 3.7 model with given prompt and parameters.
+    model_ids overrides the models tried in order.
     """
-    client = boto3.client("bedrock-runtime", region_name="us-east-1")
-
     # Try to use Claude 3.7 if available, otherwise fall back to 3.5
-    model_ids = [
-        "us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-        "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
-    ]
+    model_ids = model_ids or SONNET_MODEL_IDS
 
     for model_id in model_ids:
         native_request = {
@@ -62,8 +228,7 @@ def invoke_bedrock_claude_sonnet_37(prompt: str, max_tokens: int = 512, temperat
         request = json.dumps(native_request)
 
         try:
-            response = client.invoke_model(modelId=model_id, body=request)
-            model_response = json.loads(response["body"].read())
+            model_response = bedrock_pool.call(lambda client: _invoke(client, model_id, request))
             print('''(''' + model_response["content"][0]["text"] + ''')''')
 
             return model_response["content"][0]["text"]
@@ -75,6 +240,8 @@ def invoke_bedrock_claude_sonnet_37(prompt: str, max_tokens: int = 512, temperat
             else:
                 # Other error, return it
                 return {"error": str(e)}
+        except Cancelled:
+            raise
         except Exception as e:
             return {"error": str(e)}
 
@@ -84,9 +251,8 @@ def invoke_bedrock_claude_sonnet_with_image(prompt: str, image_file, max_tokens:
     """
     Generic function to invoke Bedrock Claude model with given prompt and image parameters.
     """
-    client = boto3.client("bedrock-runtime", region_name="us-east-1")
     model_id = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
-    encoded_image = base64.b64encode(image_file.read()).decode()
+    encoded_image = encode_image(image_file)
 
     native_request = {
         "anthropic_version": "bedrock-2023-05-31",
@@ -116,28 +282,29 @@ def invoke_bedrock_claude_sonnet_with_image(prompt: str, image_file, max_tokens:
     request = json.dumps(native_request)
 
     try:
-        response = client.invoke_model(modelId=model_id, body=request)
-        model_response = json.loads(response["body"].read())
+        model_response = bedrock_pool.call(lambda client: _invoke(client, model_id, request))
         print('''(''' + model_response["content"][0]["text"] + ''')''')
 
         return model_response["content"][0]["text"]
 
+    except Cancelled:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
-def invoke_bedrock_claude_sonnet37_with_image(prompt: str, image_file, max_tokens: int = 4000, temperature: float = 0.1):
+def invoke_bedrock_claude_sonnet37_with_image(prompt: str, image_file, max_tokens: int = 4000, temperature: float = 0.1,
+                                               model_ids=None, cancel=None):
     """
     Generic function to invoke Bedrock Claude 3.7 model with given prompt and image parameters.
-    """
-    client = boto3.client("bedrock-runtime", region_name="us-east-1")
+    image_file may also be a list of labelled images (see image_content).
 
-    # Try to use Claude 3.7 if available, otherwise fall back to 3.5
-    model_ids = [
-        "us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-        "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
-    ]
+    model_ids overrides the models tried in order; cancel is an optional
+    cancellation token (see _invoke).
+    """
+    model_ids = model_ids or SONNET_MODEL_IDS
 
-    encoded_image = base64.b64encode(image_file.read()).decode()
+    content = image_content(image_file)
+    content.append({"type": "text", "text": prompt})
 
     for model_id in model_ids:
         native_request = {
@@ -147,20 +314,7 @@ def invoke_bedrock_claude_sonnet37_with_image(prompt: str, image_file, max_token
             "messages": [
                 {
                     "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": encoded_image
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ],
+                    "content": content,
                 }
             ],
         }
@@ -168,8 +322,7 @@ def invoke_bedrock_claude_sonnet37_with_image(prompt: str, image_file, max_token
         request = json.dumps(native_request)
 
         try:
-            response = client.invoke_model(modelId=model_id, body=request)
-            model_response = json.loads(response["body"].read())
+            model_response = bedrock_pool.call(lambda client: _invoke(client, model_id, request, cancel))
             print('''(''' + model_response["content"][0]["text"] + ''')''')
 
             return model_response["content"][0]["text"]
@@ -181,7 +334,67 @@ def invoke_bedrock_claude_sonnet37_with_image(prompt: str, image_file, max_token
             else:
                 # Other error, return it
                 return {"error": str(e)}
+        except Cancelled:
+            raise
+        except Exception as e:
+            return {"error": str(e)}
+
+    return {"error": "No available Claude models found"}
+
+def invoke_bedrock_claude_structured(prompt: str, tool: dict, image_file=None, max_tokens: int = 4000, temperature: float = 0.1,
+                                     model_ids=None, cancel=None):
+    """
+    Invoke Bedrock Claude 3.7 with a single forced tool and return the tool input.
+
+    tool is a Bedrock tool definition ({"name", "description", "input_schema"});
+    the model must answer by calling it, so the result is already a parsed dict
+    matching the schema. An optional image, or list of labelled images
+    (see image_content), is sent before the prompt.
+    model_ids overrides the models tried in order; cancel is an optional
+    cancellation token (see _invoke).
+    """
+    model_ids = model_ids or SONNET_MODEL_IDS
+
+    content = image_content(image_file) if image_file is not None else []
+    content.append({"type": "text", "text": prompt})
+
+    for model_id in model_ids:
+        native_request = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "tools": [tool],
+            "tool_choice": {"type": "tool", "name": tool["name"]},
+            "messages": [
+                {
+                    "role": "user",
+                    "content": content,
+                }
+            ],
+        }
+
+        request = json.dumps(native_request)
+
+        try:
+            model_response = bedrock_pool.call(lambda client: _invoke(client, model_id, request, cancel))
+
+            for block in model_response["content"]:
+                if block.get("type") == "tool_use" and block.get("name") == tool["name"]:
+                    print('''(''' + json.dumps(block["input"]) + ''')''')
+                    return block["input"]
+
+            return {"error": f"Model did not call tool {tool['name']} (stop reason: {model_response.get('stop_reason')})"}
+
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ValidationException' and 'model' in str(e).lower():
+                # Model not available, try next one
+                continue
+            else:
+                # Other error, return it
+                return {"error": str(e)}
+        except Cancelled:
+            raise
         except Exception as e:
             return {"error": str(e)}
 
-    return {"error": "No available Claude models found"}
\ No newline at end of file
+    return {"error": "No available Claude models found"}
@@ -0,0 +1,79 @@
+import threading
+from collections import defaultdict, deque
+
+# Number of recent observations kept per series for percentile estimates
+WINDOW_SIZE = 1000
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_observations = defaultdict(lambda: deque(maxlen=WINDOW_SIZE))
+_totals = defaultdict(lambda: [0, 0.0])  # count, sum
+
+def _series(name, labels):
+    if not labels:
+        return name
+    label_text = ','.join(f"{key}={value}" for key, value in sorted(labels.items()))
+    return f"{name}{{{label_text}}}"
+
+def increment(name, amount=1, **labels):
+    """Increase a counter, e.g. increment('llm_parse_failures', kind='receipt')"""
+    with _lock:
+        _counters[_series(name, labels)] += amount
+
+def observe(name, value, **labels):
+    """Record one observation (e.g. a latency in seconds) for a summary series"""
+    series = _series(name, labels)
+    with _lock:
+        _observations[series].append(value)
+        totals = _totals[series]
+        totals[0] += 1
+        totals[1] += value
+
+def percentile(name, q, **labels):
+    """
+    Return the q-th percentile (0-100) of the recent observations, or None.
+    """
+    with _lock:
+        values = sorted(_observations.get(_series(name, labels), ()))
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+def count(name, **labels):
+    """Number of observations recorded for a summary series"""
+    with _lock:
+        totals = _totals.get(_series(name, labels))
+        return totals[0] if totals else 0
+
+def counter(name, **labels):
+    """Current value of a counter"""
+    with _lock:
+        return _counters.get(_series(name, labels), 0)
+
+def snapshot():
+    """
+    Return all counters and summaries as a JSON-serialisable dict.
+    """
+    with _lock:
+        counters = dict(_counters)
+        summaries = {}
+        for series, window in _observations.items():
+            values = sorted(window)
+            count, total = _totals[series]
+            summaries[series] = {
+                'count': count,
+                'mean': total / count if count else None,
+                'p50': values[len(values) // 2],
+                'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+                'p99': values[min(len(values) - 1, int(len(values) * 0.99))],
+                'max': values[-1]
+            }
+    return {'counters': counters, 'summaries': summaries}
+
+def reset():
+    """Clear all metrics"""
+    with _lock:
+        _counters.clear()
+        _observations.clear()
+        _totals.clear()
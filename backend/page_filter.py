@@ -0,0 +1,156 @@
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+import image_hashing
+
+# Pages are analysed on a downscaled greyscale copy; this is plenty for
+# ink/variance statistics and keeps the filter far cheaper than an LLM call
+ANALYSIS_WIDTH = 512
+
+# A pixel counts as ink when it is this much darker than the page background
+INK_CONTRAST = 80
+
+# Blank page thresholds (fraction of inked pixels / greyscale standard deviation)
+BLANK_INK_COVERAGE = 0.002
+BLANK_STDDEV = 4.0
+
+# Duplicate detection: perceptual hash candidate, confirmed by a tile comparison
+# of blurred low-resolution copies so that re-scans with slight skew still match
+DUPLICATE_MAX_DISTANCE = 8
+DUPLICATE_COMPARE_WIDTH = 256
+DUPLICATE_COMPARE_BLUR = 2
+DUPLICATE_GRID = 8
+DUPLICATE_MAX_TILE_DIFF = 16.0
+
+class PageDecision:
+    """
+    Outcome of pre-filtering one rendered page.
+
+    action is one of 'process', 'blank' or 'duplicate'; for duplicates
+    source_page is the zero-based page whose result should be reused.
+    """
+
+    def __init__(self, action, page_num, ink_coverage, stddev, page_hash, source_page=None):
+        self.action = action
+        self.page_num = page_num
+        self.ink_coverage = ink_coverage
+        self.stddev = stddev
+        self.page_hash = page_hash
+        self.source_page = source_page
+
+    def describe(self):
+        """Human readable summary used in the processing log"""
+        stats = f"ink {self.ink_coverage:.4f}, stddev {self.stddev:.1f}"
+        if self.action == 'duplicate':
+            return f"duplicate of page {self.source_page + 1} ({stats})"
+        return f"{self.action} ({stats})"
+
+def load_analysis_image(image):
+    """
+    Return a small greyscale copy of a page for analysis.
+
+    Accepts a PIL image or a path; JPEG files are decoded in draft mode so
+    only a fraction of the full-resolution pixels are ever materialised.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+        image.draft('L', (ANALYSIS_WIDTH, ANALYSIS_WIDTH))
+
+    gray = image.convert('L')
+    if gray.width > ANALYSIS_WIDTH:
+        height = max(1, round(gray.height * ANALYSIS_WIDTH / gray.width))
+        gray = gray.resize((ANALYSIS_WIDTH, height), Image.BILINEAR)
+    return gray
+
+def ink_statistics(gray):
+    """
+    Compute (ink_coverage, stddev) for a greyscale page.
+
+    A median filter removes scanner speckle first so that the noise on a
+    blank verso is not mistaken for content.
+    """
+    cleaned = gray.filter(ImageFilter.MedianFilter(3))
+    histogram = cleaned.histogram()
+    total = sum(histogram)
+
+    # Background level is the median intensity (pages are mostly background)
+    running = 0
+    background = 255
+    for level, count in enumerate(histogram):
+        running += count
+        if running * 2 >= total:
+            background = level
+            break
+
+    ink_threshold = background - INK_CONTRAST
+    ink_pixels = sum(histogram[:max(0, ink_threshold)])
+    stddev = ImageStat.Stat(cleaned).stddev[0]
+
+    return ink_pixels / max(1, total), stddev
+
+def comparison_image(gray):
+    """Blurred low-resolution copy of a page kept for duplicate confirmation"""
+    height = max(1, round(gray.height * DUPLICATE_COMPARE_WIDTH / gray.width))
+    small = gray.resize((DUPLICATE_COMPARE_WIDTH, height), Image.BILINEAR)
+    return small.filter(ImageFilter.GaussianBlur(DUPLICATE_COMPARE_BLUR))
+
+def max_tile_difference(a, b):
+    """
+    Largest mean absolute difference over a grid of tiles of two pages.
+
+    Using the worst tile rather than the page average keeps a single
+    changed paragraph from being averaged away.
+    """
+    if a.size != b.size:
+        b = b.resize(a.size, Image.BILINEAR)
+
+    diff = ImageChops.difference(a, b)
+    tile_w = max(1, a.width // DUPLICATE_GRID)
+    tile_h = max(1, a.height // DUPLICATE_GRID)
+
+    worst = 0.0
+    for top in range(0, a.height, tile_h):
+        for left in range(0, a.width, tile_w):
+            tile = diff.crop((left, top, min(left + tile_w, a.width), min(top + tile_h, a.height)))
+            worst = max(worst, ImageStat.Stat(tile).mean[0])
+    return worst
+
+class PageFilter:
+    """
+    Cheap local pre-filter that decides which rendered pages need an LLM call.
+
+    Pages are classified in document order; a page that is a near-identical
+    copy of an earlier processed page is reported as a duplicate of it.
+    """
+
+    def __init__(self, blank_ink_coverage=BLANK_INK_COVERAGE, blank_stddev=BLANK_STDDEV,
+                 max_distance=DUPLICATE_MAX_DISTANCE, max_tile_diff=DUPLICATE_MAX_TILE_DIFF):
+        self.blank_ink_coverage = blank_ink_coverage
+        self.blank_stddev = blank_stddev
+        self.max_distance = max_distance
+        self.max_tile_diff = max_tile_diff
+        self._seen = []  # (page_hash, page_num, comparison image)
+
+    def classify(self, image, page_num):
+        """
+        Classify a page given as a PIL image or an image path.
+        """
+        gray = load_analysis_image(image)
+        ink_coverage, stddev = ink_statistics(gray)
+
+        if ink_coverage < self.blank_ink_coverage or stddev < self.blank_stddev:
+            return PageDecision('blank', page_num, ink_coverage, stddev, None)
+
+        page_hash = image_hashing.phash(gray)
+        compare = None
+        for seen_hash, seen_page, seen_compare in self._seen:
+            if image_hashing.hamming_distance(page_hash, seen_hash) > self.max_distance:
+                continue
+            if compare is None:
+                compare = comparison_image(gray)
+            if max_tile_difference(compare, seen_compare) <= self.max_tile_diff:
+                return PageDecision('duplicate', page_num, ink_coverage, stddev, page_hash,
+                                    source_page=seen_page)
+
+        if compare is None:
+            compare = comparison_image(gray)
+        self._seen.append((page_hash, page_num, compare))
+        return PageDecision('process', page_num, ink_coverage, stddev, page_hash)
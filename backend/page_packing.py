@@ -0,0 +1,74 @@
+import os
+
+# Policy extraction can send several consecutive pages as one multi-image
+# request instead of one request per page, so the prompt and the fixed
+# per-request latency are paid once per pack rather than once per page.
+PAGE_PACKING_ENABLED = os.getenv('POLICY_PAGE_PACKING', 'False').lower() == 'true'
+
+# Pages per request; Bedrock accepts up to 20 images, but recall on sparse
+# rules drops well before that
+MAX_PACK_PAGES = int(os.getenv('POLICY_PACK_MAX_PAGES', 6))
+
+# Base64 image bytes per request, including the context page, well under
+# Bedrock's request size limit
+MAX_PACK_BYTES = int(os.getenv('POLICY_PACK_MAX_BYTES', 10_000_000))
+
+# max_tokens of a packed request, and the share of it the expected output
+# of a pack may fill so a denser than expected pack isn't cut off
+PACK_MAX_TOKENS = 8192
+PACK_OUTPUT_BUDGET = int(PACK_MAX_TOKENS * 0.75)
+
+# Expected output tokens for one page's rules: a base for a sparse page plus
+# a share proportional to ink coverage (a dense page of rules, at about
+# 0.15 coverage, runs to ~1,500 tokens)
+BASE_PAGE_TOKENS = 150
+TOKENS_PER_INK_COVERAGE = 9000
+
+def estimate_output_tokens(ink_coverage):
+    """Expected output tokens for the rules on a page with this ink coverage"""
+    if ink_coverage is None:
+        return BASE_PAGE_TOKENS + int(TOKENS_PER_INK_COVERAGE * 0.15)
+    return BASE_PAGE_TOKENS + int(TOKENS_PER_INK_COVERAGE * ink_coverage)
+
+class PagePacker:
+    """
+    Groups consecutive pages into packs that stay within the page, byte and
+    expected output token limits. Each pack after the first is sent with the
+    previous pack's last page as context, whose bytes count towards its limit.
+    """
+
+    def __init__(self, max_pages=MAX_PACK_PAGES, max_bytes=MAX_PACK_BYTES, output_budget=PACK_OUTPUT_BUDGET):
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.output_budget = output_budget
+        self.pages = []
+        self._bytes = 0
+        self._tokens = 0
+        self._last_size = 0
+
+    def add(self, page, size, ink_coverage=None):
+        """
+        Add a page of size bytes. Returns the pack this page did not fit in,
+        now closed, or None.
+        """
+        tokens = estimate_output_tokens(ink_coverage)
+        closed = None
+        if self.pages and (len(self.pages) >= self.max_pages
+                           or self._bytes + size > self.max_bytes
+                           or self._tokens + tokens > self.output_budget):
+            closed = self.flush()
+            self._bytes = self._last_size
+
+        self.pages.append(page)
+        self._bytes += size
+        self._tokens += tokens
+        self._last_size = size
+        return closed
+
+    def flush(self):
+        """Close and return the open pack (possibly empty)"""
+        pages = self.pages
+        self.pages = []
+        self._bytes = 0
+        self._tokens = 0
+        return pages
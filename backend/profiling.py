@@ -0,0 +1,277 @@
+import hmac
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime
+import render_pool
+
+# Operator-triggered profiling of single requests. Profiling is off unless
+# PROFILE_TOKEN is set; a request is then profiled when it carries the token
+# in an X-Profile-Token header, or when an operator has armed its path. A
+# profiled request runs under a sampling profiler that attributes each
+# thread's CPU time to the stack it is in, and under tracemalloc; the
+# artifacts are kept in PROFILE_DIR for download.
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'expense-profiles'))
+SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', 16))
+MAX_PROFILES = int(os.getenv('PROFILE_MAX_KEPT', 20))
+
+# Render pool work runs in the request's threads while profiled, so page
+# rendering and encoding are attributed (at the cost of parallelism)
+PROFILE_RENDER_INLINE = os.getenv('PROFILE_RENDER_INLINE', 'True').lower() == 'true'
+
+# Functions and allocation sites listed in a profile summary
+TOP_N = 40
+
+ARTIFACTS = {
+    'summary.json': 'application/json',
+    'cpu.folded': 'text/plain',
+    'allocations.txt': 'text/plain',
+    'tracemalloc.snapshot': 'application/octet-stream'
+}
+
+# tracemalloc and the sampler are process-wide: one profile at a time
+_active = threading.Lock()
+_armed = {}
+_armed_lock = threading.Lock()
+
+def authorized(token):
+    """Whether a request's token matches PROFILE_TOKEN"""
+    return bool(PROFILE_TOKEN and token) and hmac.compare_digest(token, PROFILE_TOKEN)
+
+def arm(path, count=1):
+    """Profile the next count requests to path"""
+    with _armed_lock:
+        if count > 0:
+            _armed[path] = count
+        else:
+            _armed.pop(path, None)
+        return dict(_armed)
+
+def armed():
+    with _armed_lock:
+        return dict(_armed)
+
+def requested(path, token):
+    """Whether this request should be profiled (an authorised header, or an armed path)"""
+    if token:
+        return authorized(token)
+    with _armed_lock:
+        remaining = _armed.get(path)
+        if not remaining:
+            return False
+        if remaining > 1:
+            _armed[path] = remaining - 1
+        else:
+            del _armed[path]
+        return True
+
+def _function_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class Sampler(threading.Thread):
+    """
+    Samples the stacks of the profiled request's thread and of threads
+    started while it runs (its worker threads), every interval seconds. Each
+    thread's CPU time since its previous sample is attributed to the stack
+    it is in now; where per-thread CPU clocks are unavailable, samples are
+    weighted by the interval instead.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.existing = {thread.ident for thread in threading.enumerate()} - {thread_id}
+        self.stacks = Counter()
+        self.self_seconds = Counter()
+        self.total_seconds = Counter()
+        self.samples = Counter()
+        self.sampled_seconds = 0.0
+        self._clocks = {}
+        self._stop_event = threading.Event()
+
+    def _cpu_time(self, thread_id):
+        clock = self._clocks.get(thread_id)
+        if clock is None:
+            try:
+                clock = self._clocks[thread_id] = time.pthread_getcpuclockid(thread_id)
+            except (AttributeError, OSError):
+                return None
+        try:
+            return time.clock_gettime(clock)
+        except OSError:
+            return None
+
+    def run(self):
+        last_cpu = {}
+        while not self._stop_event.wait(self.interval):
+            own = self.ident
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (thread_id != self.thread_id and thread_id in self.existing):
+                    continue
+                cpu = self._cpu_time(thread_id)
+                if cpu is None:
+                    seconds = self.interval
+                else:
+                    seconds = cpu - last_cpu.get(thread_id, cpu)
+                    last_cpu[thread_id] = cpu
+                self._record(frame, seconds)
+
+    def _record(self, frame, seconds):
+        names = []
+        while frame is not None:
+            names.append(_function_name(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        if not names:
+            return
+        self.samples[names[-1]] += 1
+        if seconds <= 0:
+            return
+        self.sampled_seconds += seconds
+        self.stacks[';'.join(names)] += seconds
+        self.self_seconds[names[-1]] += seconds
+        for name in set(names):
+            self.total_seconds[name] += seconds
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+class Session:
+    """One profiled request; see start()"""
+
+    def __init__(self, label):
+        self.id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.label = label
+        self.started_at = datetime.now().isoformat()
+        self.sampler = Sampler(threading.get_ident(), SAMPLE_INTERVAL)
+        self._inline_token = render_pool.run_inline() if PROFILE_RENDER_INLINE else None
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self.sampler.start()
+
+    def stop(self, status=None):
+        """Stop profiling, write the artifacts and return the summary"""
+        try:
+            self.sampler.stop()
+            wall = time.perf_counter() - self._wall
+            cpu = time.process_time() - self._cpu
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<unknown>')
+            ])
+        finally:
+            tracemalloc.stop()
+            if self._inline_token is not None:
+                render_pool.reset_inline(self._inline_token)
+            _active.release()
+
+        try:
+            return self._write(status, wall, cpu, current, peak, snapshot)
+        except Exception as e:
+            logging.error(f"Failed to write profile {self.id}: {str(e)}")
+            return None
+
+    def _write(self, status, wall, cpu, current, peak, snapshot):
+        directory = os.path.join(PROFILE_DIR, self.id)
+        os.makedirs(directory, exist_ok=True)
+        sampler = self.sampler
+
+        with open(os.path.join(directory, 'cpu.folded'), 'w') as f:
+            for stack, seconds in sampler.stacks.most_common():
+                f.write(f"{stack} {round(seconds * 1e6)}\n")
+
+        sites = snapshot.statistics('lineno')
+        with open(os.path.join(directory, 'allocations.txt'), 'w') as f:
+            for stat in snapshot.statistics('traceback')[:TOP_N]:
+                f.write(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+                for line in stat.traceback.format():
+                    f.write(f"{line}\n")
+                f.write("\n")
+        snapshot.dump(os.path.join(directory, 'tracemalloc.snapshot'))
+
+        summary = {
+            'id': self.id,
+            'request': self.label,
+            'status': status,
+            'startedAt': self.started_at,
+            'wallSeconds': round(wall, 4),
+            # Process-wide, so includes any other requests running meanwhile
+            'processCpuSeconds': round(cpu, 4),
+            'sampledCpuSeconds': round(sampler.sampled_seconds, 4),
+            'sampleInterval': SAMPLE_INTERVAL,
+            'renderedInline': self._inline_token is not None,
+            'functions': [
+                {
+                    'function': name,
+                    'cpuSeconds': round(seconds, 4),
+                    'selfCpuSeconds': round(sampler.self_seconds.get(name, 0.0), 4),
+                    'samplesOnTop': sampler.samples.get(name, 0)
+                }
+                for name, seconds in sampler.total_seconds.most_common(TOP_N)
+            ],
+            'allocations': {
+                'currentBytes': current,
+                'peakBytes': peak,
+                'topSites': [
+                    {'site': str(stat.traceback[0]), 'sizeBytes': stat.size, 'blocks': stat.count}
+                    for stat in sites[:TOP_N]
+                ]
+            },
+            'artifacts': list(ARTIFACTS)
+        }
+        with open(os.path.join(directory, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        _prune()
+        print(f"Profile {self.id} of {self.label}: {wall:.2f}s wall, {sampler.sampled_seconds:.2f}s CPU sampled, "
+              f"peak {peak / 1048576:.1f} MiB traced")
+        return summary
+
+def start(label):
+    """
+    Start profiling the current request and return its Session, or None if
+    another profile is running (the request then runs unprofiled).
+    """
+    if not _active.acquire(blocking=False):
+        logging.warning(f"Not profiling {label}: another profile is running")
+        return None
+    try:
+        return Session(label)
+    except Exception:
+        _active.release()
+        raise
+
+def _prune():
+    """Keep the MAX_PROFILES most recent profiles"""
+    for profile_id in list_profiles()[MAX_PROFILES:]:
+        shutil.rmtree(os.path.join(PROFILE_DIR, profile_id), ignore_errors=True)
+
+def list_profiles():
+    """Profile ids, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted((name for name in os.listdir(PROFILE_DIR)
+                   if os.path.isfile(os.path.join(PROFILE_DIR, name, 'summary.json'))), reverse=True)
+
+def artifact_path(profile_id, artifact):
+    """Path of a profile artifact, or None if there is no such profile or artifact"""
+    if artifact not in ARTIFACTS or profile_id not in list_profiles():
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id, artifact)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,324 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from PIL import Image, ImageOps
+import image_hashing
+
+DATA_FOLDER = os.getenv('DATA_FOLDER', os.path.join(os.path.dirname(__file__), 'data'))
+RECEIPT_INDEX_PATH = os.getenv('RECEIPT_INDEX_PATH', os.path.join(DATA_FOLDER, 'receipt_index.db'))
+RECEIPT_INDEX_ENABLED = os.getenv('RECEIPT_INDEX_ENABLED', 'False').lower() == 'true'
+
+# Receipts are only ever matched against receipts of the same tenant
+DEFAULT_TENANT = 'default'
+
+# Receipts within this many bits (of 64) are candidate duplicates. Receipts
+# from one vendor share a layout and can hash a few bits apart, so a stored
+# extraction is reused outright only when the content digest matches too.
+# A near-hash hit (the same paper receipt photographed again, or scanned as
+# a PDF) is confirmed first, with CONFIRM_NEAR_MATCHES, by reading just the
+# date, vendor and total with the fast model: when they agree with the
+# stored extraction it is reused, otherwise the receipt is extracted in
+# full and flagged as a possible duplicate.
+CONFIRM_NEAR_MATCHES = os.getenv('RECEIPT_DUPLICATE_CONFIRM', 'True').lower() == 'true'
+# Multi-index hashing splits the hash into CHUNKS pieces, so a match within
+# MAX_DISTANCE is guaranteed to be within MAX_DISTANCE // CHUNKS in some chunk.
+MAX_DISTANCE = int(os.getenv('RECEIPT_DUPLICATE_MAX_DISTANCE', 7))
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# Receipt normalisation (on the autocontrasted greyscale image): the paper is
+# the region of bright pixels, the content is the dark ink printed on it.
+# Both are located on a coarse grid so speckle and JPEG noise do not matter.
+PAPER_THRESHOLD = 180
+PAPER_MIN_FILL = 128
+INK_THRESHOLD = 128
+INK_MIN_FILL = 8
+GRID_WIDTH = 64
+
+def receipt_hash(image):
+    """
+    Perceptual hash of a receipt given as a PIL image or an image path.
+
+    The image is normalised first (greyscale, autocontrast, cropped to the
+    paper and then to the printed content) so that a phone photo and a scan
+    of the same paper receipt land close together.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+        image.draft('L', (512, 512))
+
+    gray = ImageOps.autocontrast(image.convert('L'), cutoff=1)
+
+    paper_box = _grid_bbox(gray, lambda p: p > PAPER_THRESHOLD, PAPER_MIN_FILL)
+    if paper_box:
+        # Step one grid cell inside the paper so its edge is not taken for ink
+        inset = gray.width // GRID_WIDTH
+        left, top, right, bottom = paper_box
+        if right - left > 2 * inset and bottom - top > 2 * inset:
+            gray = gray.crop((left + inset, top + inset, right - inset, bottom - inset))
+
+    ink_box = _grid_bbox(gray, lambda p: p < INK_THRESHOLD, INK_MIN_FILL)
+    if ink_box:
+        gray = gray.crop(ink_box)
+    return image_hashing.phash(gray)
+
+def content_digest(image):
+    """
+    Exact digest of a receipt given as a PIL image (its pixels) or an image
+    path (its bytes). Equal digests mean the same image, not just a similar one.
+    """
+    digest = hashlib.sha256()
+    if isinstance(image, Image.Image):
+        digest.update(f"{image.mode}:{image.width}x{image.height}:".encode())
+        digest.update(image.tobytes())
+    else:
+        with open(image, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def _grid_bbox(gray, predicate, min_fill):
+    """
+    Bounding box of the grid cells where enough pixels satisfy predicate.
+
+    min_fill is the per-cell fraction of matching pixels on a 0-255 scale.
+    """
+    mask = gray.point(lambda p: 255 if predicate(p) else 0)
+    grid_height = max(1, round(gray.height * GRID_WIDTH / gray.width))
+    grid = mask.resize((GRID_WIDTH, grid_height), Image.BOX)
+    box = grid.point(lambda p: 255 if p > min_fill else 0).getbbox()
+    if not box:
+        return None
+
+    scale_x = gray.width / GRID_WIDTH
+    scale_y = gray.height / grid_height
+    return (int(box[0] * scale_x), int(box[1] * scale_y),
+            min(gray.width, round(box[2] * scale_x)), min(gray.height, round(box[3] * scale_y)))
+
+def _to_signed(value):
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+def _neighbour_masks(radius):
+    """XOR masks for every chunk value within the given Hamming radius (radius <= 2)"""
+    masks = [0]
+    if radius >= 1:
+        masks.extend(1 << bit for bit in range(CHUNK_BITS))
+    if radius >= 2:
+        masks.extend((1 << i) | (1 << j) for i in range(CHUNK_BITS) for j in range(i + 1, CHUNK_BITS))
+    return masks
+
+class ReceiptIndex:
+    """
+    Persistent perceptual-hash index of previously extracted receipts.
+
+    Extractions are stored in SQLite, per tenant; lookups use an in-memory
+    multi-index hash table (one dict per hash chunk) per tenant so only a
+    handful of candidates are compared even with millions of stored receipts.
+    """
+
+    def __init__(self, path=RECEIPT_INDEX_PATH, max_distance=MAX_DISTANCE):
+        if max_distance // CHUNKS > 2:
+            raise ValueError(f"max_distance must be below {3 * CHUNKS}")
+
+        self.path = path
+        self.max_distance = max_distance
+        self._masks = _neighbour_masks(max_distance // CHUNKS)
+        self._lock = threading.Lock()
+        # tenant -> (phash -> receipt id of the first receipt stored with it,
+        #            per chunk: chunk value -> list of phashes)
+        self._tenants = {}
+        self._count = 0
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS receipts ("
+            " id INTEGER PRIMARY KEY,"
+            " phash INTEGER NOT NULL,"
+            " extraction TEXT NOT NULL,"
+            " source TEXT,"
+            " created TEXT NOT NULL)"
+        )
+        # Indexes created before receipts were kept per tenant and confirmed by digest
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(receipts)")}
+        if 'tenant' not in columns:
+            self._db.execute(f"ALTER TABLE receipts ADD COLUMN tenant TEXT NOT NULL DEFAULT '{DEFAULT_TENANT}'")
+        if 'digest' not in columns:
+            self._db.execute("ALTER TABLE receipts ADD COLUMN digest TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS receipts_digest ON receipts (tenant, digest)")
+        self._db.commit()
+
+        for receipt_id, phash, tenant in self._db.execute("SELECT id, phash, tenant FROM receipts ORDER BY id"):
+            self._insert(tenant, receipt_id, _to_unsigned(phash))
+
+    def __len__(self):
+        return self._count
+
+    def _insert(self, tenant, receipt_id, phash):
+        ids, tables = self._tenants.setdefault(tenant, ({}, [{} for _ in range(CHUNKS)]))
+        if phash in ids:
+            return
+        ids[phash] = receipt_id
+        self._count += 1
+        for chunk_num, table in enumerate(tables):
+            chunk = (phash >> (chunk_num * CHUNK_BITS)) & CHUNK_MASK
+            table.setdefault(chunk, []).append(phash)
+
+    def nearest(self, phash, tenant=DEFAULT_TENANT):
+        """
+        Return (receipt_id, distance) of the tenant's closest stored receipt
+        within max_distance, or None.
+        """
+        max_distance = self.max_distance
+        best_hash = None
+        best_distance = max_distance + 1
+
+        with self._lock:
+            if tenant not in self._tenants:
+                return None
+            ids, tables = self._tenants[tenant]
+            receipt_id = ids.get(phash)
+            if receipt_id is not None:
+                return receipt_id, 0
+
+            for chunk_num, table in enumerate(tables):
+                chunk = (phash >> (chunk_num * CHUNK_BITS)) & CHUNK_MASK
+                for mask in self._masks:
+                    bucket = table.get(chunk ^ mask)
+                    if not bucket:
+                        continue
+                    for candidate in bucket:
+                        distance = (candidate ^ phash).bit_count()
+                        if distance < best_distance:
+                            best_hash, best_distance = candidate, distance
+
+            if best_hash is None:
+                return None
+            return ids[best_hash], best_distance
+
+    def lookup(self, phash, digest=None, tenant=DEFAULT_TENANT):
+        """
+        Look a receipt up among the tenant's stored receipts. Returns None, or
+        a dict with receiptId, distance, the stored extraction, source and
+        created, and exact: True when a receipt with the same content digest
+        is stored, False for a receipt that is only within max_distance.
+        """
+        with self._lock:
+            row = None
+            if digest is not None:
+                row = self._db.execute(
+                    "SELECT id, phash, extraction, source, created FROM receipts"
+                    " WHERE tenant = ? AND digest = ? ORDER BY id LIMIT 1", (tenant, digest)
+                ).fetchone()
+        if row:
+            return {
+                'receiptId': row[0],
+                'distance': (_to_unsigned(row[1]) ^ phash).bit_count(),
+                'exact': True,
+                'extraction': row[2],
+                'source': row[3],
+                'created': row[4]
+            }
+
+        match = self.nearest(phash, tenant)
+        if not match:
+            return None
+
+        receipt_id, distance = match
+        with self._lock:
+            row = self._db.execute(
+                "SELECT extraction, source, created FROM receipts WHERE id = ?", (receipt_id,)
+            ).fetchone()
+        if not row:
+            return None
+
+        return {
+            'receiptId': receipt_id,
+            'distance': distance,
+            'exact': False,
+            'extraction': row[0],
+            'source': row[1],
+            'created': row[2]
+        }
+
+    def add(self, phash, extraction, source=None, digest=None, tenant=DEFAULT_TENANT):
+        """Store an extraction (raw JSON text) under its receipt hash and content digest"""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO receipts (phash, extraction, source, created, tenant, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                (_to_signed(phash), extraction, source, datetime.now().isoformat(), tenant, digest)
+            )
+            self._db.commit()
+            self._insert(tenant, cursor.lastrowid, phash)
+        return cursor.lastrowid
+
+    def add_many(self, entries, source=None, tenant=DEFAULT_TENANT):
+        """Bulk-store (phash, extraction) or (phash, extraction, digest) entries in a single transaction"""
+        created = datetime.now().isoformat()
+        with self._lock:
+            for entry in entries:
+                phash, extraction = entry[:2]
+                digest = entry[2] if len(entry) > 2 else None
+                cursor = self._db.execute(
+                    "INSERT INTO receipts (phash, extraction, source, created, tenant, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                    (_to_signed(phash), extraction, source, created, tenant, digest)
+                )
+                self._insert(tenant, cursor.lastrowid, phash)
+            self._db.commit()
+
+def mark_duplicate(match):
+    """
+    Build an extraction response from a match (see lookup) that is exact or
+    was confirmed, flagged as a probable duplicate.
+    """
+    try:
+        extraction = json.loads(match['extraction'])
+    except json.JSONDecodeError:
+        return match['extraction']
+
+    extraction['probableDuplicate'] = True
+    extraction['duplicateOf'] = {
+        'receiptId': match['receiptId'],
+        'hashDistance': match['distance'],
+        'confirmedBy': 'contentDigest' if match['exact'] else 'keyFields',
+        'source': match['source'],
+        'extractedAt': match['created']
+    }
+    return json.dumps(extraction)
+
+def mark_possible_duplicate(extraction, match):
+    """Flag a fresh extraction (JSON text) as a possible duplicate of a near match"""
+    try:
+        result = json.loads(extraction)
+    except json.JSONDecodeError:
+        return extraction
+    result['possibleDuplicate'] = True
+    result['possibleDuplicateOf'] = {
+        'receiptId': match['receiptId'],
+        'hashDistance': match['distance'],
+        'source': match['source'],
+        'extractedAt': match['created']
+    }
+    return json.dumps(result)
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """Return the process-wide receipt index, or None when disabled"""
+    global _index
+    if not RECEIPT_INDEX_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = ReceiptIndex()
+        return _index
@@ -0,0 +1,582 @@
+import bisect
+import csv
+import io
+import itertools
+import math
+import re
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+import fx_rates
+import llm_output
+
+# Card transactions post on or a few days after the receipt date; one day
+# the other way allows for time zones
+DAYS_BEFORE = 5
+DAYS_AFTER = 1
+
+# Same-currency amounts must agree to the cent; amounts converted through the
+# offline FX table may differ by this fraction (card network rates, fees)
+FX_AMOUNT_TOLERANCE = 0.03
+
+# Score weights (sum to 1) and thresholds
+AMOUNT_WEIGHT = 0.5
+DATE_WEIGHT = 0.2
+VENDOR_WEIGHT = 0.3
+MATCH_THRESHOLD = 0.8
+REVIEW_THRESHOLD = 0.55
+# A best candidate within TIE_MARGIN of the runner-up is sent to review
+TIE_MARGIN = 0.05
+REVIEW_CANDIDATES = 3
+
+# Vendor tokens that say nothing about the merchant: legal suffixes and the
+# prefixes payment processors put in card descriptors (SQ *, TST*, PAYPAL *)
+VENDOR_STOPWORDS = {
+    'the', 'and', 'of', 'inc', 'llc', 'ltd', 'co', 'corp', 'company', 'gmbh', 'sa',
+    'sq', 'tst', 'pp', 'paypal', 'pos', 'purchase', 'debit', 'credit', 'card', 'www', 'com'
+}
+# Tokens of at least MIN_PREFIX_LENGTH letters match their own prefixes;
+# the vendor index is keyed on the first VENDOR_KEY_LENGTH letters
+MIN_PREFIX_LENGTH = 3
+VENDOR_KEY_LENGTH = 4
+
+# Same-merchant receipts are only looked up through a transaction's rarest
+# vendor key, and not at all when even that key is this common (fraction of
+# all receipts), so generic words like "cafe" never fan out
+MAX_VENDOR_KEY_SHARE = 0.01
+
+# A charge up to this much above a same-merchant receipt (tip, surcharge)
+# counts as partial amount evidence
+TIP_TOLERANCE = 0.3
+TIP_AMOUNT_SCORE = 0.3
+
+# CSV header aliases (lowercase, without spaces/underscores)
+CSV_COLUMNS = {
+    'id': ('id', 'transactionid', 'reference', 'referencenumber', 'fitid'),
+    'date': ('date', 'transactiondate', 'transdate', 'posteddate', 'postingdate'),
+    'merchantName': ('merchantname', 'merchant', 'description', 'payee', 'name'),
+    'amount': ('amount', 'transactionamount'),
+    'debit': ('debit',),
+    'credit': ('credit',),
+    'type': ('type', 'transactiontype', 'debitcredit', 'drcr'),
+    'currency': ('currency',),
+    'cardNumber': ('cardnumber', 'card')
+}
+
+# Transaction types (CSV type column) that are money back on the card
+# rather than charges; only charges are matched to receipts
+CREDIT_TYPES = {'credit', 'cr', 'payment', 'refund', 'return', 'reversal'}
+# Exports with a single amount column show charges either as positive or as
+# negative amounts. Card statements are mostly charges, so the sign of most
+# of the first SIGN_SAMPLE_ROWS amounts is taken to be the charges' sign.
+SIGN_SAMPLE_ROWS = 200
+
+_EPOCH = date(1970, 1, 1)
+_BAND_WIDTH = math.log(1 + FX_AMOUNT_TOLERANCE)
+_OFX_TAG = re.compile(r'<(/?)(\w+)>([^<\r\n]*)')
+
+@lru_cache(maxsize=4096)
+def _parse_day(value):
+    """Days since epoch for a statement/receipt date, or None"""
+    if not value:
+        return None
+    try:
+        return (date.fromisoformat(value) - _EPOCH).days
+    except ValueError:
+        pass
+    iso_date = llm_output.parse_date(value)
+    try:
+        return (date.fromisoformat(iso_date) - _EPOCH).days
+    except (TypeError, ValueError):
+        return None
+
+@lru_cache(maxsize=65536)
+def vendor_tokens(name):
+    """Normalised merchant tokens: lowercase words, no digits or processor noise"""
+    if not name:
+        return frozenset()
+    return frozenset(
+        token for token in re.findall(r'[a-z]+', name.lower())
+        if len(token) >= 2 and token not in VENDOR_STOPWORDS
+    )
+
+@lru_cache(maxsize=65536)
+def _prefixes(token):
+    """The token's prefixes of at least MIN_PREFIX_LENGTH letters, itself included"""
+    return frozenset(token[:length] for length in range(MIN_PREFIX_LENGTH, len(token) + 1))
+
+@lru_cache(maxsize=65536)
+def _prefix_closure(tokens):
+    return frozenset().union(*(_prefixes(token) for token in tokens))
+
+def vendor_similarity(tokens_a, tokens_b):
+    """
+    Overlap of two token sets (0-1); a token matches an equal token or one
+    it is a prefix of ("air" / "airlines"), as card descriptors truncate.
+    """
+    if not tokens_a or not tokens_b:
+        return 0.0
+    if len(tokens_a) > len(tokens_b):
+        tokens_a, tokens_b = tokens_b, tokens_a
+    closure_b = _prefix_closure(tokens_b)
+    matched = 0
+    for token in tokens_a:
+        # token is a prefix of some b, or some b is a prefix of token
+        if token in tokens_b or token in closure_b or not _prefixes(token).isdisjoint(tokens_b):
+            matched += 1
+    return matched / len(tokens_a)
+
+def _vendor_keys(tokens):
+    """Index keys for vendor tokens: their first VENDOR_KEY_LENGTH letters"""
+    return {token[:VENDOR_KEY_LENGTH] for token in tokens if len(token) >= VENDOR_KEY_LENGTH}
+
+def _amount_band(cents):
+    """Logarithmic amount band; amounts within FX_AMOUNT_TOLERANCE fall in adjacent bands"""
+    return int(math.log(max(cents, 1)) / _BAND_WIDTH)
+
+def _day_sorted(postings):
+    """{key: [(day, index)]} -> {key: (days, indexes)} sorted by day"""
+    result = {}
+    for key, entries in postings.items():
+        entries.sort()
+        result[key] = ([day for day, _ in entries], [index for _, index in entries])
+    return result
+
+def _to_cents(amount):
+    return int((amount * 100).quantize(Decimal('1')))
+
+def _base_cents(cents, currency):
+    """Amount in base-currency cents, or None for unknown currencies"""
+    multiplier = fx_rates.rate(currency) if currency != fx_rates.BASE_CURRENCY else 1
+    return None if multiplier is None else int(cents * multiplier)
+
+def iter_csv_transactions(stream, default_currency=fx_rates.BASE_CURRENCY):
+    """
+    Yield transactions from a CSV card statement (text stream), one row at a
+    time. Rows without a usable date or amount are yielded as
+    {'error': ...} so the caller can count them.
+
+    amount_cents is positive for charges and negative for credits
+    (payments, refunds): from the debit/credit columns or the type column
+    where there are any, otherwise from the amount's sign, read with the
+    statement's convention (see SIGN_SAMPLE_ROWS).
+    """
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    normalized = [re.sub(r'[\s_]', '', column.strip().lower()) for column in header]
+    columns = {}
+    for field, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in normalized:
+                columns[field] = normalized.index(alias)
+                break
+
+    if 'date' not in columns or not ({'amount', 'debit'} & columns.keys()):
+        raise ValueError("CSV statement needs a date column and an amount or debit column")
+
+    def column(row, field):
+        index = columns.get(field)
+        return row[index].strip() if index is not None and index < len(row) else ''
+
+    def transaction(line_number, row):
+        """(transaction, whether only its amount's sign says if it is a charge)"""
+        if column(row, 'amount'):
+            amount = llm_output.parse_amount(column(row, 'amount'))
+            kind = column(row, 'type').lower()
+            sign = (-1 if kind in CREDIT_TYPES else 1) if kind else None
+        elif column(row, 'debit'):
+            amount, sign = llm_output.parse_amount(column(row, 'debit')), 1
+        else:
+            amount, sign = llm_output.parse_amount(column(row, 'credit')), -1
+        day = _parse_day(column(row, 'date'))
+        if amount is None or day is None:
+            return {'error': f"line {line_number}: unparsable date or amount"}, False
+        cents = _to_cents(amount)
+        return {
+            'id': column(row, 'id') or f"line-{line_number}",
+            'day': day,
+            'merchantName': column(row, 'merchantName'),
+            'amount_cents': cents if sign is None else sign * abs(cents),
+            'currency': fx_rates.normalize_currency(column(row, 'currency')) or default_currency,
+            'cardNumber': column(row, 'cardNumber') or None
+        }, sign is None
+
+    rows = (
+        transaction(line_number, row) for line_number, row in enumerate(reader, start=2)
+        if any(cell.strip() for cell in row)
+    )
+    sample = list(itertools.islice(rows, SIGN_SAMPLE_ROWS))
+    signed = [parsed['amount_cents'] for parsed, by_sign in sample if by_sign]
+    charge_sign = -1 if sum(cents < 0 for cents in signed) * 2 > len(signed) else 1
+    for parsed, by_sign in itertools.chain(sample, rows):
+        if by_sign:
+            parsed['amount_cents'] *= charge_sign
+        yield parsed
+
+def iter_ofx_transactions(stream, default_currency=fx_rates.BASE_CURRENCY):
+    """
+    Yield transactions from an OFX statement (SGML 1.x or XML 2.x text
+    stream), reading one <STMTTRN> block at a time. OFX amounts are negative
+    for money out; amount_cents is positive for charges and negative for
+    credits, as for CSV statements.
+    """
+    currency = default_currency
+    fields = None
+    count = 0
+
+    for line in stream:
+        for closing, tag, value in _OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if not closing:
+                    fields = {}
+                    continue
+                if fields is None:
+                    continue
+                count += 1
+                yield _ofx_transaction(fields, currency, count)
+                fields = None
+            elif closing:
+                continue
+            elif tag == 'CURDEF':
+                currency = fx_rates.normalize_currency(value.strip()) or currency
+            elif fields is not None:
+                fields[tag] = value.strip()
+
+def _ofx_transaction(fields, currency, count):
+    amount = llm_output.parse_amount(fields.get('TRNAMT'))
+    posted = fields.get('DTUSER') or fields.get('DTPOSTED') or ''
+    day = _parse_day(posted[:8]) if len(posted) >= 8 else None
+    if amount is None or day is None:
+        return {'error': f"transaction {count}: unparsable date or amount"}
+    return {
+        'id': fields.get('FITID') or f"txn-{count}",
+        'day': day,
+        'merchantName': fields.get('NAME') or fields.get('MEMO') or '',
+        'amount_cents': -_to_cents(amount),
+        'currency': currency,
+        'cardNumber': None
+    }
+
+def iter_statement(stream, filename=''):
+    """
+    Yield transactions from a binary statement stream, detecting CSV or OFX
+    from the file name or the first bytes.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    if filename.lower().endswith(('.ofx', '.qfx')):
+        return iter_ofx_transactions(text)
+    if filename.lower().endswith('.csv'):
+        return iter_csv_transactions(text)
+
+    first_line = text.readline()
+    lines = _chain(first_line, text)
+    if 'OFX' in first_line.upper() or first_line.lstrip().startswith('<'):
+        return iter_ofx_transactions(lines)
+    return iter_csv_transactions(lines)
+
+def _chain(first_line, stream):
+    yield first_line
+    yield from stream
+
+def _day_iso(day):
+    return date.fromordinal(_EPOCH.toordinal() + day).isoformat()
+
+class ReceiptMatcher:
+    """
+    Index of receipts for matching card transactions.
+
+    Receipts are indexed by (currency, amount in cents) for exact matches in
+    the transaction's own currency, and by logarithmic amount band (after
+    conversion to the transaction's currency) for matches in other
+    currencies, with each posting list sorted by day so the date window is a
+    binary search. A second index keyed by (currency, vendor token prefix,
+    day) and sorted by amount finds same-merchant receipts the charge could
+    be a tipped version of, for the review queue.
+    """
+
+    def __init__(self, receipts):
+        self.receipts = []
+        self.skipped = 0
+        exact = {}
+        by_vendor = {}
+        self._vendor_key_counts = {}
+
+        for receipt in receipts:
+            record = self._receipt_record(receipt)
+            if record is None:
+                self.skipped += 1
+                continue
+            index = len(self.receipts)
+            self.receipts.append(record)
+            exact.setdefault((record['currency'], record['cents']), []).append((record['day'], index))
+            for key in _vendor_keys(record['tokens']):
+                by_vendor.setdefault((record['currency'], key, record['day']), []).append((record['cents'], index))
+                self._vendor_key_counts[key] = self._vendor_key_counts.get(key, 0) + 1
+
+        self._max_vendor_key_count = max(1, int(len(self.receipts) * MAX_VENDOR_KEY_SHARE))
+        self._exact = _day_sorted(exact)
+        self._cross_currency_bands = {}
+        self._by_vendor_day = {}
+        for key, entries in by_vendor.items():
+            entries.sort()
+            self._by_vendor_day[key] = ([cents for cents, _ in entries], [index for _, index in entries])
+
+    def __len__(self):
+        return len(self.receipts)
+
+    @staticmethod
+    def _receipt_record(receipt):
+        if 'amount_cents' in receipt:
+            cents = receipt['amount_cents']
+        else:
+            amount = llm_output.parse_amount(receipt.get('total', receipt.get('amount')))
+            cents = None if amount is None else _to_cents(amount)
+        day = _parse_day(receipt.get('date'))
+        currency = fx_rates.normalize_currency(receipt.get('currency')) or fx_rates.BASE_CURRENCY
+        if cents is None or cents < 0 or day is None or not receipt.get('id'):
+            # Refund receipts have no charge to match
+            return None
+        base_cents = _base_cents(cents, currency)
+        if base_cents is None:
+            return None
+
+        vendor = receipt.get('vendor') or receipt.get('merchantName') or ''
+        return {
+            'id': str(receipt['id']),
+            'day': day,
+            'cents': cents,
+            'currency': currency,
+            'base_cents': base_cents,
+            'vendor': vendor,
+            'tokens': vendor_tokens(vendor)
+        }
+
+    def candidates(self, transaction):
+        """
+        Score receipts near a transaction. Returns [(score, receipt index)],
+        best first, limited to scores of at least REVIEW_THRESHOLD.
+        """
+        base_cents = _base_cents(transaction['amount_cents'], transaction['currency'])
+        if base_cents is None:
+            return []
+        day = transaction['day']
+        cents = transaction['amount_cents']
+        currency = transaction['currency']
+        tokens = vendor_tokens(transaction['merchantName'])
+        vendor_key = self._rarest_vendor_key(tokens)
+
+        found = set()
+        for postings in self._amount_postings(cents, currency):
+            days, indexes = postings
+            low = bisect.bisect_left(days, day - DAYS_BEFORE)
+            high = bisect.bisect_right(days, day + DAYS_AFTER)
+            found.update(indexes[low:high])
+
+        if vendor_key is not None:
+            # Same-merchant receipts the charge could be a tipped version of
+            lowest = cents / (1 + TIP_TOLERANCE)
+            for candidate_day in range(day - DAYS_BEFORE, day + DAYS_AFTER + 1):
+                bucket = self._by_vendor_day.get((currency, vendor_key, candidate_day))
+                if bucket is not None:
+                    amounts, indexes = bucket
+                    low = bisect.bisect_left(amounts, lowest)
+                    high = bisect.bisect_left(amounts, cents)
+                    found.update(indexes[low:high])
+
+        scored = []
+        for index in found:
+            score = self.score(transaction, base_cents, tokens, self.receipts[index])
+            if score >= REVIEW_THRESHOLD:
+                scored.append((score, index))
+        scored.sort(reverse=True)
+        return scored
+
+    def _amount_postings(self, cents, currency):
+        """Day-sorted posting lists of receipts whose amount could match"""
+        postings = []
+        for offset in (-1, 0, 1):
+            entry = self._exact.get((currency, cents + offset))
+            if entry is not None:
+                postings.append(entry)
+
+        bands = self._bands_for(currency)
+        if bands:
+            band = _amount_band(cents)
+            for neighbour in (band - 1, band, band + 1):
+                entry = bands.get(neighbour)
+                if entry is not None:
+                    postings.append(entry)
+        return postings
+
+    def _bands_for(self, currency):
+        """
+        Amount-band index of the receipts in other currencies, converted to
+        currency. Built on first use; statements rarely mix currencies.
+        """
+        bands = self._cross_currency_bands.get(currency)
+        if bands is None:
+            rates = {}
+            entries = {}
+            for index, receipt in enumerate(self.receipts):
+                if receipt['currency'] == currency:
+                    continue
+                if receipt['currency'] not in rates:
+                    multiplier = fx_rates.rate(receipt['currency'], currency)
+                    rates[receipt['currency']] = None if multiplier is None else float(multiplier)
+                multiplier = rates[receipt['currency']]
+                if multiplier is not None:
+                    band = _amount_band(receipt['cents'] * multiplier)
+                    entries.setdefault(band, []).append((receipt['day'], index))
+            bands = self._cross_currency_bands[currency] = _day_sorted(entries)
+        return bands
+
+    def _rarest_vendor_key(self, tokens):
+        counts = [(self._vendor_key_counts.get(key, 0), key) for key in _vendor_keys(tokens)]
+        counts = [(count, key) for count, key in counts if count]
+        if not counts:
+            return None
+        count, key = min(counts)
+        return key if count <= self._max_vendor_key_count else None
+
+    @staticmethod
+    def score(transaction, base_cents, tokens, receipt):
+        """Weighted amount/date/vendor agreement between 0 and 1"""
+        if receipt['currency'] == transaction['currency']:
+            difference = abs(receipt['cents'] - transaction['amount_cents'])
+            if difference <= 1:
+                amount_score = 1.0
+            elif receipt['cents'] < transaction['amount_cents'] <= receipt['cents'] * (1 + TIP_TOLERANCE):
+                amount_score = TIP_AMOUNT_SCORE
+            else:
+                amount_score = 0.0
+        else:
+            relative = abs(receipt['base_cents'] - base_cents) / max(base_cents, 1)
+            amount_score = 0.1 + 0.9 * (1 - relative / FX_AMOUNT_TOLERANCE) if relative <= FX_AMOUNT_TOLERANCE else 0.0
+
+        if not amount_score:
+            # Date and vendor alone top out below REVIEW_THRESHOLD
+            return 0.0
+        date_score = 1 - abs(receipt['day'] - transaction['day']) / (DAYS_BEFORE + 1)
+        vendor_score = vendor_similarity(tokens, receipt['tokens'])
+        return round(AMOUNT_WEIGHT * amount_score + DATE_WEIGHT * date_score + VENDOR_WEIGHT * vendor_score, 4)
+
+def reconcile(transactions, receipts):
+    """
+    Match card transactions (an iterable, e.g. iter_statement) to receipts.
+
+    Only charges are matched; credits (negative amount_cents: payments,
+    refunds) are listed separately. Candidates are scored while the statement streams in; matches are then
+    assigned one-to-one, best score first. A transaction is matched when its
+    best score reaches MATCH_THRESHOLD and no other unclaimed candidate (for
+    the transaction or the receipt) is within TIE_MARGIN; otherwise it goes
+    to the review queue with its top candidates.
+    """
+    matcher = receipts if isinstance(receipts, ReceiptMatcher) else ReceiptMatcher(receipts)
+    kept = []
+    candidates = []
+    credits = []
+    errors = []
+
+    for transaction in transactions:
+        if 'error' in transaction:
+            errors.append(transaction['error'])
+            continue
+        if transaction['amount_cents'] < 0:
+            credits.append(transaction)
+            continue
+        kept.append(transaction)
+        candidates.append(matcher.candidates(transaction))
+
+    # Receipt -> [(score, transaction index)] for receipt-side ties
+    claims = {}
+    edges = []
+    for position, scored in enumerate(candidates):
+        for score, index in scored:
+            claims.setdefault(index, []).append((score, position))
+            edges.append((score, position, index))
+    edges.sort(key=lambda edge: -edge[0])
+
+    matched_transactions = {}
+    claimed_receipts = set()
+    review = set()
+
+    for score, position, index in edges:
+        if position in matched_transactions or position in review or index in claimed_receipts:
+            continue
+        if score < MATCH_THRESHOLD:
+            review.add(position)
+            continue
+        tied = any(
+            other_index != index and other_index not in claimed_receipts and other_score >= score - TIE_MARGIN
+            for other_score, other_index in candidates[position]
+        ) or any(
+            other_position != position and other_position not in matched_transactions
+            and other_score >= score - TIE_MARGIN
+            for other_score, other_position in claims[index]
+        )
+        if tied:
+            review.add(position)
+            continue
+        matched_transactions[position] = (score, index)
+        claimed_receipts.add(index)
+
+    def transaction_summary(transaction):
+        return {
+            'id': transaction['id'],
+            'date': _day_iso(transaction['day']),
+            'merchantName': transaction['merchantName'],
+            'amount': transaction['amount_cents'] / 100,
+            'currency': transaction['currency'],
+            'cardNumber': transaction['cardNumber']
+        }
+
+    def receipt_summary(score, index):
+        receipt = matcher.receipts[index]
+        return {
+            'receiptId': receipt['id'],
+            'date': _day_iso(receipt['day']),
+            'vendor': receipt['vendor'],
+            'amount': receipt['cents'] / 100,
+            'currency': receipt['currency'],
+            'score': score
+        }
+
+    matches = []
+    review_queue = []
+    unmatched = []
+    for position, transaction in enumerate(kept):
+        if position in matched_transactions:
+            matches.append(dict(transaction_summary(transaction), match=receipt_summary(*matched_transactions[position])))
+        elif position in review:
+            open_candidates = [
+                receipt_summary(score, index) for score, index in candidates[position]
+                if index not in claimed_receipts
+            ][:REVIEW_CANDIDATES]
+            if open_candidates:
+                review_queue.append(dict(transaction_summary(transaction), candidates=open_candidates))
+            else:
+                unmatched.append(transaction_summary(transaction))
+        else:
+            unmatched.append(transaction_summary(transaction))
+
+    return {
+        'matched': matches,
+        'review': review_queue,
+        'unmatched': unmatched,
+        'credits': [transaction_summary(transaction) for transaction in credits],
+        'summary': {
+            'transactions': len(kept) + len(credits),
+            'receipts': len(matcher),
+            'matched': len(matches),
+            'review': len(review_queue),
+            'unmatched': len(unmatched),
+            'credits': len(credits),
+            'unmatchedReceipts': len(matcher) - len(claimed_receipts),
+            'skippedRows': len(errors),
+            'skippedReceipts': matcher.skipped
+        },
+        'errors': errors[:20]
+    }
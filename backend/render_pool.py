@@ -0,0 +1,135 @@
+import contextvars
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+# CPU-bound page work (rasterising, analysis, JPEG and base64 encoding) runs
+# in a pool of worker processes so concurrent pages aren't serialised on the
+# GIL. Large results come back through shared memory rather than pickles.
+RENDER_POOL_ENABLED = os.getenv('RENDER_POOL_ENABLED', 'True').lower() == 'true'
+RENDER_POOL_WORKERS = int(os.getenv('RENDER_POOL_WORKERS', 0)) or os.cpu_count() or 1
+
+# Modules imported once by the fork server, so workers start with them loaded
+PRELOAD_MODULES = ['expensereportextractor']
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Set while a request is profiled, so its page work runs in the request's
+# own threads where the profiler can see it
+_inline = contextvars.ContextVar('render_pool_inline', default=False)
+
+def run_inline():
+    """Run this context's (and copies of it) pool work inline; returns a token for reset_inline"""
+    return _inline.set(True)
+
+def reset_inline(token):
+    _inline.reset(token)
+
+def get_executor():
+    """Return the process-wide worker pool, or None when disabled"""
+    global _executor
+    if not RENDER_POOL_ENABLED:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # Workers are forked from a single-threaded fork server rather
+            # than from the (threaded) web server process
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(PRELOAD_MODULES)
+            else:
+                context = multiprocessing.get_context('spawn')
+            _executor = ProcessPoolExecutor(max_workers=RENDER_POOL_WORKERS, mp_context=context)
+        return _executor
+
+def submit(function, *args):
+    """
+    Run function(*args) in the pool and return a Future. function must be
+    importable by workers (a module-level function). Without a pool, or if
+    the pool has broken, or in a context set by run_inline, it runs inline.
+    """
+    global _executor
+    executor = None if _inline.get() else get_executor()
+    if executor is not None:
+        try:
+            return executor.submit(function, *args)
+        except BrokenProcessPool as e:
+            logging.error(f"Render pool broken, restarting it: {str(e)}")
+            with _executor_lock:
+                if _executor is executor:
+                    _executor = None
+
+    future = Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def map_ordered(function, argument_lists, window=None, discard=None):
+    """
+    Yield function(*arguments) for each item of argument_lists, in order,
+    keeping at most window calls submitted ahead of the consumer so memory
+    stays bounded. If the consumer stops early, the results of calls already
+    submitted are passed to discard (e.g. to free their shared memory).
+    """
+    window = window or 2 * RENDER_POOL_WORKERS
+    arguments = iter(argument_lists)
+    pending = deque(submit(function, *args) for args in itertools.islice(arguments, window))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for args in itertools.islice(arguments, 1):
+                pending.append(submit(function, *args))
+            yield result
+    finally:
+        for future in pending:
+            if future.cancel() or discard is None:
+                continue
+            try:
+                discard(future.result())
+            except Exception:
+                pass
+
+def share(*buffers):
+    """
+    Copy buffers into one new shared memory block and return a descriptor
+    (name, lengths) to pass to take() in another process. The block lives
+    until take() or discard() unlinks it.
+    """
+    lengths = [len(buffer) for buffer in buffers]
+    block = shared_memory.SharedMemory(create=True, size=max(1, sum(lengths)))
+    offset = 0
+    for buffer, length in zip(buffers, lengths):
+        block.buf[offset:offset + length] = buffer
+        offset += length
+    block.close()
+    return block.name, lengths
+
+def take(descriptor):
+    """Read the buffers of a share() descriptor as bytes and free the block"""
+    name, lengths = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        buffers = []
+        offset = 0
+        for length in lengths:
+            buffers.append(bytes(block.buf[offset:offset + length]))
+            offset += length
+        return buffers
+    finally:
+        block.close()
+        block.unlink()
+
+def discard(descriptor):
+    """Free a share() block without reading it"""
+    block = shared_memory.SharedMemory(name=descriptor[0])
+    block.close()
+    block.unlink()
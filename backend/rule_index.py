@@ -0,0 +1,266 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+# Relevance-ranked rule retrieval for compliance checks. After the metadata
+# filter, a large set of applicable rules is narrowed to the TOP_K rules
+# whose text best matches the invoice (BM25 over an inverted index of rule
+# text), plus the rules that are always sent: rules scoped specifically to
+# the invoice's country, seniority or expense type, timeframe rules (the
+# prompt always checks the expense date) and rules flagged mandatory.
+RULE_RETRIEVAL_ENABLED = os.getenv('RULE_RETRIEVAL_ENABLED', 'True').lower() == 'true'
+TOP_K = int(os.getenv('RULE_RETRIEVAL_TOP_K', 50))
+# Smaller rule sets are sent whole
+MIN_RULES = int(os.getenv('RULE_RETRIEVAL_MIN_RULES', 40))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Indexes kept, one per policy set version. A tenant's new version is built
+# from its previous index, adding and removing only the rules that changed.
+MAX_INDEXES = 64
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have if in into is it its of on or per than that the their "
+    "them then there these they this to was were will with within must should may can not no any all "
+    "each every only been being".split()
+)
+
+# Terms added to the query for an expense type, so a "meals" invoice finds
+# rules about restaurants or dinners
+EXPENSE_TYPE_TERMS = {
+    'meals': 'meal food restaurant lunch dinner breakfast catering drink beverage alcohol tip',
+    'transportation': 'travel taxi cab ride train rail flight airfare car rental mileage fuel parking toll',
+    'accommodation': 'hotel lodging room night stay airbnb',
+    'entertainment': 'client entertainment event ticket gift guest alcohol',
+    'mobile': 'phone mobile cellular data roaming',
+    'office_supplies': 'office supplies stationery equipment',
+    'software': 'software license subscription saas',
+    'hardware': 'hardware equipment computer laptop device',
+    'conferences': 'conference event registration ticket travel',
+    'training': 'training course certification tuition',
+}
+
+# Stand-ins for an amount and for a group of people, so rules with monetary
+# limits or per person/attendee conditions match any invoice with those
+AMOUNT_TERM = '_amount_'
+PEOPLE_TERM = '_people_'
+
+_AMOUNT = re.compile(r'[$€£¥]\s*\d[\d,.]*|\d[\d,.]*\s*(?:usd|eur|gbp|jpy|cad|aud|inr|chf|sgd|dollars?|euros?|pounds?)\b')
+_PEOPLE = re.compile(r'\b(?:per person|per head|attendees?|guests?|participants?|each person)\b')
+_TIMEFRAME = re.compile(r'\b(?:within|older than|after|before|no later than)\s+\d+\s+(?:days?|weeks?|months?)\b'
+                        r'|\b\d+\s+(?:days?|weeks?|months?)\s+(?:of|after|from)\b')
+_WORD = re.compile(r'[a-z][a-z0-9]*')
+
+def _stem(word):
+    """A light suffix stripper, enough to match plurals, simple verb forms and alcohol/alcoholic"""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('sses', 'shes', 'ches', 'xes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    if len(word) > 5 and word.endswith('ing'):
+        return word[:-3]
+    if len(word) > 4 and word.endswith('ed'):
+        return word[:-2]
+    if len(word) > 6 and word.endswith('ic'):
+        return word[:-2]
+    return word
+
+def tokenize(text):
+    """Index terms of a text: stemmed words without stopwords, plus the amount and people markers"""
+    text = text.lower()
+    terms = [_stem(word) for word in _WORD.findall(text) if word not in STOPWORDS]
+    if _AMOUNT.search(text):
+        terms.append(AMOUNT_TERM)
+    if _PEOPLE.search(text):
+        terms.append(PEOPLE_TERM)
+    return terms
+
+def rule_key(rule):
+    """Identity of a rule within a policy set: its text and scope"""
+    scope = [str(rule.get(field) or '').lower() for field in ('country', 'seniority', 'expenseType')]
+    return hashlib.sha1(json.dumps([str(rule.get('rule', ''))] + scope).encode()).hexdigest()
+
+def policy_set_version(rules):
+    """Version of a policy set, independent of rule order"""
+    return hashlib.sha1(''.join(sorted(rule_key(rule) for rule in rules)).encode()).hexdigest()[:16]
+
+def is_mandatory(rule):
+    """Rules sent whenever they apply, whatever their relevance score"""
+    if rule.get('mandatory'):
+        return True
+    if (str(rule.get('country') or 'global').lower() != 'global'
+            or str(rule.get('seniority') or 'all').lower() != 'all'
+            or str(rule.get('expenseType') or 'all').lower() != 'all'):
+        return True
+    return bool(_TIMEFRAME.search(str(rule.get('rule', '')).lower()))
+
+def invoice_query(extraction_results):
+    """Query terms for an invoice: vendor, expense type, items, amounts, currency and party size"""
+    parts = [str(extraction_results.get(key) or '') for key in ('vendor', 'expenseType', 'currency')]
+    parts.append(EXPENSE_TYPE_TERMS.get(str(extraction_results.get('expenseType') or '').lower().replace(' ', '_'), ''))
+    for item in extraction_results.get('items') or []:
+        parts.append(str(item.get('description') or ''))
+    terms = tokenize(' '.join(parts))
+    if extraction_results.get('total') not in (None, '') or any(item.get('amount') for item in extraction_results.get('items') or []):
+        terms.append(AMOUNT_TERM)
+    try:
+        if int(extraction_results.get('numberOfPeople') or 1) > 1:
+            terms.append(PEOPLE_TERM)
+    except (TypeError, ValueError):
+        pass
+    return terms
+
+class RuleIndex:
+    """
+    BM25 inverted index over rule text. Rules are added and removed
+    individually, so a changed policy set is synced rather than rebuilt.
+    An index is not changed once it is in use (see get_index).
+    """
+
+    def __init__(self):
+        self.version = None
+        self.rules = {}            # key -> rule
+        self._lengths = {}         # key -> number of terms
+        self._postings = {}        # term -> {key: term frequency}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, rule):
+        key = rule_key(rule)
+        if key in self.rules:
+            return
+        terms = Counter(tokenize(str(rule.get('rule', ''))))
+        self.rules[key] = rule
+        self._lengths[key] = sum(terms.values())
+        self._total_length += self._lengths[key]
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[key] = frequency
+
+    def remove(self, key):
+        rule = self.rules.pop(key, None)
+        if rule is None:
+            return
+        self._total_length -= self._lengths.pop(key)
+        for term in set(tokenize(str(rule.get('rule', '')))):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def copy(self):
+        index = RuleIndex()
+        with self._lock:
+            index.version = self.version
+            index.rules = dict(self.rules)
+            index._lengths = dict(self._lengths)
+            index._postings = {term: dict(postings) for term, postings in self._postings.items()}
+            index._total_length = self._total_length
+        return index
+
+    def sync(self, rules, version=None):
+        """
+        Bring the index to this policy set, adding and removing only the
+        rules that changed. Returns (added, removed) counts.
+        """
+        with self._lock:
+            version = version or policy_set_version(rules)
+            if version == self.version:
+                return 0, 0
+            wanted = {rule_key(rule): rule for rule in rules}
+            stale = [key for key in self.rules if key not in wanted]
+            for key in stale:
+                self.remove(key)
+            added = 0
+            for key, rule in wanted.items():
+                if key not in self.rules:
+                    self.add(rule)
+                    added += 1
+            self.version = version
+            return added, len(stale)
+
+    def scores(self, query_terms, keys=None):
+        """BM25 score of each indexed rule (or of keys) with at least one query term"""
+        with self._lock:
+            count = len(self.rules)
+            if not count:
+                return {}
+            average_length = self._total_length / count
+            scores = {}
+            for term, query_frequency in Counter(query_terms).items():
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, frequency in postings.items():
+                    if keys is not None and key not in keys:
+                        continue
+                    norm = frequency + K1 * (1 - B + B * self._lengths[key] / average_length)
+                    scores[key] = scores.get(key, 0.0) + query_frequency * idf * frequency * (K1 + 1) / norm
+            return scores
+
+_indexes = OrderedDict()   # policy set version -> RuleIndex
+_latest = {}               # tenant -> version of its last policy set
+_indexes_lock = threading.Lock()
+
+def get_index(tenant, rules):
+    """
+    The index of this policy set, built once per version. Concurrent checks
+    with different policy sets (even for one tenant) each get their own.
+    """
+    version = policy_set_version(rules)
+    with _indexes_lock:
+        index = _indexes.get(version)
+        if index is not None:
+            _indexes.move_to_end(version)
+            _latest[tenant] = version
+            return index
+        previous = _indexes.get(_latest.get(tenant))
+
+    # Built outside the lock from a copy of the tenant's previous index
+    index = previous.copy() if previous is not None else RuleIndex()
+    added, removed = index.sync(rules, version)
+    print(f"Rule index for {tenant}: {added} rules added, {removed} removed (version {version})")
+
+    with _indexes_lock:
+        index = _indexes.setdefault(version, index)
+        _indexes.move_to_end(version)
+        _latest[tenant] = version
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+        for stale in [name for name, latest in _latest.items() if latest not in _indexes]:
+            del _latest[stale]
+    return index
+
+def select_rules(policy_rules, applicable_rules, extraction_results, tenant, top_k=None):
+    """
+    Narrow the applicable rules to the mandatory ones plus the top_k
+    (default TOP_K) most relevant others, keeping their original order.
+    Rules are only dropped when more than top_k are candidates; slots the
+    scored rules leave free go to unscored ones in policy order. The index
+    covers the tenant's whole policy set, so relevance statistics don't
+    depend on the invoice's metadata filter.
+    """
+    top_k = TOP_K if top_k is None else top_k
+    if not RULE_RETRIEVAL_ENABLED or len(applicable_rules) < MIN_RULES:
+        return applicable_rules
+
+    keys = [rule_key(rule) for rule in applicable_rules]
+    candidates = list(dict.fromkeys(key for key, rule in zip(keys, applicable_rules) if not is_mandatory(rule)))
+    if len(candidates) <= top_k:
+        return applicable_rules
+
+    index = get_index(tenant, policy_rules)
+    scores = index.scores(invoice_query(extraction_results), set(candidates))
+    # Stable sort: equal (and zero) scores stay in policy order
+    chosen = set(sorted(candidates, key=lambda key: -scores.get(key, 0.0))[:top_k])
+    dropped = set(candidates) - chosen
+    return [rule for key, rule in zip(keys, applicable_rules) if key not in dropped]
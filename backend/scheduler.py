@@ -0,0 +1,265 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import metrics
+
+# Admission control for LLM-bound work. Requests are admitted per priority
+# class (interactive receipts > compliance checks > bulk policy extraction)
+# up to a per-class limit and fail fast with 429 beyond it; each LLM call
+# then waits for one of LLM_SLOTS, handed out by class priority and
+# round-robin between tenants within a class.
+INTERACTIVE, COMPLIANCE, BULK = 'interactive', 'compliance', 'bulk'
+PRIORITIES = [INTERACTIVE, COMPLIANCE, BULK]
+
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'True').lower() == 'true'
+LLM_SLOTS = int(os.getenv('SCHEDULER_LLM_SLOTS', 16))
+# Bulk calls may hold at most this share of the slots, so interactive calls
+# arriving behind a large document find one free without waiting
+BULK_MAX_SLOT_SHARE = float(os.getenv('SCHEDULER_BULK_MAX_SLOT_SHARE', 0.5))
+
+# Requests in flight per class, and the share of that one tenant may hold
+MAX_REQUESTS = {
+    INTERACTIVE: int(os.getenv('SCHEDULER_MAX_INTERACTIVE', 64)),
+    COMPLIANCE: int(os.getenv('SCHEDULER_MAX_COMPLIANCE', 32)),
+    BULK: int(os.getenv('SCHEDULER_MAX_BULK', 4)),
+}
+TENANT_MAX_SHARE = float(os.getenv('SCHEDULER_TENANT_MAX_SHARE', 0.5))
+
+# Longest an LLM call waits for a slot before its request is rejected;
+# calls of an admitted bulk document wait as long as it takes
+MAX_SLOT_WAIT = {INTERACTIVE: 30.0, COMPLIANCE: 60.0, BULK: None}
+
+# Retry-After used until a class has request durations to estimate from
+DEFAULT_RETRY_AFTER = {INTERACTIVE: 5, COMPLIANCE: 5, BULK: 60}
+
+DEFAULT_TENANT = 'default'
+
+_priority = contextvars.ContextVar('scheduler_priority', default=BULK)
+_tenant = contextvars.ContextVar('scheduler_tenant', default=DEFAULT_TENANT)
+
+def current_tenant():
+    """Tenant of the request being handled (DEFAULT_TENANT outside one)"""
+    return _tenant.get()
+
+class Overloaded(Exception):
+    """Raised when a class is at capacity; retry_after is in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ('priority', 'tenant', 'event', 'granted')
+
+    def __init__(self, priority, tenant):
+        self.priority = priority
+        self.tenant = tenant
+        self.event = threading.Event()
+        self.granted = False
+
+class Scheduler:
+    """
+    Priority classes with bounded admission and per-tenant fair LLM slots.
+    """
+
+    def __init__(self, slots=LLM_SLOTS, max_requests=None, tenant_max_share=TENANT_MAX_SHARE,
+                 bulk_max_slot_share=BULK_MAX_SLOT_SHARE):
+        self.slots = slots
+        self.max_requests = dict(max_requests or MAX_REQUESTS)
+        self.tenant_max_share = tenant_max_share
+        self.bulk_max_slots = max(1, int(slots * bulk_max_slot_share))
+        self._lock = threading.Lock()
+        self._free = slots
+        self._running = {priority: 0 for priority in PRIORITIES}
+        # Per class: tenant -> FIFO of waiters, in round-robin order
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._requests = {priority: 0 for priority in PRIORITIES}
+        self._tenant_requests = {priority: {} for priority in PRIORITIES}
+
+    def retry_after(self, priority):
+        """Seconds a rejected client should wait: about one median request of its class"""
+        if metrics.count('scheduler_request_seconds', priority=priority) < 10:
+            return DEFAULT_RETRY_AFTER[priority]
+        return max(1, math.ceil(metrics.percentile('scheduler_request_seconds', 50, priority=priority)))
+
+    @contextmanager
+    def admit(self, priority, tenant=DEFAULT_TENANT):
+        """
+        Admit one request of a class for a tenant, or raise Overloaded. LLM
+        calls made inside (on this thread, or threads run in a copy of its
+        context) are scheduled under that class and tenant.
+        """
+        capacity = self.max_requests[priority]
+        tenant_capacity = max(1, math.ceil(capacity * self.tenant_max_share))
+        with self._lock:
+            tenant_requests = self._tenant_requests[priority]
+            if self._requests[priority] >= capacity:
+                reason = 'class'
+            elif tenant_requests.get(tenant, 0) >= tenant_capacity:
+                reason = 'tenant'
+            else:
+                reason = None
+                self._requests[priority] += 1
+                tenant_requests[tenant] = tenant_requests.get(tenant, 0) + 1
+
+        if reason is not None:
+            metrics.increment('scheduler_rejected', priority=priority, reason=reason)
+            limit = f"{capacity} {priority} requests" if reason == 'class' else f"{tenant_capacity} {priority} requests per tenant"
+            raise Overloaded(f"Server busy: at most {limit} at a time", self.retry_after(priority))
+
+        metrics.increment('scheduler_admitted', priority=priority)
+        priority_token = _priority.set(priority)
+        tenant_token = _tenant.set(tenant)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            metrics.observe('scheduler_request_seconds', time.perf_counter() - start, priority=priority)
+            _priority.reset(priority_token)
+            _tenant.reset(tenant_token)
+            with self._lock:
+                self._requests[priority] -= 1
+                tenant_requests[tenant] -= 1
+                if not tenant_requests[tenant]:
+                    del tenant_requests[tenant]
+
+    def _next_waiter(self):
+        for priority in PRIORITIES:
+            if priority == BULK and self._running[BULK] >= self.bulk_max_slots:
+                continue
+            tenants = self._queues[priority]
+            if not tenants:
+                continue
+            tenant, waiters = next(iter(tenants.items()))
+            waiter = waiters.popleft()
+            # Round robin: the tenant goes to the back of its class
+            del tenants[tenant]
+            if waiters:
+                tenants[tenant] = waiters
+            return waiter
+        return None
+
+    def _dispatch(self):
+        while self._free > 0:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._free -= 1
+            self._running[waiter.priority] += 1
+            waiter.granted = True
+            waiter.event.set()
+
+    def _acquire(self, priority, tenant):
+        waiter = _Waiter(priority, tenant)
+        start = time.perf_counter()
+        with self._lock:
+            self._queues[priority].setdefault(tenant, deque()).append(waiter)
+            self._dispatch()
+
+        if not waiter.granted and not waiter.event.wait(MAX_SLOT_WAIT[priority]):
+            with self._lock:
+                if not waiter.granted:
+                    waiters = self._queues[priority].get(tenant)
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self._queues[priority][tenant]
+                    metrics.increment('scheduler_slot_timeouts', priority=priority)
+                    raise Overloaded(f"Server busy: no LLM capacity for {priority} work", self.retry_after(priority))
+
+        metrics.observe('scheduler_wait_seconds', time.perf_counter() - start, priority=priority)
+
+    def _release(self, priority):
+        with self._lock:
+            self._free += 1
+            self._running[priority] -= 1
+            self._dispatch()
+
+    def try_slot(self):
+        """
+        Take an LLM slot for the current request's class without waiting:
+        False when none is free or other calls are queued for one. A slot
+        taken is given back with release_slot.
+        """
+        priority = _priority.get()
+        with self._lock:
+            if (self._free <= 0 or any(self._queues[waiting] for waiting in PRIORITIES)
+                    or priority == BULK and self._running[BULK] >= self.bulk_max_slots):
+                return False
+            self._free -= 1
+            self._running[priority] += 1
+            return True
+
+    def release_slot(self):
+        """Give back a slot taken with try_slot (in the same request's context)"""
+        self._release(_priority.get())
+
+    @contextmanager
+    def slot(self):
+        """Hold one LLM slot for the current request's class and tenant"""
+        priority = _priority.get()
+        self._acquire(priority, _tenant.get())
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+    def status(self):
+        with self._lock:
+            return {
+                'slots': self.slots,
+                'freeSlots': self._free,
+                'classes': {
+                    priority: {
+                        'requests': self._requests[priority],
+                        'maxRequests': self.max_requests[priority],
+                        'runningCalls': self._running[priority],
+                        'waitingCalls': sum(len(waiters) for waiters in self._queues[priority].values()),
+                        'tenants': dict(self._tenant_requests[priority])
+                    }
+                    for priority in PRIORITIES
+                }
+            }
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Return the process-wide scheduler"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+@contextmanager
+def admit(priority, tenant=DEFAULT_TENANT):
+    """Admit a request on the shared scheduler (see Scheduler.admit)"""
+    if not SCHEDULER_ENABLED:
+        yield
+        return
+    with get_scheduler().admit(priority, tenant):
+        yield
+
+@contextmanager
+def slot():
+    """Hold an LLM slot on the shared scheduler (see Scheduler.slot)"""
+    if not SCHEDULER_ENABLED:
+        yield
+        return
+    with get_scheduler().slot():
+        yield
+
+def try_slot():
+    """Take an LLM slot on the shared scheduler if one is free (see Scheduler.try_slot)"""
+    if not SCHEDULER_ENABLED:
+        return True
+    return get_scheduler().try_slot()
+
+def release_slot():
+    """Give back a slot taken with try_slot"""
+    if SCHEDULER_ENABLED:
+        get_scheduler().release_slot()
@@ -0,0 +1,147 @@
+import contextvars
+import copy
+import hashlib
+import json
+import os
+import select
+import socket
+import ssl
+import threading
+import hedging
+import metrics
+
+# Single-flight coalescing: identical requests arriving while one is being
+# computed (double clicks, frontend retries after a timeout, several
+# reviewers opening the same report) wait for that computation and share
+# its result instead of each making their own LLM calls. The computation
+# runs in a thread of its own, so it outlives the request that started it
+# while other requests wait on it; once every waiting client has
+# disconnected, it is cancelled.
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'True').lower() == 'true'
+# Seconds between checks that a waiting request's client is still connected
+POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', 0.25))
+# Stream the LLM calls of a cancellable flight so cancelling it closes the
+# call in progress rather than only stopping before the next one. Streaming
+# needs the bedrock:InvokeModelWithResponseStream IAM permission on the
+# models used (as hedging does), so it is off unless granted.
+CANCEL_STREAMS = os.getenv('SINGLE_FLIGHT_CANCEL_STREAMS', 'False').lower() == 'true'
+
+# Cancellation token of the flight computing in this context
+_cancel = contextvars.ContextVar('single_flight_cancel', default=None)
+
+_flights = {}
+_lock = threading.Lock()
+
+class Disconnected(Exception):
+    """Raised in a waiting request whose client has gone away"""
+
+def key(kind, *parts):
+    """
+    Content hash identifying a request: bytes parts (e.g. an upload) are
+    hashed as they are, other parts as canonical JSON (sorted keys), so
+    payloads differing only in key order or whitespace coalesce
+    """
+    digest = hashlib.sha256(kind.encode())
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str).encode()
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return f"{kind}:{digest.hexdigest()}"
+
+def current_cancel():
+    """
+    Cancellation token (a hedging.CancelToken) of the flight computing in
+    this context, or None when there is none or it can't be cancelled
+    """
+    return _cancel.get()
+
+def socket_connected(sock):
+    """
+    Whether the client of a server socket is still connected, once its
+    request has been read: a closed connection reads as end of file
+    """
+    if isinstance(sock, ssl.SSLSocket):
+        # Can't peek below TLS; assume connected
+        return True
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return not readable or sock.recv(1, socket.MSG_PEEK) != b''
+    except (OSError, ValueError):
+        return False
+
+class Flight:
+    """One computation and the requests waiting for it"""
+
+    def __init__(self, kind, key, cancellable):
+        self.kind = kind
+        self.key = key
+        # Only a leader that can tell its client has gone ever stops
+        # waiting before the flight is done, so only then can it be cancelled
+        self.cancel = hedging.CancelToken() if cancellable else None
+        self.waiters = 0
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self, compute):
+        _cancel.set(self.cancel)
+        try:
+            self.result = compute()
+        except Exception as e:
+            self.error = e
+        finally:
+            with _lock:
+                if _flights.get(self.key) is self:
+                    del _flights[self.key]
+            self.done.set()
+
+def run(kind, key, compute, connected=None):
+    """
+    Return compute(), computed once for concurrent calls with the same key.
+
+    compute runs in a new thread (in a copy of the caller's context) and
+    the caller waits for it, calling connected() every POLL_INTERVAL
+    seconds if given; when it returns False the caller stops waiting with
+    Disconnected. When no caller is left waiting, the flight's cancellation
+    token (see current_cancel) is cancelled and the next identical request
+    starts a new flight. Exceptions raised by compute are raised in every
+    caller; callers that joined a flight get a copy of its result.
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return compute()
+
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight(kind, key, connected is not None)
+        flight.waiters += 1
+
+    if leader:
+        metrics.increment('single_flight_computations', kind=kind)
+        threading.Thread(target=contextvars.copy_context().run, args=(flight.run, compute),
+                         name=f"flight-{kind}", daemon=True).start()
+    else:
+        metrics.increment('single_flight_coalesced', kind=kind)
+        print(f"Coalesced a {kind} request with the one in flight ({flight.waiters} waiting)")
+
+    try:
+        while not flight.done.wait(POLL_INTERVAL if connected else None):
+            if not connected():
+                metrics.increment('single_flight_disconnects', kind=kind)
+                raise Disconnected(f"Client disconnected while waiting for {kind}")
+    finally:
+        with _lock:
+            flight.waiters -= 1
+            abandoned = not flight.waiters and not flight.done.is_set()
+            if abandoned and _flights.get(key) is flight:
+                del _flights[key]
+        if abandoned and flight.cancel is not None:
+            metrics.increment('single_flight_cancelled', kind=kind)
+            print(f"Cancelling {kind}: every waiting client disconnected")
+            flight.cancel.cancel()
+
+    if flight.error is not None:
+        raise flight.error
+    return flight.result if leader else copy.deepcopy(flight.result)
@@ -0,0 +1,128 @@
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+import bedrock_pool
+
+# Warm-up before the readiness check passes: import the modules requests
+# need, load the stores, resolve AWS credentials and open a connection to
+# every Bedrock endpoint, so the first request after a deploy doesn't pay
+# for it
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'False').lower() == 'true'
+# Send a 1-token request per model and endpoint to check the models answer
+WARMUP_VALIDATE_MODELS = os.getenv('WARMUP_VALIDATE_MODELS', 'True').lower() == 'true'
+# A failed step (credentials not yet mounted, Bedrock throttling) is
+# retried on the warm-up thread, after a delay doubling from
+# RETRY_DELAY up to MAX_RETRY_DELAY seconds, until it succeeds
+RETRY_DELAY = float(os.getenv('WARMUP_RETRY_DELAY', 2.0))
+MAX_RETRY_DELAY = float(os.getenv('WARMUP_MAX_RETRY_DELAY', 60.0))
+
+HEAVY_MODULES = ['expensereportextractor', 'expense_store', 'requests']
+
+_lock = threading.Lock()
+_state = {'status': 'cold', 'steps': {}, 'models': {}, 'error': None, 'retries': 0}
+
+def _step(name, function):
+    start = time.perf_counter()
+    result = function()
+    with _lock:
+        _state['steps'][name] = round(time.perf_counter() - start, 3)
+    return result
+
+def _import_modules():
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+def _load_stores():
+    import expense_store
+    import receipt_index
+    expense_store.get_store()
+    receipt_index.get_index()
+
+def _connect_endpoints():
+    """Create each endpoint's client and resolve the credentials it signs with"""
+    for endpoint in bedrock_pool.get_pool().endpoints:
+        endpoint.client
+        credentials = endpoint.session.get_credentials()
+        if credentials is None or credentials.get_frozen_credentials().access_key is None:
+            raise RuntimeError(f"No AWS credentials for Bedrock endpoint {endpoint.name}")
+
+def _validate_models():
+    """
+    Send a minimal request for each model to each endpoint. This also opens
+    the pooled connection the first real request will reuse.
+    """
+    from botocore.exceptions import ClientError
+    import llm_utils
+
+    request = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": "ping"}]}]
+    })
+    model_ids = list(llm_utils.SONNET_MODEL_IDS)
+    if llm_utils.MODEL_TIERING_ENABLED:
+        model_ids.insert(0, llm_utils.FAST_MODEL_ID)
+    models = {}
+    for endpoint in bedrock_pool.get_pool().endpoints:
+        for model_id in model_ids:
+            try:
+                llm_utils._invoke(endpoint.client, model_id, request)
+                available = True
+            except ClientError as e:
+                logging.error(f"Warm-up: {model_id} unavailable on {endpoint.name}: {e}")
+                available = False
+            models.setdefault(model_id, {})[endpoint.name] = available
+    with _lock:
+        _state['models'] = models
+
+    if not any(any(by_endpoint.values()) for by_endpoint in models.values()):
+        raise RuntimeError("No Claude model answered on any Bedrock endpoint")
+
+def warm_up():
+    """
+    Run every warm-up step, retrying a failed one with backoff (steps that
+    succeeded are not repeated); the state is 'retrying' while waiting to
+    retry and ends 'ready'
+    """
+    with _lock:
+        _state['status'] = 'warming'
+    start = time.perf_counter()
+    steps = [('imports', _import_modules), ('stores', _load_stores), ('credentials', _connect_endpoints)]
+    if WARMUP_VALIDATE_MODELS:
+        steps.append(('models', _validate_models))
+
+    delay = RETRY_DELAY
+    for name, function in steps:
+        while True:
+            try:
+                _step(name, function)
+                break
+            except Exception as e:
+                logging.error(f"Warm-up step {name} failed: {str(e)}. Retrying in {delay:.0f}s")
+                with _lock:
+                    _state['status'] = 'retrying'
+                    _state['error'] = f"{name}: {str(e)}"
+                    _state['retries'] += 1
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                with _lock:
+                    _state['status'] = 'warming'
+
+    with _lock:
+        _state['status'] = 'ready'
+        _state['error'] = None
+    print(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+def start():
+    """Run warm_up on a background thread so the server can bind meanwhile"""
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+def is_ready():
+    return not WARMUP_ENABLED or _state['status'] == 'ready'
+
+def status():
+    with _lock:
+        return dict(_state, steps=dict(_state['steps']), models=dict(_state['models']))